@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import threading
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Set
+
+
+class SwapBuffer:
+    """Double-buffered container: writers add to the active buffer while a flusher
+    atomically swaps in an empty one and takes the full one away to process.
+
+    The lock is only ever held for a single add or a pointer swap, so writers never wait on a flush,
+        and anything written mid-flush simply lands in the next batch instead of getting lost.
+    """
+
+    def __init__(self, factory: Callable[[], Any]):
+        """
+        Args:
+            factory: callable, makes a new empty buffer (e.g., set or dict)
+        """
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._active = factory()
+
+    def __len__(self) -> int:
+        return len(self._active)
+
+    def __contains__(self, item: Hashable) -> bool:
+        return item in self._active
+
+    def swap(self):
+        """Takes the current buffer, leaving an empty one in its place"""
+        new = self._factory()
+        with self._lock:
+            old, self._active = self._active, new
+        return old
+
+    def snapshot(self):
+        """Returns a copy of the current buffer without taking it"""
+        with self._lock:
+            return self._factory() if len(self._active) == 0 else self._active.copy()
+
+
+class SetAccumulator(SwapBuffer):
+    """Double-buffered set"""
+
+    def __init__(self, items: Optional[Iterable[Hashable]] = None):
+        super().__init__(set)
+        if items is not None:
+            self._active.update(items)
+
+    def add(self, item: Hashable):
+        with self._lock:
+            self._active.add(item)
+
+    def swap(self) -> Set[Hashable]:
+        return super().swap()
+
+    def requeue(self, items: Iterable[Hashable]):
+        """Puts back items from a batch that couldn't be processed"""
+        with self._lock:
+            self._active.update(items)
+
+
+class DictAccumulator(SwapBuffer):
+    """Double-buffered dict. When a key's written again before a flush, `merge` decides what's kept"""
+
+    def __init__(self, merge: Optional[Callable[[Any, Any], Any]] = None, items: Optional[Dict] = None):
+        """
+        Args:
+            merge: callable, takes in the existing and the new value for a key and returns the value to keep.
+                Defaults to keeping the new value.
+            items: dict, initial contents
+        """
+        super().__init__(dict)
+        self.merge = merge
+        if items is not None:
+            self._active.update(items)
+
+    def __setitem__(self, key: Hashable, value: Any):
+        self.put(key, value)
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            if self.merge is not None and key in self._active:
+                value = self.merge(self._active[key], value)
+            self._active[key] = value
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            return self._active.pop(key, default)
+
+    def swap(self) -> Dict[Hashable, Any]:
+        return super().swap()
+
+    def requeue(self, items: Dict[Hashable, Any]):
+        """Puts back items from a batch that couldn't be processed, ahead of anything written since"""
+        with self._lock:
+            for key, value in items.items():
+                if key in self._active:
+                    newer = self._active[key]
+                    self._active[key] = newer if self.merge is None else self.merge(value, newer)
+                else:
+                    self._active[key] = value
@@ -1,12 +1,24 @@
 import os
+import hmac
 import json
 import signal
-import requests
+import time
+import threading
+from concurrent.futures import Future
 from datetime import datetime
-from random import randint
-from flask import Flask, request, make_response
+from typing import Callable, List, Optional
+from flask import Flask, request, make_response, Response, stream_with_context
 from slacktools import SlackEventAdapter
 from .utils import Sasha
+from .batch import BATCH_OPERATIONS, BadBatchRequest, parse_batch_request
+from .context import deadline_scope
+from .digest import DigestBuilder, pack_lines
+from .executor import KeyQueueFull, KeyedExecutor, conversation_key
+from .logs import event_scope
+from .metrics import metrics
+from .scheduler import Scheduler
+from .responder import response_body
+from .work import COSMETIC, MODERATION, WorkShed
 
 
 bot_name = 'sasha'
@@ -17,6 +29,12 @@ key_dict = {}
 for t in ['SIGNING_SECRET', 'XOXB_TOKEN', 'XOXP_TOKEN', 'VERIFY_TOKEN', 'ONBOARDING_KEY', 'SPREADSHEET_KEY']:
     with open(os.path.join(key_path, f'{bot_name.upper()}_SLACK_{t}')) as f:
         key_dict[t.lower()] = f.read().strip()
+# Optional keys - features depending on these are disabled when they're missing
+for t in ['API_TOKEN']:
+    fpath = os.path.join(key_path, f'{bot_name.upper()}_SLACK_{t}')
+    if os.path.exists(fpath):
+        with open(fpath) as f:
+            key_dict[t.lower()] = f.read().strip()
 
 Bot = Sasha(bot_name, key_dict['xoxb_token'], key_dict['xoxp_token'],
              ss_key=key_dict['spreadsheet_key'], onboarding_key=key_dict['onboarding_key'], debug=DEBUG)
@@ -28,40 +46,94 @@ signal.signal(signal.SIGTERM, Bot.cleanup)
 message_events = []
 emoji_events = []
 user_events = []
-action_timestamps = []
+action_timestamps = {}  # block_id, time handled
+action_timestamps_lock = threading.Lock()
 message_limits = {}  # date, count
-users_list = Bot.st.get_channel_members('CLWCPQ2TV')  # get users in general
+message_limits_lock = threading.Lock()
+users_list = []  # users in general, fetched at startup
+# Seconds a user should have to wait, at most, for a response to a command
+COMMAND_BUDGET = 10
+# Limits for the bulk language API
+BATCH_MAX_WORDS = 5000
+BATCH_MAX_WORKERS = 8
+batch_slots = threading.BoundedSemaphore(2)  # Number of batch requests processed at once
+# Handles commands in the background. Replies in a channel (or thread) go out in the order the commands came in,
+#   while different channels are handled in parallel
+#   Runs on the bot's WorkScheduler, ahead of everything else there
+handlers = KeyedExecutor('handlers', pool=Bot.work, max_queue=20)
+# Background jobs (seconds). Digests are checked every `interval` and sent once nothing new has come in
+#   for `min_delay`, or `max_delay` after the first item came in, whichever's sooner.
+JOB_SCHEDULE = {
+    'new_emojis': {'interval': 30, 'min_delay': 120, 'max_delay': 600},
+    'profile_update': {'interval': 30, 'min_delay': 120, 'max_delay': 600},
+    'reactions': {'interval': 1.5},
+    'checkpoint': {'interval': 60},
+    'image_pool': {'interval': 20},
+    'emoji_refresh': {'interval': 60 * 60},
+}
+# What users see when they reach for Sasha before the startup's connected to Slack
+NOT_READY_MSG = "I'm still waking up - try again in a few seconds!"
+# What users see when their slash command gets turned away because there's too much going on
+BUSY_MSG = "I'm swamped right now :sweat_smile: - try again in a minute!"
+# What users see while their slash command is being worked on (None for nothing)
+SLASH_ACK_TEXT = 'Working on it... :hourglass_flowing_sand:'
 app = Flask(__name__)
 
 # Events API listener
 bot_events = SlackEventAdapter(key_dict['signing_secret'], "/sasha/vikapi/events", app)
 
 
+def run_with_budget(func: Callable, *args, started_at: Optional[float] = None):
+    """Runs a command handler with the time a user should have to wait for it, at most"""
+    with deadline_scope(COMMAND_BUDGET, started_at=started_at):
+        return func(*args)
+
+
 @app.route('/sasha/vikapi/slash', methods=['GET', 'POST'])
 def handle_slash():
     """Handles a slash command"""
-    event_data = request.form
-    # Handle the command
-    Bot.st.parse_slash_command(event_data)
+    event_data = request.form.to_dict()
+    if not Bot.startup.ready.is_set():
+        return make_response(NOT_READY_MSG, 200)
+    # Handle the command in the background, in order with other work in the channel.
+    #   The result goes to the command's response url
+    future = handlers.submit(event_data.get('channel_id', ''), run_with_budget, Bot.handle_slash_command, event_data)
+    future.add_done_callback(lambda f: reply_if_turned_away(f, event_data.get('response_url')))
 
-    # Send HTTP 200 response with an empty body so Slack knows we're done
-    return make_response('', 200)
+    # Acknowledge right away, so Slack doesn't time out on us
+    if SLASH_ACK_TEXT is None:
+        return make_response('', 200)
+    return make_response(json.dumps({'response_type': 'ephemeral', 'text': SLASH_ACK_TEXT}), 200,
+                         {'Content-Type': 'application/json'})
+
+
+def reply_if_turned_away(future: Future, response_url: Optional[str]):
+    """Lets the user know their slash command won't be run because we're too busy"""
+    if response_url is None or future.cancelled() or not isinstance(future.exception(), (KeyQueueFull, WorkShed)):
+        return
+    Bot.responder.respond_urgently(response_url, response_body(BUSY_MSG, 'ephemeral'))
 
 
 @app.route('/sasha/vikapi/actions', methods=['GET', 'POST'])
 def handle_action():
     """Handle a response when a user clicks a button from Wizzy in Slack"""
     event_data = json.loads(request.form["payload"])
+    if not Bot.startup.ready.is_set():
+        return make_response(NOT_READY_MSG, 200)
     user = event_data['user']['id']
     channel = event_data['channel']['id']
     actions = event_data['actions']
     # Not sure if we'll ever receive more than one action?
     action = actions[0]
 
-    # Send that info onwards to determine how to deal with it
-    if action['block_id'] not in action_timestamps:
-        Bot.process_incoming_action(user, channel, action)
-        action_timestamps.append(action['block_id'])
+    # Turn the action into a command and run it in the background (only once, even if Slack retries)
+    # Slack's retries can come in at the same time as the original
+    with action_timestamps_lock:
+        is_new = action['block_id'] not in action_timestamps
+        if is_new:
+            action_timestamps[action['block_id']] = time.time()
+    if is_new:
+        handlers.submit(channel, run_with_budget, Bot.handle_action, user, channel, action)
     # Respond to the initial message and update it
     update_dict = {
         'replace_original': True,
@@ -69,113 +141,251 @@ def handle_action():
     }
     if event_data['container']['is_ephemeral']:
         update_dict['response_type'] = 'ephemeral'
-    resp = requests.post(event_data['response_url'], json=update_dict,
-                         headers={'Content-Type': 'application/json'})
+    Bot.responder.respond(event_data['response_url'], update_dict, key=action['block_id'])
 
     # Send HTTP 200 response with an empty body so Slack knows we're done
     return make_response('', 200)
 
 
-@app.route("/sasha/cron/new_emojis", methods=['POST'])
-def handle_cron_new_emojis():
-    """Check for newly uploaded emojis (triggered by cron task that sends POST req every 10 mins)"""
-    # Check emojis uploaded (every 10 mins)
-    if len(Bot.new_emoji_set) > 0:
-        # Go about notifying channel of newly uploaded emojis
-        emojis = [f':{x}:' for x in list(Bot.new_emoji_set)]
-        emoji_str = ''
-        for i in range(0, len(emojis), 10):
-            emoji_str += f"{''.join(emojis[i:i + 10])}\n"
+def is_api_authorized() -> bool:
+    """Checks the request's bearer token against the API token"""
+    api_token = key_dict.get('api_token')
+    if api_token is None:
+        return False
+    auth = request.headers.get('Authorization', '')
+    if not auth.startswith('Bearer '):
+        return False
+    return hmac.compare_digest(auth[len('Bearer '):].strip(), api_token)
+
+
+@app.route('/sasha/api/lingua/batch', methods=['POST'])
+def handle_lingua_batch():
+    """Lemmatizes / translates / finds examples for a list of words,
+    streaming back one NDJSON line per word as each lookup finishes
+
+    Expects a JSON body like {"operation": "translate-en", "words": ["koer", "kassid"], "workers": 4}
+    """
+    if not is_api_authorized():
+        return make_response(json.dumps({'error': 'unauthorized'}), 401)
+    try:
+        # Checked before the language tools get loaded, so bad requests don't load them
+        operation, words, workers = parse_batch_request(request.get_json(silent=True), BATCH_OPERATIONS,
+                                                        BATCH_MAX_WORDS, BATCH_MAX_WORKERS)
+    except BadBatchRequest as e:
+        return make_response(json.dumps({'error': str(e)}), e.status)
+    if not batch_slots.acquire(blocking=False):
+        return make_response(json.dumps({'error': 'too many batch requests in progress'}), 429)
+
+    def generate():
+        for result in Bot.ling.batch_lookup(words, operation, max_workers=workers):
+            yield json.dumps(result, ensure_ascii=False) + '\n'
+
+    resp = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    # Free up the slot once the stream is done (or the client has gone away)
+    resp.call_on_close(batch_slots.release)
+    return resp
+
+
+@app.route('/sasha/ready', methods=['GET'])
+def handle_ready():
+    """Readiness check - 200 once Sasha can handle events, 503 before then"""
+    body = json.dumps({'ready': Bot.startup.ready.is_set(), 'stages': Bot.startup.status()})
+    return make_response(body, 200 if Bot.startup.ready.is_set() else 503, {'Content-Type': 'application/json'})
+
+
+@app.route('/sasha/api/metrics', methods=['GET'])
+def handle_metrics():
+    """Reports the bot's counters and gauges (e.g., circuit breaker states of external sites)"""
+    if not is_api_authorized():
+        return make_response(json.dumps({'error': 'unauthorized'}), 401)
+    return make_response(json.dumps(metrics.snapshot()), 200, {'Content-Type': 'application/json'})
+
+
+def flush_new_emojis():
+    """Notifies the emoji channel of newly uploaded emojis"""
+    # Take the pending emojis, leaving an empty dict for new ones to come in
+    seen_at = Bot.new_emojis.swap()
+    new_emojis = sorted(seen_at)
+    if len(new_emojis) == 0:
+        return
+    # Go about notifying channel of newly uploaded emojis, 10 per line
+    digest = DigestBuilder(header=[
+        Bot.bkb.make_context_section('Incoming emojis that were added recently!'),
+    ])
+    rows = [new_emojis[i:i + 10] for i in range(0, len(new_emojis), 10)]
+    lines = [(tuple(row), ''.join([f':{x}:' for x in row])) for row in rows]
+    for row_keys, text in pack_lines(lines):
+        digest.add_group([Bot.bkb.make_block_section(text)], keys=row_keys)
+    # Try again with the next batch if sending fails
+    Bot.send_digest(Bot.emoji_channel, digest.build(),
+                    on_failure=lambda keys: Bot.new_emojis.requeue({x: seen_at[x] for row in keys for x in row}))
+
+
+def flush_profile_updates():
+    """Notifies the general channel of recently updated profile elements"""
+    # Take the pending updates, leaving an empty dict for new ones to come in
+    user_updates = Bot.profile_diff.take()
+    if len(user_updates) == 0:
+        return
+    # we'll currently report on avatar, display name, name, title and status changes.
+    changes_txt = '*`{display_name}`*\t\t*`{real_name}`*\n:q:{title}:q:\n{status_emoji} {status_text}'
+    digest = DigestBuilder()
+    for uid, change_dict in user_updates.items():
         msg_block = [
-            Bot.bkb.make_context_section('Incoming emojis that were added in the last 10 min!'),
+            Bot.bkb.make_context_section(f'<@{uid}> changed their profile info recently!'),
+            Bot.bkb.make_block_divider()
         ]
-        Bot.st.send_message(Bot.emoji_channel, '', blocks=msg_block)
-        Bot.st.send_message(Bot.emoji_channel, emoji_str)
-        # Reset list of added emojis to an empty set
-        Bot.new_emoji_set = set()
+        # Process new/old data
+        for data in ['old', 'new']:
+            transition = 'from' if data == 'old' else 'to'
+            avi_url = change_dict[data]['avi']
+            avi_alt = f'{transition} pic'
+            msg_block += [
+                Bot.bkb.make_context_section(f'{transition} this...'),
+                Bot.bkb.make_block_section(changes_txt.format(**change_dict[data].to_dict()),
+                                           accessory=Bot.bkb.make_image_accessory(avi_url, avi_alt))
+            ]
+        digest.add_group(msg_block, key=uid)
 
+    def mark_reported(uids: List[str]):
+        # Make sure the current dict is then updated to reflect changes we've reported
+        for uid in uids:
+            Bot.users_dict[uid] = user_updates[uid]['new']
+
+    def requeue(uids: List[str]):
+        # Try again with the next batch
+        Bot.profile_diff.requeue({uid: user_updates[uid] for uid in uids})
+
+    Bot.send_digest(Bot.general_channel, digest.build(), on_failure=requeue, on_sent=mark_reported)
+
+
+def checkpoint_state():
+    """Saves the runtime state, so a restart doesn't lose pending digests or handle Slack's retries twice"""
+    # Forget actions old enough that they wouldn't get restored anyway
+    cutoff = time.time() - Bot.state.max_age
+    for block_id, handled_at in list(action_timestamps.items()):
+        if handled_at < cutoff:
+            action_timestamps.pop(block_id, None)
+    Bot.state.checkpoint()
+
+
+Bot.state.register('action_timestamps', dump=lambda: {k: (v, v) for k, v in list(action_timestamps.items())},
+                   restore=action_timestamps.update)
+Bot.state.register('message_limits',
+                   dump=lambda: {k: (datetime.strptime(k, '%Y-%m-%d').timestamp(), v)
+                                 for k, v in list(message_limits.items())},
+                   restore=message_limits.update)
+# Pick up where the last run left off before handling anything
+Bot.state.restore()
+
+
+def refresh_emojis():
+    """Catches any emoji changes we missed events for (only refetches once the catalog's a day old)"""
+    # Until startup's loaded the catalog, there's nothing to refresh
+    if Bot.startup.is_open('emojis'):
+        Bot.work.submit(Bot.emojis.refresh_if_stale, priority=COSMETIC)
+
+
+def refill_image_pool():
+    """Keeps a few inspirational images ready (once someone's asked for one)"""
+    if 'not so useful' in Bot.plugins.loaded:
+        pool = Bot.plugins.load('not so useful').pool
+        if pool.in_use:
+            pool.refill_async()
+
+
+scheduler = Scheduler()
+scheduler.add_job('new_emojis', flush_new_emojis, pending=lambda: len(Bot.new_emojis),
+                  **JOB_SCHEDULE['new_emojis'])
+# Profile changes are found against the user directory, so there's nothing to report until it's loaded
+scheduler.add_job('profile_update', flush_profile_updates,
+                  pending=lambda: len(Bot.profile_diff) if Bot.startup.is_open('directory') else 0,
+                  **JOB_SCHEDULE['profile_update'])
+# Reactions are the first thing dropped when the bot's busy
+scheduler.add_job('reactions', lambda: Bot.work.submit(Bot.reactions.flush, priority=COSMETIC),
+                  **JOB_SCHEDULE['reactions'])
+scheduler.add_job('checkpoint', checkpoint_state, **JOB_SCHEDULE['checkpoint'])
+scheduler.add_job('image_pool', refill_image_pool, **JOB_SCHEDULE['image_pool'])
+scheduler.add_job('emoji_refresh', refresh_emojis, **JOB_SCHEDULE['emoji_refresh'])
+# The rest of startup happens in the background, so events get acked while we connect to Slack.
+#   Events arriving before then are held back and handled once connected.
+Bot.startup.add_stage('general_members', lambda: users_list.extend(Bot.st.get_channel_members('CLWCPQ2TV')))
+# Jobs start as soon as we're connected, rather than waiting on the slower stages (the ones that need
+#   those stages check for them)
+Bot.startup.add_stage('scheduler', scheduler.start, critical=True)
+Bot.startup.start()
+
+
+@app.route("/sasha/cron/new_emojis", methods=['POST'])
+def handle_cron_new_emojis():
+    """Manually sends the new emoji digest (otherwise it's sent by the scheduler)"""
+    scheduler.trigger('new_emojis')
     return make_response('', 200)
 
 
 @app.route("/sasha/cron/profile_update", methods=['POST'])
 def handle_cron_profile_update():
-    """Check for newly updated profile elements (triggered by cron task that sends POST req every 10 mins)"""
-    # Check updated profile (every 10 mins)
-    if len(Bot.user_updates_dict) > 0:
-        # Go about notifying channel of newly uploaded emojis
-        for uid, change_dict in Bot.user_updates_dict.items():
-            # we'll currently report on avatar, display name, name, title and status changes.
-            changes_txt = '*`{display_name}`*\t\t*`{real_name}`*\n:q:{title}:q:\n{status_emoji} {status_text}'
-            msg_block = [
-                Bot.bkb.make_context_section(f'<@{uid}> changed their profile info recently!'),
-                Bot.bkb.make_block_divider()
-            ]
-            # Process new/old data
-            for data in ['old', 'new']:
-                transition = 'from' if data == 'old' else 'to'
-                avi_url = change_dict[data]['avi']
-                avi_alt = f'{transition} pic'
-                msg_block += [
-                    Bot.bkb.make_context_section(f'{transition} this...'),
-                    Bot.bkb.make_block_section(changes_txt.format(**change_dict[data]),
-                                               accessory=Bot.bkb.make_image_accessory(avi_url, avi_alt))
-                ]
-
-            Bot.st.send_message(Bot.general_channel, '', blocks=msg_block)
-            # Make sure the current dict is then updated to reflect changes we've reported
-            Bot.users_dict[uid] = change_dict['new']
-        # Reset dict of user profile changes to an empty dict
-        Bot.user_updates_dict = {}
-
+    """Manually sends the profile update digest (otherwise it's sent by the scheduler)"""
+    scheduler.trigger('profile_update')
     return make_response('', 200)
 
 
 @bot_events.on('reaction_added')
+@Bot.startup.defer_until_ready
 def reaction(event_data: dict):
     event = event_data['event']
     if event['user'] not in [Bot.bot_id, Bot.user_id]:
         # Keep from reacting to own reaction
-        emojis = Bot.emoji_list
-        random_emoji = emojis[randint(0, len(emojis))]
-        try:
-            Bot.bot.reactions_add(
-                name=random_emoji,
-                channel=event['item']['channel'],
-                timestamp=event['item']['ts']
-            )
-        except Exception as e:
-            # Sometimes we'll get a 'too_many_reactions' error. Disregard in that case
-            pass
+        Bot.emojis.record_use(event['reaction'])
+        if event['item'].get('type') == 'message':
+            # Reactions on the same message get coalesced and answered in the background
+            Bot.reactions.submit(event['item']['channel'], event['item']['ts'], event['reaction'])
 
 
 @bot_events.on('message')
+@Bot.startup.defer_until_ready
 def scan_message(event_data: dict):
-    Bot.st.parse_event(event_data)
-    if event_data['event']['user'] == 'UM35HE6R5':
+    # Messages are by far the most common event, so what's logged while handling them is sampled
+    with event_scope('message'):
+        # Only commands need a handler - the rest are just checked here and now
+        if Bot.command_in(event_data['event']) is not None:
+            handlers.submit(conversation_key(event_data['event']), handle_message, event_data)
+        moderate_message(event_data)
+
+
+def handle_message(event_data: dict):
+    # Time the event spent in transit from Slack counts against the budget
+    run_with_budget(Bot.handle_event, event_data, started_at=event_data.get('event_time'))
+
+
+def moderate_message(event_data: dict):
+    if event_data['event'].get('user') == 'UM35HE6R5':
         today = f'{datetime.now():%F}'
-        if today in message_limits.keys():
-            if message_limits[today] >= 3:
-                # Bot.st.delete_message(event_data['event'])
-                Bot.st.user.chat_delete(
-                    channel=event_data['event']['channel'],
-                    ts=event_data['event']['ts']
-                )
-            else:
-                message_limits[today] += 1
-        else:
-            message_limits[today] = 1
+        # Messages from different channels get handled at the same time
+        with message_limits_lock:
+            over_limit = message_limits.get(today, 0) >= 3
+            if not over_limit:
+                message_limits[today] = message_limits.get(today, 0) + 1
+        if over_limit:
+            # Bot.st.delete_message(event_data['event'])
+            Bot.work.submit(Bot.st.user.chat_delete, channel=event_data['event']['channel'],
+                            ts=event_data['event']['ts'], priority=MODERATION)
 
 
 @bot_events.on('emoji_changed')
+@Bot.startup.defer_until_ready
 def notify_new_emojis(event_data):
     event = event_data['event']
+    # Keep our copy of the workspace's emojis current
+    Bot.emojis.apply_event(event)
     # Make a post about a new emoji being added in the #emoji_suggestions channel
     if event['subtype'] == 'add':
         emoji = event['name']
-        Bot.new_emoji_set.add(emoji)
+        Bot.new_emojis.put(emoji, time.time())
 
 
 @bot_events.on('user_change')
+@Bot.startup.defer_until_stage('directory')
 def notify_new_statuses(event_data):
     """Triggered when a user updates their profile info. Gets saved to global dict
     where we then report it in #general"""
@@ -188,5 +398,6 @@ def notify_new_statuses(event_data):
         # Get the user's newly updated dict
         new_user_dict = Bot.st.clean_user_info(user_info)
 
-        # Add updated to our updates dict
-        Bot.user_updates_dict[uid] = {k: v for k, v in zip(['old', 'new'], [current_user_dict, new_user_dict])}
+        # Add to our updates, if anything we report on has changed.
+        #   Several changes before the next digest get merged into one.
+        Bot.profile_diff.observe(uid, current_user_dict, new_user_dict)
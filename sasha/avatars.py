@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import hashlib
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from typing import Dict, List, Optional, Tuple
+from .cache import TTLCache
+from .metrics import metrics, Metrics
+from .resilience import ResilientClient
+
+
+class DiskCache:
+    """Directory of files capped at a total size, evicting the least recently used first"""
+
+    def __init__(self, path: str, max_bytes: int = 20 * 1024 * 1024):
+        """
+        Args:
+            path: str, the directory to keep files in
+            max_bytes: int, the most the files may take up in total
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total = None  # type: Optional[int]  # Bytes taken up by the files, counted on first write
+        os.makedirs(path, exist_ok=True)
+
+    def _fpath(self, key: str) -> str:
+        return os.path.join(self.path, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def get(self, key: str) -> Optional[bytes]:
+        fpath = self._fpath(key)
+        try:
+            with open(fpath, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        # Mark as recently used
+        os.utime(fpath)
+        return data
+
+    def set(self, key: str, data: bytes):
+        fpath = self._fpath(key)
+        try:
+            replaced = os.path.getsize(fpath)
+        except OSError:
+            replaced = 0
+        tmp_path = f'{fpath}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, fpath)
+        with self._lock:
+            if self._total is None:
+                self._total = sum(size for _, size, _ in self._scan())
+            else:
+                self._total += len(data) - replaced
+            # The directory only gets looked through once it's over the limit
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _scan(self) -> List[Tuple[float, int, str]]:
+        files = []
+        for entry in os.scandir(self.path):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        return files
+
+    def _evict(self):
+        files = self._scan()
+        total = sum(size for _, size, _ in files)
+        for _, size, fpath in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(fpath)
+                total -= size
+            except OSError:
+                pass
+        self._total = total
+
+
+class AvatarFingerprinter:
+    """Tells whether two avatar urls point to the same picture by hashing the image content.
+
+    Slack often rotates avatar urls without the image changing. Images are fetched in a background pool
+        (through a bounded disk cache), so event handling never waits on them.
+    """
+
+    def __init__(self, cache_dir: str, http: Optional[ResilientClient] = None, max_bytes: int = 20 * 1024 * 1024,
+                 max_workers: int = 2, registry: Metrics = metrics):
+        """
+        Args:
+            cache_dir: str, directory to cache avatar images in
+            http: ResilientClient, for fetching the images
+            max_bytes: int, maximum size of the image cache
+            max_workers: int, number of images fetched at once
+            registry: Metrics, where cache hits and fetch failures get reported
+        """
+        self.http = ResilientClient() if http is None else http
+        self.disk = DiskCache(cache_dir, max_bytes=max_bytes)
+        self.metrics = registry
+        self.hashes = TTLCache(ttl=60 * 60 * 24 * 7, max_size=10000)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='avatars')
+        self._lock = threading.Lock()
+        self._in_flight = {}  # type: Dict[str, Future]
+
+    def _fetch_hash(self, url: str) -> Optional[str]:
+        data = self.disk.get(url)
+        if data is None:
+            resp = self.http.get(url)
+            if resp.status_code != 200:
+                self.metrics.inc('avatars.fetch_failures')
+                return None
+            data = resp.content
+            self.disk.set(url, data)
+        else:
+            self.metrics.inc('avatars.disk_hits')
+        digest = hashlib.sha256(data).hexdigest()
+        self.hashes.set(url, digest)
+        return digest
+
+    def prefetch(self, url: str) -> Future:
+        """Starts fetching and hashing the image in the background (once per url)"""
+        with self._lock:
+            future = self._in_flight.get(url)
+            if future is not None:
+                return future
+            future = self._pool.submit(self._fetch_hash, url)
+            self._in_flight[url] = future
+        future.add_done_callback(lambda f: self._forget(url))
+        return future
+
+    def _forget(self, url: str):
+        with self._lock:
+            self._in_flight.pop(url, None)
+
+    def fingerprint(self, url: str, timeout: float = 5) -> Optional[str]:
+        """Returns the hash of the image at the url, or None if it couldn't be had in time"""
+        digest = self.hashes.get(url)
+        if digest is not None:
+            return digest
+        try:
+            return self.prefetch(url).result(timeout=timeout)
+        except TimeoutError:
+            self.metrics.inc('avatars.timeouts')
+        except Exception:
+            self.metrics.inc('avatars.fetch_failures')
+        return None
+
+    def same_image(self, old_url: str, new_url: str, timeout: float = 5) -> Optional[bool]:
+        """Whether the two urls serve the same image. None if we can't tell (e.g., within the timeout,
+        which can be 0 to only go by images that have already been hashed)"""
+        if old_url == new_url:
+            return True
+        if old_url == '' or new_url == '':
+            return None
+        old_hash = self.fingerprint(old_url, timeout=timeout)
+        new_hash = self.fingerprint(new_url, timeout=timeout)
+        if old_hash is None or new_hash is None:
+            return None
+        return old_hash == new_hash
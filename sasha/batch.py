@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Checks bulk lookup requests. Kept apart from the language tools, so the web app can turn away bad
+requests without loading them (and lxml with them)"""
+from typing import Any, List, Tuple
+
+
+# Operations available for bulk lookups
+BATCH_OPERATIONS = ['lemma', 'translate-et', 'translate-en', 'examples']
+
+
+class BadBatchRequest(ValueError):
+    """Raised when a bulk lookup request can't be processed"""
+
+    def __init__(self, message: str, status: int = 400):
+        self.status = status
+        super().__init__(message)
+
+
+def parse_batch_request(body: Any, operations: List[str], max_words: int, max_workers: int) \
+        -> Tuple[str, List[str], int]:
+    """Checks a bulk lookup request's body
+
+    Args:
+        body: the request's JSON, e.g. {"operation": "translate-en", "words": ["koer", "kassid"], "workers": 4}
+        operations: list of str, the allowed operations
+        max_words: int, the most words allowed in one request
+        max_workers: int, the most lookups a request can run at once
+    Returns:
+        the operation, words and number of workers
+    Raises:
+        BadBatchRequest, with the status to respond with
+    """
+    if not isinstance(body, dict):
+        raise BadBatchRequest('body must be a JSON object')
+    operation = body.get('operation')
+    words = body.get('words')
+    if operation not in operations:
+        raise BadBatchRequest(f'operation must be one of: {", ".join(operations)}')
+    if not isinstance(words, list) or not all(isinstance(x, str) for x in words):
+        raise BadBatchRequest('words must be a list of strings')
+    if len(words) > max_words:
+        raise BadBatchRequest(f'too many words (max {max_words})', status=413)
+    try:
+        workers = min(int(body.get('workers', 4)), max_workers)
+    except (TypeError, ValueError):
+        raise BadBatchRequest('workers must be an integer')
+    return operation, words, max(1, workers)
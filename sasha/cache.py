@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Hashable, Optional
+
+
+class TTLCache:
+    """A thread-safe, size-bounded LRU cache whose entries expire after a set time.
+
+    Entries go through three phases:
+        fresh: returned as-is
+        stale (within `stale_ttl` after expiring): returned immediately by `get_or_compute`,
+            while a refresh runs in the background
+        expired: dropped and recomputed on the next lookup
+    Negative results (as decided by the `is_negative` callable) are kept for the shorter `negative_ttl`
+        and are never served stale.
+    """
+    _refresh_pool = None
+    _refresh_pool_lock = threading.Lock()
+
+    def __init__(self, ttl: float = 3600, max_size: int = 2048, negative_ttl: Optional[float] = None,
+                 stale_ttl: float = 0, is_negative: Optional[Callable[[Any], bool]] = None,
+                 max_bytes: Optional[int] = None, size_of: Callable[[Any], int] = len):
+        """
+        Args:
+            ttl: float, number of seconds an entry stays fresh
+            max_size: int, maximum number of entries held before the least recently used are evicted
+            negative_ttl: float, number of seconds a negative result stays fresh. Defaults to `ttl`
+            stale_ttl: float, number of seconds after expiring that an entry can still be served
+                while it's refreshed in the background
+            is_negative: callable, takes in a value and returns True if it's a negative result
+                (e.g., nothing found). By default, None and empty containers are negative.
+            max_bytes: int, if given, the least recently used entries are also evicted
+                once the sizes of the values (as measured by `size_of`) add up to more than this
+            size_of: callable, takes in a value and returns its size in bytes
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self.stale_ttl = stale_ttl
+        self.is_negative = self._default_is_negative if is_negative is None else is_negative
+        self.max_bytes = max_bytes
+        self.size_of = size_of
+        self._data = OrderedDict()  # key: (fresh_until, stale_until, value)
+        # Sizes of the values, only kept when there's a max_bytes
+        self._sizes = {}
+        self.total_bytes = 0
+        self._lock = threading.Lock()
+        # Per-key locks so that concurrent lookups of the same key only compute it once
+        self._key_locks = {}
+        # Keys currently being refreshed in the background
+        self._refreshing = set()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @staticmethod
+    def _default_is_negative(value: Any) -> bool:
+        if value is None:
+            return True
+        try:
+            return len(value) == 0
+        except TypeError:
+            return False
+
+    @classmethod
+    def _get_refresh_pool(cls) -> ThreadPoolExecutor:
+        """Shared pool for background refreshes, started on first use"""
+        with cls._refresh_pool_lock:
+            if cls._refresh_pool is None:
+                cls._refresh_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='cache-refresh')
+            return cls._refresh_pool
+
+    def _lookup(self, key: Hashable, allow_stale: bool = False):
+        """Returns (value, is_stale), or None if there's no usable entry"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            fresh_until, stale_until, value = item
+            now = time.monotonic()
+            if now < fresh_until:
+                self._data.move_to_end(key)
+                return value, False
+            if now >= stale_until:
+                self._drop(key)
+                return None
+            if not allow_stale:
+                return None
+            self._data.move_to_end(key)
+            return value, True
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Returns the value stored at the key, or the default if it's missing or no longer fresh"""
+        item = self._lookup(key)
+        return default if item is None else item[0]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Stores the value at the key, evicting the oldest entries if the cache is full"""
+        negative = self.is_negative(value)
+        if ttl is None:
+            ttl = self.negative_ttl if negative else self.ttl
+        stale_ttl = 0 if negative else self.stale_ttl
+        now = time.monotonic()
+        size = self.size_of(value) if self.max_bytes is not None else 0
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (now + ttl, now + ttl + stale_ttl, value)
+            if self.max_bytes is not None:
+                self._sizes[key] = size
+                self.total_bytes += size
+            # (A value that's bigger than max_bytes on its own doesn't get kept at all)
+            while len(self._data) > self.max_size or \
+                    (self.max_bytes is not None and self.total_bytes > self.max_bytes and len(self._data) > 0):
+                self._drop(next(iter(self._data)))
+
+    def _drop(self, key: Hashable):
+        """Removes the key (the lock must be held)"""
+        del self._data[key]
+        self.total_bytes -= self._sizes.pop(key, 0)
+
+    def get_or_compute(self, key: Hashable, func: Callable[[], Any]) -> Any:
+        """Returns the cached value for the key, computing and storing it with func on a miss.
+        Concurrent misses on the same key wait for the first computation instead of repeating it.
+        Stale values are returned right away and refreshed in the background.
+        """
+        item = self._lookup(key, allow_stale=True)
+        if item is not None:
+            value, is_stale = item
+            if is_stale:
+                self._refresh_in_background(key, func)
+            return value
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            # Someone else may have filled it while we waited
+            item = self._lookup(key)
+            if item is None:
+                value = func()
+                self.set(key, value)
+            else:
+                value = item[0]
+        with self._lock:
+            self._key_locks.pop(key, None)
+        return value
+
+    def _refresh_in_background(self, key: Hashable, func: Callable[[], Any]):
+        """Recomputes the key's value off-thread, making sure only one refresh per key runs at once"""
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def _refresh():
+            try:
+                self.set(key, func())
+            except Exception:
+                # Keep serving the stale value until it fully expires
+                pass
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        self._get_refresh_pool().submit(_refresh)
+
+    def clear(self):
+        """Empties the cache"""
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.total_bytes = 0
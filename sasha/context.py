@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Request-scoped state, carried implicitly through the call stack of a single Slack event"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+
+class DeadlineExceeded(Exception):
+    """Raised when there's no time left in a request's budget"""
+
+    def __init__(self, step: str = ''):
+        super().__init__(f'Deadline exceeded{f" before {step}" if step != "" else ""}')
+
+    @property
+    def friendly_message(self) -> str:
+        """A message suitable for posting back to Slack"""
+        return 'That took way too long, so I gave up on it :hourglass:'
+
+
+class Deadline:
+    """A point in time by which a request's work should be done"""
+
+    def __init__(self, budget: float, started_at: Optional[float] = None):
+        """
+        Args:
+            budget: float, total number of seconds allowed for the request
+            started_at: float, unix timestamp of when the request began (e.g., Slack's `event_time`).
+                Time already spent since then counts against the budget. Defaults to now.
+        """
+        self.budget = budget
+        elapsed = 0.0 if started_at is None else max(0.0, time.time() - started_at)
+        self.expires_at = time.monotonic() + budget - elapsed
+
+    def remaining(self) -> float:
+        """Seconds left before the deadline (negative once it's passed)"""
+        return self.expires_at - time.monotonic()
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def timeout(self, default: float) -> float:
+        """Returns the timeout to use for the next call: the default, capped by the time remaining"""
+        return min(default, self.remaining())
+
+    def check(self, step: str = ''):
+        """Raises DeadlineExceeded if the deadline has passed"""
+        if self.expired:
+            raise DeadlineExceeded(step)
+
+
+_current_deadline = ContextVar('sasha_deadline', default=None)
+
+
+def current_deadline() -> Optional[Deadline]:
+    """Returns the deadline of the request currently being handled, if any"""
+    return _current_deadline.get()
+
+
+def check_deadline(step: str = ''):
+    """Raises DeadlineExceeded if the current request's deadline has passed"""
+    deadline = _current_deadline.get()
+    if deadline is not None:
+        deadline.check(step)
+
+
+@contextmanager
+def deadline_scope(budget: float, started_at: Optional[float] = None) -> Iterator[Deadline]:
+    """Sets a deadline for all the work done within the block"""
+    deadline = Deadline(budget, started_at=started_at)
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from typing import Any, Hashable, List, Optional, Tuple
+
+
+# Block Kit limits
+MAX_BLOCKS = 50  # Blocks per message
+MAX_SECTION_CHARS = 3000  # Characters in a section's text
+MAX_MESSAGE_CHARS = 12000  # Characters across all blocks in a message (kept well under Slack's cap)
+
+
+def block_chars(obj: Any) -> int:
+    """Counts the characters of text in a block (or list of blocks)"""
+    if isinstance(obj, str):
+        return len(obj)
+    if isinstance(obj, dict):
+        return sum(block_chars(v) for k, v in obj.items() if k in ['text', 'elements', 'fields', 'accessory',
+                                                                   'alt_text'])
+    if isinstance(obj, list):
+        return sum(block_chars(x) for x in obj)
+    return 0
+
+
+def split_line(line: str, max_chars: int = MAX_SECTION_CHARS) -> List[str]:
+    """Breaks a line that's too long into pieces of at most max_chars, at a space where there is one"""
+    pieces = []
+    while len(line) > max_chars:
+        cut = line.rfind(' ', 0, max_chars + 1)
+        if cut <= 0:
+            cut = max_chars
+        pieces.append(line[:cut])
+        line = line[cut:].lstrip(' ')
+    pieces.append(line)
+    return pieces
+
+
+def pack_lines(lines: List[Tuple[Hashable, str]], max_chars: int = MAX_SECTION_CHARS) \
+        -> List[Tuple[List[Hashable], str]]:
+    """Joins lines of text into as few chunks of at most max_chars as possible.
+    A line that's longer than max_chars on its own continues into the next chunk(s), which share its key.
+
+    Args:
+        lines: list of (key, line) tuples
+        max_chars: int, the maximum length of a chunk
+    Returns:
+        list of (keys of the lines in the chunk, chunk text) tuples
+    """
+    chunks = []
+    keys, text = [], ''
+    for key, line in lines:
+        for piece in split_line(line, max_chars):
+            if text != '' and len(text) + 1 + len(piece) > max_chars:
+                chunks.append((keys, text))
+                keys, text = [], ''
+            if key not in keys:
+                keys.append(key)
+            text = piece if text == '' else f'{text}\n{piece}'
+    if len(keys) > 0:
+        chunks.append((keys, text))
+    return chunks
+
+
+class DigestMessage:
+    """One message of a digest, along with the keys of the items it covers"""
+
+    def __init__(self):
+        self.blocks = []  # type: List[dict]
+        self.keys = []  # type: List[Hashable]
+        self.chars = 0
+
+
+class DigestBuilder:
+    """Packs digest items into as few messages as Block Kit's limits allow.
+
+    Items are added as groups of blocks that are kept together in the same message where possible.
+    """
+
+    def __init__(self, header: Optional[List[dict]] = None, max_blocks: int = MAX_BLOCKS,
+                 max_chars: int = MAX_MESSAGE_CHARS):
+        """
+        Args:
+            header: list of dict, blocks that start the digest
+            max_blocks: int, maximum blocks per message
+            max_chars: int, maximum characters of text per message
+        """
+        self.max_blocks = max_blocks
+        self.max_chars = max_chars
+        self.messages = []  # type: List[DigestMessage]
+        if header is not None:
+            self.add_group(header)
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def _new_message(self) -> DigestMessage:
+        msg = DigestMessage()
+        self.messages.append(msg)
+        return msg
+
+    def add_group(self, blocks: List[dict], key: Optional[Hashable] = None, keys: Optional[List[Hashable]] = None):
+        """Adds a group of blocks, starting a new message if they don't fit in the current one
+
+        Args:
+            blocks: list of dict, the blocks to add
+            key: hashable, identifies the item the blocks are for (e.g., the user id)
+            keys: list of hashable, for when the blocks cover several items
+        """
+        keys = ([] if key is None else [key]) + ([] if keys is None else keys)
+        chars = block_chars(blocks)
+        msg = self.messages[-1] if len(self.messages) > 0 else self._new_message()
+        if len(msg.blocks) > 0 and (len(msg.blocks) + len(blocks) > self.max_blocks or
+                                    msg.chars + chars > self.max_chars):
+            msg = self._new_message()
+        for block in blocks:
+            # Groups that are too big for a single message get split up
+            if len(msg.blocks) >= self.max_blocks or \
+                    (len(msg.blocks) > 0 and msg.chars + block_chars(block) > self.max_chars):
+                msg = self._new_message()
+            msg.blocks.append(block)
+            msg.chars += block_chars(block)
+            msg.keys += [k for k in keys if k not in msg.keys]
+
+    def build(self) -> List[DigestMessage]:
+        """Returns the messages that make up the digest"""
+        return [x for x in self.messages if len(x.blocks) > 0]
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import re
+import threading
+from typing import Any, Dict, List, Optional, Pattern, Tuple
+
+
+class CommandDispatcher:
+    """Matches command text against the commands dict and runs whatever the matching entry calls for.
+
+    The regexes are compiled once (and again whenever the commands change). Entry values work like they do
+        in SlackBotBase: a string is a response (formatted with the event's values, e.g., `{user}`),
+        a list starting with a callable is called with the named event values, anything else (e.g., blocks)
+        is the response as-is.
+    """
+
+    def __init__(self, commands: Dict[str, dict], triggers: List[str]):
+        """
+        Args:
+            commands: dict, regex -> command entry (with a 'value')
+            triggers: list of str, what a message has to start with to be meant for the bot
+        """
+        self._lock = threading.Lock()
+        self._compiled = []  # type: List[Tuple[Pattern, str, dict]]
+        self.triggers = triggers
+        self._trigger_re = re.compile(r'^\s*(?:{})(?=[\s,:]|$)[\s,:]*'.format(
+            '|'.join(re.escape(x) for x in triggers)), re.IGNORECASE)
+        self.update(commands)
+
+    def update(self, commands: Dict[str, dict]):
+        """Takes in a new (or changed) commands dict"""
+        compiled = [(re.compile(regex, re.IGNORECASE), regex, entry) for regex, entry in commands.items()]
+        with self._lock:
+            self._compiled = compiled
+
+    def strip_trigger(self, text: str) -> Optional[str]:
+        """Returns the command in the message, or None if the message wasn't meant for the bot"""
+        match = self._trigger_re.match(text)
+        if match is None:
+            return None
+        return text[match.end():].strip()
+
+    def match(self, command: str) -> Optional[Tuple[str, dict]]:
+        """Finds the entry for the command (the first one that matches)"""
+        with self._lock:
+            compiled = self._compiled
+        for pattern, regex, entry in compiled:
+            if pattern.search(command) is not None:
+                return regex, entry
+        return None
+
+    def dispatch(self, command: str, context: Dict[str, Any]) -> Any:
+        """Runs the command
+
+        Args:
+            command: str, the command text (without the trigger)
+            context: dict, the event's values (e.g., 'channel', 'user') the entry can ask for
+        Returns:
+            the response (text, blocks or None), or None if no command matched
+        """
+        found = self.match(command)
+        if found is None:
+            return None
+        regex, entry = found
+        values = dict(context, message=command, match_pattern=regex)
+        value = entry['value']
+        if isinstance(value, list) and len(value) > 0 and callable(value[0]):
+            func, args = value[0], value[1:]
+            return func(*[values.get(x) for x in args])
+        if isinstance(value, str):
+            return value.format(**values)
+        return value
+
+
+def parse_slash_command(event_data: dict, triggers: List[str]) -> str:
+    """Turns a slash command's payload into command text.
+    `/sasha ety koer` becomes `ety koer`, and so does `/ety koer`"""
+    name = event_data.get('command', '').lstrip('/')
+    text = event_data.get('text', '').strip()
+    if name.lower() in [x.lower() for x in triggers]:
+        return text
+    return f'{name} {text}'.strip()
+
+
+def parse_action(action: dict) -> Optional[str]:
+    """Turns an incoming action (e.g., when a button is clicked) into the command it stands for"""
+    if action['type'] == 'multi_static_select':
+        # Multiselect
+        selections = action['selected_options']
+        parsed_command = ''
+        for selection in selections:
+            value = selection['value'].replace('-', ' ')
+            if 'all' in value:
+                # Only used for randpick/choose. Results in just the command 'rand(pick|choose)'
+                #   If we're selecting all, we don't need to know any of the other selections.
+                parsed_command = f'{value.split()[0]}'
+                break
+            if parsed_command == '':
+                # Put the entire first value into the parsed command (e.g., 'pick 1'
+                parsed_command = f'{value}'
+            else:
+                # Build on the already-made command by concatenating the number to the end
+                #   e.g. 'pick 1' => 'pick 12'
+                parsed_command += value.split()[1]
+
+    elif action['type'] == 'button':
+        # Normal button clicks just send a 'value' key in the payload dict
+        parsed_command = action['value'].replace('-', ' ')
+    else:
+        # Command not parsed
+        # Probably should notify the user, but I'm not sure if Slack will attempt
+        #   to send requests multiple times if it doesn't get a response in time.
+        return None
+    return parsed_command
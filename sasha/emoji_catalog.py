@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import random
+import threading
+from typing import Callable, Dict, Iterable, List, Optional
+
+
+class EmojiCatalog:
+    """Local copy of the workspace's custom emojis.
+
+    Loaded from disk if we've saved it recently enough, otherwise from Slack, then kept current
+        with `emoji_changed` events (and refetched from Slack once it's older than `max_age`, in case
+        we missed any). Changes are written to disk in bursts, `save_delay` after the first one.
+        Offers O(1) uniform sampling and O(1) sampling weighted by how often each emoji gets used
+        in reactions (via the alias method).
+    Until it's loaded, events are held back (and applied once it is) and nothing's saved,
+        so an empty catalog never overwrites the one on disk.
+    """
+    version = 1
+
+    def __init__(self, path: str, fetch_func: Callable[[], Dict[str, str]], smoothing: float = 1.0,
+                 rebuild_interval: float = 60, max_age: float = 60 * 60 * 24, save_delay: float = 5):
+        """
+        Args:
+            path: str, path to the file the catalog is persisted to
+            fetch_func: callable, returns the full dict of emoji name -> url from Slack (`emoji.list`)
+            smoothing: float, weight added to every emoji's use count so unused ones still show up
+            rebuild_interval: float, minimum seconds between rebuilds of the weighted sampling table
+            max_age: float, seconds after which the full list is fetched from Slack again
+            save_delay: float, seconds to wait after a change before writing the catalog to disk
+        """
+        self.path = path
+        self.fetch_func = fetch_func
+        self.smoothing = smoothing
+        self.rebuild_interval = rebuild_interval
+        self.max_age = max_age
+        self.save_delay = save_delay
+        self._lock = threading.RLock()
+        self.refreshed_at = 0.0  # When the full list was last fetched from Slack (unix time)
+        self.loaded = False
+        self._pending = []  # type: List[dict]  # Events that came in before the catalog was loaded
+        self._save_timer = None  # type: Optional[threading.Timer]
+        self.emojis = {}  # type: Dict[str, str]
+        self.counts = {}  # type: Dict[str, int]
+        # Uniform sampling: a list of names plus each name's position, for O(1) swap-removal
+        self._names = []  # type: List[str]
+        self._positions = {}  # type: Dict[str, int]
+        # Weighted sampling: alias table, rebuilt lazily once the weights are dirty
+        self._alias_names = []  # type: List[str]
+        self._alias_probs = []  # type: List[float]
+        self._aliases = []  # type: List[int]
+        self._alias_dirty = True
+        self._alias_built_at = 0.0
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._positions
+
+    def load(self):
+        """Loads the catalog from disk, falling back to Slack if there's no usable (or recent enough) file"""
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    data = json.load(f)
+                if data.get('version') == self.version:
+                    self._replace(data['emojis'])
+                    self.counts = {k: v for k, v in data.get('counts', {}).items() if k in self.emojis}
+                    self.refreshed_at = data.get('refreshed_at', 0.0)
+            except (ValueError, KeyError, OSError):
+                pass
+        # A file in an older format is never refreshed_at, so that gets fetched too
+        if not self.refresh_if_stale():
+            self._set_loaded()
+
+    def _set_loaded(self):
+        with self._lock:
+            self.loaded = True
+            pending, self._pending = self._pending, []
+        for event in pending:
+            self.apply_event(event)
+
+    def refresh_if_stale(self) -> bool:
+        """Refetches the full list from Slack if it's been longer than `max_age`"""
+        if time.time() - self.refreshed_at < self.max_age:
+            return False
+        self.refresh()
+        return True
+
+    def refresh(self):
+        """Replaces the catalog with the full list from Slack (keeping the use counts)"""
+        emojis = self.fetch_func()
+        with self._lock:
+            self._replace(emojis)
+            self.counts = {k: v for k, v in self.counts.items() if k in self.emojis}
+            self.refreshed_at = time.time()
+        self._set_loaded()
+        self.save()
+
+    def save_soon(self):
+        """Saves the catalog in `save_delay` seconds, along with any other changes made until then"""
+        with self._lock:
+            if self._save_timer is not None:
+                return
+            self._save_timer = threading.Timer(self.save_delay, self.save)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def save(self):
+        """Writes the catalog to disk (atomically, so a crash never leaves a partial file)"""
+        with self._lock:
+            if not self.loaded:
+                return
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            data = {'version': self.version, 'refreshed_at': self.refreshed_at, 'emojis': dict(self.emojis),
+                    'counts': dict(self.counts)}
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+    def _replace(self, emojis: Dict[str, str]):
+        with self._lock:
+            self.emojis = dict(emojis)
+            self._names = list(self.emojis.keys())
+            self._positions = {name: i for i, name in enumerate(self._names)}
+            self._alias_dirty = True
+
+    def add(self, name: str, url: str = ''):
+        with self._lock:
+            if name not in self._positions:
+                self._positions[name] = len(self._names)
+                self._names.append(name)
+                self._alias_dirty = True
+            self.emojis[name] = url
+
+    def remove(self, names: Iterable[str]):
+        with self._lock:
+            for name in names:
+                pos = self._positions.pop(name, None)
+                if pos is None:
+                    continue
+                # Move the last name into the removed name's slot
+                last = self._names.pop()
+                if pos < len(self._names):
+                    self._names[pos] = last
+                    self._positions[last] = pos
+                self.emojis.pop(name, None)
+                self.counts.pop(name, None)
+                self._alias_dirty = True
+
+    def rename(self, old_name: str, new_name: str, url: str = ''):
+        with self._lock:
+            count = self.counts.get(old_name)
+            self.remove([old_name])
+            self.add(new_name, url)
+            if count is not None:
+                self.counts[new_name] = count
+
+    def apply_event(self, event: dict):
+        """Updates the catalog from an `emoji_changed` event, persisting the change shortly"""
+        with self._lock:
+            if not self.loaded:
+                self._pending.append(event)
+                return
+        subtype = event.get('subtype')
+        if subtype == 'add':
+            self.add(event['name'], event.get('value', ''))
+        elif subtype == 'remove':
+            self.remove(event.get('names', []))
+        elif subtype == 'rename':
+            self.rename(event['old_name'], event['new_name'], event.get('value', ''))
+        else:
+            return
+        self.save_soon()
+
+    def record_use(self, name: str):
+        """Counts a reaction made with the emoji, for weighted sampling"""
+        with self._lock:
+            if name in self._positions:
+                self.counts[name] = self.counts.get(name, 0) + 1
+                self._alias_dirty = True
+
+    def sample(self) -> Optional[str]:
+        """Picks an emoji uniformly at random"""
+        with self._lock:
+            if len(self._names) == 0:
+                return None
+            return self._names[random.randrange(len(self._names))]
+
+    def sample_weighted(self) -> Optional[str]:
+        """Picks an emoji at random, favoring the ones used most in reactions"""
+        with self._lock:
+            if len(self._names) == 0:
+                return None
+            if self._alias_dirty and (len(self._alias_names) == 0 or
+                                      time.monotonic() - self._alias_built_at >= self.rebuild_interval):
+                self._build_alias_table()
+            i = random.randrange(len(self._alias_names))
+            name = self._alias_names[i] if random.random() < self._alias_probs[i] \
+                else self._alias_names[self._aliases[i]]
+            if name not in self._positions:
+                # Removed since the table was built
+                return self._names[random.randrange(len(self._names))]
+            return name
+
+    def _build_alias_table(self):
+        """Builds the alias table for the current weights (Vose's method)"""
+        names = list(self._names)
+        n = len(names)
+        weights = [self.counts.get(name, 0) + self.smoothing for name in names]
+        total = sum(weights)
+        if total <= 0:
+            weights = [1] * n
+            total = n
+        probs = [w * n / total for w in weights]
+        aliases = [0] * n
+        small = [i for i, p in enumerate(probs) if p < 1]
+        large = [i for i, p in enumerate(probs) if p >= 1]
+        while len(small) > 0 and len(large) > 0:
+            s = small.pop()
+            g = large.pop()
+            aliases[s] = g
+            probs[g] -= 1 - probs[s]
+            (small if probs[g] < 1 else large).append(g)
+        # Whatever's left over is (within rounding) exactly 1
+        for i in small + large:
+            probs[i] = 1
+        self._alias_names = names
+        self._alias_probs = probs
+        self._aliases = aliases
+        self._alias_dirty = False
+        self._alias_built_at = time.monotonic()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import time
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Deque, Dict, Hashable, Optional, Tuple
+from .metrics import metrics, Metrics
+from .work import INTERACTIVE, WorkScheduler, WorkShed
+
+
+class KeyQueueFull(Exception):
+    """Set on the future of work turned away because its key already has too much queued"""
+
+    def __init__(self, key: Hashable):
+        self.key = key
+        super().__init__(f'too much work queued for {key}')
+
+
+def conversation_key(event: dict) -> str:
+    """Key for ordering work on a Slack event: the thread if it's in one, otherwise the channel"""
+    channel = event.get('channel', '')
+    thread_ts = event.get('thread_ts')
+    return channel if thread_ts is None else f'{channel}:{thread_ts}'
+
+
+class KeyedExecutor:
+    """Runs work in FIFO order per key (e.g., per channel), while different keys are worked on in parallel.
+
+    Each key has its own bounded queue. A key with queued work has at most one task in the WorkScheduler,
+        which runs one item and then goes to the back of the line if there's more, so a busy key
+        can't starve the others. Work runs in a copy of the submitter's context (e.g., its deadline).
+        If the WorkScheduler sheds a key's task, the item it was for is shed and the key moves on.
+    """
+
+    def __init__(self, name: str, pool: Optional[WorkScheduler] = None, max_workers: int = 8, max_queue: int = 20,
+                 lag_threshold: float = 5, registry: Metrics = metrics):
+        """
+        Args:
+            name: str, the executor's name in metrics
+            pool: WorkScheduler, runs the work (by its priority). Defaults to a WorkScheduler of its own.
+            max_workers: int, the most keys worked on at once, when there's no pool given
+            max_queue: int, the most items queued per key (anything more is turned away)
+            lag_threshold: float, seconds an item can wait before its key counts as lagging
+            registry: Metrics, where queue lag and rejections get reported
+        """
+        self.name = name
+        self.max_queue = max_queue
+        self.lag_threshold = lag_threshold
+        self.metrics = registry
+        self._pool = WorkScheduler(name, max_workers=max_workers, registry=registry) if pool is None else pool
+        self._lock = threading.Lock()
+        self._queues = {}  # type: Dict[Hashable, Deque[Tuple[float, int, Future, contextvars.Context, Callable]]]
+        self.metrics.register_gauge(f'executor.{name}.queued', self.queued)
+        self.metrics.register_gauge(f'executor.{name}.max_lag', lambda: max(self.lags().values(), default=0))
+        self.metrics.register_gauge(f'executor.{name}.lagging_keys',
+                                    lambda: sum(x >= self.lag_threshold for x in self.lags().values()))
+
+    def queued(self) -> int:
+        with self._lock:
+            return sum(len(q) for q in self._queues.values())
+
+    def lags(self) -> Dict[Hashable, float]:
+        """How long the oldest queued item of each key has been waiting"""
+        now = time.monotonic()
+        with self._lock:
+            return {k: now - q[0][0] for k, q in self._queues.items() if len(q) > 0}
+
+    def submit(self, key: Hashable, func: Callable, *args, priority: int = INTERACTIVE, **kwargs) -> Future:
+        """Queues the work behind anything else with the same key
+
+        Args:
+            key: hashable, work with the same key is run one at a time, in order
+            func: callable, the work
+            priority: int, the work's class in the WorkScheduler (e.g., INTERACTIVE)
+        Returns:
+            Future, holds the work's result (or KeyQueueFull if it was turned away)
+        """
+        future = Future()
+        ctx = contextvars.copy_context()
+        with self._lock:
+            queue = self._queues.get(key)
+            if queue is None:
+                queue = self._queues[key] = deque()
+            elif len(queue) >= self.max_queue:
+                self.metrics.inc(f'executor.{self.name}.rejected')
+                future.set_exception(KeyQueueFull(key))
+                return future
+            queue.append((time.monotonic(), priority, future, ctx, lambda: func(*args, **kwargs)))
+            # The key's first item starts its runner - later ones get picked up by it
+            start_runner = len(queue) == 1
+        self.metrics.inc(f'executor.{self.name}.submitted')
+        if start_runner:
+            self._start_runner(key, priority)
+        return future
+
+    def _start_runner(self, key: Hashable, priority: int):
+        runner = self._pool.submit(self._run_next, key, priority=priority)
+        runner.add_done_callback(lambda f: self._on_runner_done(key, f))
+
+    def _on_runner_done(self, key: Hashable, runner: Future):
+        if runner.cancelled() or not isinstance(runner.exception(), WorkShed):
+            return
+        # The runner never got to run - drop the item it was for and carry on with the rest
+        with self._lock:
+            future = self._queues[key][0][2]
+        future.set_exception(runner.exception())
+        self._advance(key)
+
+    def _run_next(self, key: Hashable):
+        with self._lock:
+            enqueued_at, _, future, ctx, work = self._queues[key][0]
+        self.metrics.inc(f'executor.{self.name}.lag_seconds', time.monotonic() - enqueued_at)
+        if future.set_running_or_notify_cancel():
+            try:
+                future.set_result(ctx.run(work))
+            except BaseException as e:
+                self.metrics.inc(f'executor.{self.name}.errors')
+                future.set_exception(e)
+        self._advance(key)
+
+    def _advance(self, key: Hashable):
+        with self._lock:
+            queue = self._queues[key]
+            queue.popleft()
+            if len(queue) == 0:
+                del self._queues[key]
+                return
+            priority = queue[0][1]
+        # More work for this key - back of the line, so other keys get a turn
+        self._start_runner(key, priority)
+
+    def shutdown(self, wait: bool = True):
+        self._pool.shutdown(wait=wait)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import time
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, Optional, Set
+from .context import current_deadline, DeadlineExceeded
+from .metrics import metrics, Metrics
+from .resilience import DependencyTimeoutError
+
+
+class LatencyTracker:
+    """Keeps a rolling window of latencies to estimate percentiles from"""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        """
+        Args:
+            window: int, number of most recent latencies to keep
+            min_samples: int, number of latencies needed before percentiles are reported
+        """
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        """Returns the latency at the given percentile (0-100), or None if there's not enough data yet"""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            samples = sorted(self._samples)
+        idx = min(len(samples) - 1, int(round(pct / 100 * (len(samples) - 1))))
+        return samples[idx]
+
+
+class HedgeBudget:
+    """Token bucket that caps hedged requests to a fraction of all requests"""
+
+    def __init__(self, ratio: float = 0.1, max_tokens: float = 10):
+        """
+        Args:
+            ratio: float, maximum share of extra requests hedging may add (0.1 = 10% more load)
+            max_tokens: float, the most hedges that can be saved up for a burst
+        """
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = 0.0
+        self._lock = threading.Lock()
+
+    def on_request(self):
+        """Earns a fraction of a hedge for each request made"""
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def available(self) -> bool:
+        """Whether there's a token for a hedge (without taking it)"""
+        with self._lock:
+            return self._tokens >= 1
+
+    def try_spend(self) -> bool:
+        """Takes a token for a hedge, if one's available"""
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+class Hedger:
+    """Runs idempotent calls with a backup: if the first attempt hasn't answered by the
+    configured latency percentile, an identical second attempt is sent and whichever answers first wins.
+
+    Calls only go through the pool when a hedge could actually be sent (there's budget for one, time left
+        before the deadline and a free worker). Otherwise they're run on the caller's thread, so time spent
+        waiting for a worker never counts as the host's latency.
+    """
+
+    def __init__(self, percentile: float = 95, default_delay: float = 1.0, min_delay: float = 0.05,
+                 budget: Optional[HedgeBudget] = None, max_workers: int = 8, max_wait: float = 30,
+                 registry: Metrics = metrics):
+        """
+        Args:
+            percentile: float, latency percentile (0-100) after which a hedge is sent
+            default_delay: float, seconds to wait before hedging while there's not enough latency data
+            min_delay: float, the shortest wait before hedging
+            budget: HedgeBudget, global cap on the extra load from hedges. Defaults to 10%
+            max_workers: int, size of the pool the attempts run on
+            max_wait: float, the longest to wait on the attempts when there's no deadline
+            registry: Metrics, where hedge and win rates get reported
+        """
+        self.percentile = percentile
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.budget = HedgeBudget() if budget is None else budget
+        self.max_workers = max_workers
+        self.max_wait = max_wait
+        self.metrics = registry
+        self.trackers = {}  # type: Dict[str, LatencyTracker]
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hedge')
+
+    def _get_tracker(self, key: str) -> LatencyTracker:
+        with self._lock:
+            if key not in self.trackers:
+                self.trackers[key] = LatencyTracker()
+                get = self.metrics.get
+                self.metrics.register_gauge(
+                    f'hedge.{key}.hedge_rate',
+                    lambda: get(f'hedge.{key}.hedged') / max(1, get(f'hedge.{key}.requests')))
+                self.metrics.register_gauge(
+                    f'hedge.{key}.win_rate',
+                    lambda: get(f'hedge.{key}.wins') / max(1, get(f'hedge.{key}.hedged')))
+            return self.trackers[key]
+
+    @staticmethod
+    def _timed(func: Callable[[], Any], tracker: LatencyTracker) -> Any:
+        """Calls the function, recording its latency if it succeeds"""
+        start = time.monotonic()
+        result = func()
+        tracker.record(time.monotonic() - start)
+        return result
+
+    def _try_reserve(self, n: int) -> bool:
+        """Claims n workers of the pool, if they're free"""
+        with self._lock:
+            if self._in_flight + n > self.max_workers:
+                return False
+            self._in_flight += n
+            return True
+
+    def _release(self, _: Optional[Future] = None):
+        with self._lock:
+            self._in_flight -= 1
+
+    def _submit(self, func: Callable[[], Any], tracker: LatencyTracker) -> Future:
+        """Runs the function on a (reserved) worker with the caller's context (e.g., its deadline),
+        recording its latency once it succeeds - even if the other attempt already won"""
+        ctx = contextvars.copy_context()
+        future = self._pool.submit(ctx.run, self._timed, func, tracker)
+        future.add_done_callback(self._release)
+        return future
+
+    def _wait_time(self) -> float:
+        deadline = current_deadline()
+        return self.max_wait if deadline is None else max(0.0, deadline.remaining())
+
+    def _timed_out(self, key: str):
+        self.metrics.inc(f'hedge.{key}.timeouts')
+        if current_deadline() is not None:
+            raise DeadlineExceeded(f'{key} answered')
+        raise DependencyTimeoutError(key, 'no answer')
+
+    def hedge_delay(self, key: str) -> float:
+        """Determines how long to wait on the first attempt before hedging"""
+        delay = self._get_tracker(key).percentile(self.percentile)
+        return max(self.min_delay, self.default_delay if delay is None else delay)
+
+    def run(self, key: str, func: Callable[[], Any]) -> Any:
+        """Calls the function, hedging it if it's slow
+
+        Args:
+            key: str, groups calls with similar latencies (e.g., the host)
+            func: callable, the idempotent call to make
+        """
+        tracker = self._get_tracker(key)
+        self.metrics.inc(f'hedge.{key}.requests')
+        self.budget.on_request()
+        delay = self.hedge_delay(key)
+        deadline = current_deadline()
+
+        worth_hedging = self.budget.available() and (deadline is None or deadline.remaining() > delay)
+        # Room for both attempts is set aside up front, so neither waits on the pool
+        if not worth_hedging or not self._try_reserve(2):
+            return self._timed(func, tracker)
+
+        primary = self._submit(func, tracker)
+        done, _ = wait([primary], timeout=delay)
+        if len(done) > 0 or not self.budget.try_spend():
+            self._release()
+            return self._result(key, primary)
+
+        self.metrics.inc(f'hedge.{key}.hedged')
+        backup = self._submit(func, tracker)
+        pending = {primary, backup}  # type: Set[Future]
+        error = None
+        while len(pending) > 0:
+            done, pending = wait(pending, timeout=self._wait_time(), return_when=FIRST_COMPLETED)
+            if len(done) == 0:
+                self._timed_out(key)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if future is backup:
+                    self.metrics.inc(f'hedge.{key}.wins')
+                return result
+        # Both attempts failed
+        raise error
+
+    def _result(self, key: str, future: Future) -> Any:
+        done, _ = wait([future], timeout=self._wait_time())
+        if len(done) == 0:
+            self._timed_out(key)
+        return future.result()
@@ -1,61 +1,142 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import re
-import requests
 import numpy as np
 import urllib.parse as parse
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterator, List, Optional
 from io import StringIO
 from lxml import etree
+from .batch import BATCH_OPERATIONS
+from .cache import TTLCache
+from .context import check_deadline
+from .hedging import Hedger
+from .resilience import ResilientClient, friendly_failures
 
 
 class Linguistics:
     """Language methods"""
+    # Operations available for bulk lookups
+    batch_operations = BATCH_OPERATIONS
 
-    def __init__(self):
-        pass
+    def __init__(self, cache_ttl: float = 60 * 60 * 12, cache_size: int = 10000,
+                 negative_ttl: float = 60 * 10, stale_ttl: float = 60 * 60 * 24,
+                 http: Optional[ResilientClient] = None, hedger: Optional[Hedger] = None,
+                 page_cache_bytes: int = 50 * 1024 * 1024):
+        """
+        Args:
+            cache_ttl: float, seconds a lookup result is kept before it's fetched again
+            cache_size: int, maximum number of lookup results to keep
+            negative_ttl: float, seconds a lookup that found nothing is remembered
+            stale_ttl: float, seconds an expired lookup result can still be served
+                while it's refreshed in the background
+            http: ResilientClient, for making requests to the dictionary sites
+            hedger: Hedger, if provided, slow requests to the dictionary sites are hedged with a second
+                identical request and whichever answers first is used
+            page_cache_bytes: int, the most page content kept around for conditional requests
+        """
+        self.http = ResilientClient() if http is None else http
+        self.hedger = hedger
+        self.cache = TTLCache(ttl=cache_ttl, max_size=cache_size, negative_ttl=negative_ttl,
+                              stale_ttl=stale_ttl)
+        # Validators (ETag / Last-Modified) and bodies of fetched pages, for conditional requests
+        self.validators = TTLCache(ttl=60 * 60 * 24 * 7, max_size=cache_size, max_bytes=page_cache_bytes,
+                                   size_of=lambda x: len(x[2]))
 
-    @staticmethod
-    def _prep_for_xpath(url: str) -> etree.ElementBase:
+    def _get(self, url: str) -> bytes:
+        """Fetches the content at the url, revalidating with the site when we've seen it before"""
+        return b''.join(self._stream(url))
+
+    def _stream(self, url: str, chunk_size: int = 16 * 1024) -> Iterator[bytes]:
+        """Fetches the content at the url chunk by chunk as it comes in, revalidating with the site
+        when we've seen it before. Only a page that's read to the end gets cached"""
+        headers = {}
+        cached = self.validators.get(url)
+        if cached is not None:
+            etag, last_modified, _ = cached
+            if etag is not None:
+                headers['If-None-Match'] = etag
+            if last_modified is not None:
+                headers['If-Modified-Since'] = last_modified
+        if self.hedger is None:
+            resp = self.http.get(url, headers=headers, stream=True)
+        else:
+            resp = self.hedger.run(parse.urlparse(url).hostname,
+                                   lambda: self.http.get(url, headers=headers, stream=True))
+        try:
+            if resp.status_code == 304 and cached is not None:
+                yield cached[2]
+                return
+            etag = resp.headers.get('ETag')
+            last_modified = resp.headers.get('Last-Modified')
+            keep = resp.status_code == 200 and (etag is not None or last_modified is not None)
+            body = []
+            for chunk in resp.iter_content(chunk_size=chunk_size):
+                if keep:
+                    body.append(chunk)
+                yield chunk
+            if keep:
+                self.validators.set(url, (etag, last_modified, b''.join(body)))
+        finally:
+            resp.close()
+
+    def _iter_parsed(self, url: str, tag: str) -> Iterator[etree.ElementBase]:
+        """Yields the page's `tag` elements one by one, as soon as each has been parsed (while the rest
+        of the page is still coming in)"""
+        parser = etree.HTMLPullParser(events=('end',), tag=tag, encoding='utf-8')
+        for chunk in self._stream(url):
+            parser.feed(chunk)
+            for _, elem in parser.read_events():
+                yield elem
+        parser.close()
+        for _, elem in parser.read_events():
+            yield elem
+
+    def _prep_for_xpath(self, url: str) -> etree.ElementBase:
         """Takes in a url and returns a tree that can be searched using xpath"""
-        page = requests.get(url)
-        html = page.content.decode('utf-8')
+        html = self._get(url).decode('utf-8')
         parser = etree.HTMLParser()
         tree = etree.parse(StringIO(html), parser=parser)
         return tree
 
-    def get_etymology(self, message: str, pattern: str):
+    @friendly_failures
+    def get_etymology(self, message: str, pattern: str) -> str:
         """Grabs the etymology of a word from Etymonline"""
+        return ''.join(self.stream_etymology(message, pattern))
 
-        def get_definition_name(res: etree.ElementBase) -> str:
-            item_str = ''
-            for elem in res.xpath('object/a'):
-                for x in elem.iter():
-                    for item in [x.text, x.tail]:
-                        if item is not None:
-                            if item.strip() != '':
-                                item_str += f' {item}'
-            return item_str.strip()
+    @staticmethod
+    def _get_definition_name(res: etree.ElementBase) -> str:
+        item_str = ''
+        for elem in res.xpath('object/a'):
+            for x in elem.iter():
+                for item in [x.text, x.tail]:
+                    if item is not None:
+                        if item.strip() != '':
+                            item_str += f' {item}'
+        return item_str.strip()
 
+    @friendly_failures
+    def stream_etymology(self, message: str, pattern: str) -> Iterator[str]:
+        """Grabs the etymology of a word from Etymonline, yielding each entry as soon as it's parsed"""
         word = re.sub(pattern, '', message).strip()
 
         url = f'https://www.etymonline.com/search?q={parse.quote(word)}'
-        content = self._prep_for_xpath(url)
-        results = content.xpath('//div[contains(@class, "word--C9UPa")]')
-        output = ':word:\n'
-        if len(results) > 0:
-            for result in results:
-                name = get_definition_name(result)
-                if word in name:
-                    desc = ' '.join([x for elem in result.xpath('object/section') for x in elem.itertext()])
-                    desc = ' '.join([f'_{x}_' for x in desc.split('\n') if x.strip() != ''])
-                    output += f'*`{name}`*:\n{desc}\n'
-
-        if output != '':
-            return output
-        else:
-            return f'No etymological data found for `{word}`.'
+        header = ':word:\n'
+        for result in self._iter_parsed(url, 'div'):
+            if 'word--C9UPa' not in result.get('class', ''):
+                continue
+            name = self._get_definition_name(result)
+            if word in name:
+                desc = ' '.join([x for elem in result.xpath('object/section') for x in elem.itertext()])
+                desc = ' '.join([f'_{x}_' for x in desc.split('\n') if x.strip() != ''])
+                # The header goes out with the first entry
+                yield f'{header}*`{name}`*:\n{desc}\n'
+                header = ''
 
+        if header != '':
+            yield f'No etymological data found for `{word}`.'
+
+    @friendly_failures
     def prep_message_for_translation(self, message: str, match_pattern: str) -> Optional[str]:
         """Takes in the raw message and prepares it for lookup"""
         # Format should be like `et <word>` or `en <word>`
@@ -65,12 +146,26 @@ class Linguistics:
         processed_word = self.get_root(word) if target == 'en' else word
 
         if processed_word is not None:
+            check_deadline('translating')
             return self._get_translation(processed_word, target)
         else:
             return f'Translation not found for `{word}`.'
 
     def _get_translation(self, word: str, target: str = 'en') -> str:
         """Returns the English translation of the Estonian word"""
+        result = self.lookup_translations(word, target)
+        if len(result) > 0:
+            return f"`{word}`: {', '.join(result)}"
+        else:
+            return f'No results found for `{word}` :frowning:'
+
+    def lookup_translations(self, word: str, target: str = 'en') -> List[str]:
+        """Returns a list of translations of the word into the target language (cached)"""
+        return self.cache.get_or_compute(('translation', word, target),
+                                         lambda: self._fetch_translations(word, target))
+
+    def _fetch_translations(self, word: str, target: str = 'en') -> List[str]:
+        """Scrapes the translations of the word from EKI"""
         # Find the English translation of the word using EKI
         eki_url = f'http://www.eki.ee/dict/ies/index.cgi?Q={parse.quote(word)}&F=V&C06={target}'
         content = self._prep_for_xpath(eki_url)
@@ -90,50 +185,67 @@ class Linguistics:
                 if word in en_result:
                     result += et_result
 
-        if len(result) > 0:
-            # Make all entries lowercase and remove dupes
-            result = list(set(map(str.lower, result)))
-            return f"`{word}`: {', '.join(result)}"
-        else:
-            return f'No results found for `{word}` :frowning:'
+        # Make all entries lowercase and remove dupes
+        return list(set(map(str.lower, result)))
 
+    @friendly_failures
     def prep_message_for_examples(self, message: str, match_pattern: str) -> Optional[str]:
         """Takes in the raw message and prepares it for lookup"""
+        return ''.join(self.stream_examples(message, match_pattern))
+
+    @friendly_failures
+    def stream_examples(self, message: str, match_pattern: str) -> Iterator[str]:
+        """Takes in the raw message and yields its example sentences one at a time"""
         # Format should be like `et <word>` or `en <word>`
         word = re.sub(match_pattern, '', message).strip()
         processed_word = self.get_root(word)
 
         if processed_word is not None:
-            return self._get_examples(processed_word, max_n=5)
+            check_deadline('collecting examples')
+            yield from self._iter_examples(processed_word, max_n=5)
         else:
-            return f'No examples found for `{word}`.'
+            yield f'No examples found for `{word}`.'
 
     def _get_examples(self, word: str, max_n: int = 5) -> str:
         """Returns some example sentences of the Estonian word"""
+        return ''.join(self._iter_examples(word, max_n=max_n))
+
+    def _iter_examples(self, word: str, max_n: int = 5) -> Iterator[str]:
+        """Yields some example sentences of the Estonian word (the first one with the header)"""
+        exp_list = self.lookup_examples(word)
+        if len(exp_list) > 0:
+            if len(exp_list) > max_n:
+                exp_list = [exp_list[x] for x in np.random.choice(len(exp_list), max_n, False).tolist()]
+            yield f'Examples for `{word}`:\n`{exp_list[0]}`'
+            for x in exp_list[1:]:
+                yield f'\n`{x}`'
+            return
+
+        yield f'No example sentences found for `{word}`'
+
+    def lookup_examples(self, word: str) -> List[str]:
+        """Returns all the example sentences of the Estonian word (cached)"""
+        return self.cache.get_or_compute(('examples', word), lambda: self._fetch_examples(word))
+
+    def _fetch_examples(self, word: str) -> List[str]:
+        """Scrapes the example sentences of the Estonian word from EKSS"""
         # Find the English translation of the word using EKI
         ekss_url = f'http://www.eki.ee/dict/ekss/index.cgi?Q={parse.quote(word)}&F=M'
-        content = self._prep_for_xpath(ekss_url)
-
-        results = content.xpath('//div[@class="tervikart"]')
-        exp_list = []
-        for i in range(0, len(results)):
-            result = content.xpath(f'(//div[@class="tervikart"])[{i + 1}]/*/span[@class="m leitud_id"]')
-            examples = content.xpath(f'(//div[@class="tervikart"])[{i + 1}]/*/span[@class="n"]')
+        # Entries are checked as they're parsed - the rest of the page isn't downloaded once the word's found
+        for entry in self._iter_parsed(ekss_url, 'div'):
+            if entry.get('class') != 'tervikart':
+                continue
             # Process text in elements
-            result = [''.join(x.itertext()) for x in result]
-            examples = [''.join(x.itertext()) for x in examples]
+            result = [''.join(x.itertext()) for x in entry.xpath('*/span[@class="m leitud_id"]')]
+            examples = [''.join(x.itertext()) for x in entry.xpath('*/span[@class="n"]')]
             if word in result:
-                re.split(r'[?.!]', ''.join(examples))
-                exp_list += re.split(r'[?.!]', ''.join(examples))
+                exp_list = re.split(r'[?.!]', ''.join(examples))
                 # Strip of leading / tailing whitespace
-                exp_list = [x.strip() for x in exp_list if x.strip() != '']
-                if len(exp_list) > max_n:
-                    exp_list = [exp_list[x] for x in np.random.choice(len(exp_list), max_n, False).tolist()]
-                examples = '\n'.join([f'`{x}`' for x in exp_list])
-                return f'Examples for `{word}`:\n{examples}'
+                return [x.strip() for x in exp_list if x.strip() != '']
 
-        return f'No example sentences found for `{word}`'
+        return []
 
+    @friendly_failures
     def prep_message_for_root(self, message: str, match_pattern: str) -> Optional[str]:
         """Takes in the raw message and prepares it for lookup"""
         # Format should be like `lemma <word>`
@@ -147,17 +259,74 @@ class Linguistics:
         else:
             return f'Lemmatization not found for `{word}`.'
 
-    @staticmethod
-    def get_root(word: str) -> Optional[str]:
-        """Retrieves the root word (nom. sing.) from Lemmatiseerija"""
+    def get_root(self, word: str) -> Optional[str]:
+        """Retrieves the root word (nom. sing.) from Lemmatiseerija (cached)"""
+        return self.cache.get_or_compute(('root', word), lambda: self._fetch_root(word))
+
+    def _fetch_root(self, word: str) -> Optional[str]:
+        """Looks up the root word (nom. sing.) with Lemmatiseerija"""
         # First, look up the word's root with the lemmatiseerija
         lemma_url = f'https://www.filosoft.ee/lemma_et/lemma.cgi?word={parse.quote(word)}'
-        content = requests.get(lemma_url).content
-        content = str(content, 'utf-8')
+        content = str(self._get(lemma_url), 'utf-8')
         # Use regex to find the word/s
         lemma_regex = re.compile(r'<strong>.*na\slemma[d]?\son:</strong><br>(\w+)<br>')
         match = lemma_regex.search(content)
         word = None
         if match is not None:
             word = match.group(1)
-        return word
\ No newline at end of file
+        return word
+
+    def lookup(self, word: str, operation: str) -> dict:
+        """Runs a single bulk lookup operation on the word, returning the structured result
+
+        Args:
+            word: str, the word to process
+            operation: str, one of `batch_operations`
+                lemma: the Estonian lemma of the word
+                translate-en: lemmatizes the Estonian word, then translates it into English
+                translate-et: translates the English word into Estonian
+                examples: lemmatizes the Estonian word, then collects example sentences
+        """
+        if operation not in self.batch_operations:
+            raise ValueError(f'Unknown operation: {operation}')
+        result = {'word': word, 'operation': operation}
+        if operation == 'translate-et':
+            result['result'] = self.lookup_translations(word, 'et')
+            return result
+        lemma = self.get_root(word)
+        result['lemma'] = lemma
+        if operation == 'lemma' or lemma is None:
+            result['result'] = lemma if operation == 'lemma' else []
+        elif operation == 'translate-en':
+            result['result'] = self.lookup_translations(lemma, 'en')
+        else:
+            result['result'] = self.lookup_examples(lemma)
+        return result
+
+    def batch_lookup(self, words: List[str], operation: str, max_workers: int = 4) -> Iterator[dict]:
+        """Runs the lookup operation over a list of words concurrently,
+        yielding each result as soon as it's done (i.e., not necessarily in input order)
+
+        Args:
+            words: list of str, the words to process. Duplicates are only looked up once
+            operation: str, one of `batch_operations`
+            max_workers: int, the maximum number of lookups to run at once
+        """
+        if operation not in self.batch_operations:
+            raise ValueError(f'Unknown operation: {operation}')
+        unique_words = list(dict.fromkeys(w.strip() for w in words if w.strip() != ''))
+        if len(unique_words) == 0:
+            return
+        executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(unique_words))))
+        futures = {executor.submit(self.lookup, word, operation): word for word in unique_words}
+        try:
+            for future in as_completed(futures):
+                try:
+                    yield future.result()
+                except Exception as e:
+                    yield {'word': futures[future], 'operation': operation, 'error': str(e)}
+        finally:
+            # If the consumer stops early (e.g., the client disconnected), drop the remaining work
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Logging that stays off the hot path: handlers only queue records, a background thread writes them"""
+import copy
+import queue
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import QueueHandler
+from typing import Dict, Iterator, List, Optional, Tuple
+from .metrics import metrics, Metrics
+
+
+_current_event = ContextVar('sasha_event', default=None)
+# Handlers whose writes we can batch. Others (e.g., rotating files) get each record handed to them as usual
+_BATCHABLE = (logging.StreamHandler, logging.FileHandler)
+_STOP = object()
+_EXC_FORMATTER = logging.Formatter()
+
+
+class _Event:
+    """One event's share of the logging context: its type, and whether its records make the sample"""
+    __slots__ = ('event_type', 'keep')
+
+    def __init__(self, event_type: str):
+        self.event_type = event_type
+        self.keep = None  # type: Optional[bool]  # Decided when the event first logs something
+
+
+@contextmanager
+def event_scope(event_type: str) -> Iterator[None]:
+    """Tags everything logged within the block (and work it submits) with the Slack event type, for sampling.
+    An event's records are sampled together, so an event is either logged in full or not at all"""
+    token = _current_event.set(_Event(event_type))
+    try:
+        yield
+    finally:
+        _current_event.reset(token)
+
+
+class QueueLogHandler(QueueHandler):
+    """Stands in for a logger's handlers, putting its records on the writer's queue. Never blocks:
+    when the queue's full, the record's dropped (and counted)"""
+
+    def __init__(self, writer: 'LogWriter', targets: List[logging.Handler]):
+        """
+        Args:
+            writer: LogWriter, writes the records
+            targets: list of logging.Handler, the handlers the records are meant for
+        """
+        super().__init__(writer.queue)
+        self.writer = writer
+        self.targets = targets
+
+    def emit(self, record: logging.LogRecord):
+        event = _current_event.get()
+        if getattr(record, 'event_type', None) is None:
+            record.event_type = None if event is None else event.event_type
+        # Sampled out before any work goes into the record
+        if not self.writer.keep(record, event):
+            return
+        try:
+            self.enqueue(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatting is left to the writer, but by the time it gets to the record, the args may have changed
+        #   and the traceback's gone - so both get rendered into the record now
+        if record.exc_info and record.exc_text is None:
+            record.exc_text = _EXC_FORMATTER.formatException(record.exc_info)
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait((self.targets, record))
+        except queue.Full:
+            self.writer.metrics.inc('logs.dropped')
+
+
+class LogWriter:
+    """Writes log records in a background thread.
+
+    Whatever's queued up gets written in one go: formatted, written to each stream at once and flushed once.
+        Records tagged with a high-volume event type (see `event_scope`) can be sampled, keeping the records of
+        1 in N of those events. Warnings and errors are always kept.
+    """
+
+    def __init__(self, max_queue: int = 10000, batch_size: int = 500, sample_every: Optional[Dict[str, int]] = None,
+                 registry: Metrics = metrics):
+        """
+        Args:
+            max_queue: int, the most records waiting to be written (anything more is dropped)
+            batch_size: int, the most records written per flush
+            sample_every: dict, event type -> N, to only keep the records of every Nth event of the type
+            registry: Metrics, where written / dropped / sampled out records get counted
+        """
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.batch_size = batch_size
+        self.sample_every = {} if sample_every is None else sample_every
+        self.metrics = registry
+        self._seen = {}  # type: Dict[str, int]
+        self._lock = threading.Lock()
+        self._installed = []  # type: List[Tuple[logging.Logger, QueueLogHandler]]
+        self._thread = threading.Thread(target=self._loop, name='log-writer', daemon=True)
+        self._thread.start()
+        self.metrics.register_gauge('logs.queued', self.queue.qsize)
+
+    def install(self, logger: logging.Logger):
+        """Moves the logger's handlers behind the queue"""
+        targets = list(logger.handlers)
+        if len(targets) == 0:
+            return
+        handler = QueueLogHandler(self, targets)
+        for target in targets:
+            logger.removeHandler(target)
+        logger.addHandler(handler)
+        self._installed.append((logger, handler))
+
+    def install_tree(self, name: str):
+        """Moves the handlers of the named logger and all of its children behind the queue"""
+        names = [name] + [x for x in list(logging.Logger.manager.loggerDict.keys()) if x.startswith(f'{name}.')]
+        for logger_name in names:
+            logger = logging.getLogger(logger_name)
+            if not any(isinstance(x, QueueLogHandler) for x in logger.handlers):
+                self.install(logger)
+
+    def keep(self, record: logging.LogRecord, event: Optional[_Event] = None) -> bool:
+        """Whether the record makes the sample. Within an `event_scope`, that's decided once for the whole event"""
+        event_type = getattr(record, 'event_type', None)
+        every = self.sample_every.get(event_type, 1)
+        if every <= 1 or record.levelno >= logging.WARNING:
+            return True
+        with self._lock:
+            if event is None or event.event_type != event_type:
+                # Tagged by hand - sampled record by record
+                keep = self._next_in_sample(event_type, every)
+            else:
+                if event.keep is None:
+                    event.keep = self._next_in_sample(event_type, every)
+                keep = event.keep
+        if not keep:
+            self.metrics.inc('logs.sampled_out')
+        return keep
+
+    def _next_in_sample(self, event_type: str, every: int) -> bool:
+        seen = self._seen[event_type] = self._seen.get(event_type, 0) + 1
+        return (seen - 1) % every == 0
+
+    def _loop(self):
+        while True:
+            item = self.queue.get()
+            batch = []
+            # Take whatever else is already waiting, up to a batch
+            while item is not _STOP:
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            if len(batch) > 0:
+                try:
+                    self._write(batch)
+                except Exception:
+                    self.metrics.inc('logs.errors')
+            if item is _STOP:
+                return
+
+    def _write(self, batch: List[Tuple[List[logging.Handler], logging.LogRecord]]):
+        lines = {}  # type: Dict[logging.Handler, List[str]]
+        for targets, record in batch:
+            for handler in targets:
+                if record.levelno < handler.level:
+                    continue
+                if type(handler) not in _BATCHABLE or handler.stream is None:
+                    handler.handle(record)
+                elif handler.filter(record):
+                    try:
+                        lines.setdefault(handler, []).append(handler.format(record) + handler.terminator)
+                    except Exception:
+                        handler.handleError(record)
+        for handler, handler_lines in lines.items():
+            handler.acquire()
+            try:
+                handler.stream.write(''.join(handler_lines))
+                handler.stream.flush()
+            except Exception:
+                self.metrics.inc('logs.errors')
+            finally:
+                handler.release()
+        self.metrics.inc('logs.written', len(batch))
+
+    def stop(self, timeout: float = 5):
+        """Writes out what's queued, then hands the loggers their handlers back"""
+        try:
+            self.queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        for logger, handler in self._installed:
+            logger.removeHandler(handler)
+            for target in handler.targets:
+                logger.addHandler(target)
+        self._installed = []
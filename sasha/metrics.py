@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import threading
+from typing import Any, Callable, Dict, Union
+
+
+class Metrics:
+    """A simple thread-safe registry of counters and gauges"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}  # type: Dict[str, Union[int, float]]
+        self.gauges = {}  # type: Dict[str, Any]
+        # Gauges that are computed only when a snapshot is taken
+        self._gauge_funcs = {}  # type: Dict[str, Callable[[], Any]]
+
+    def inc(self, name: str, value: Union[int, float] = 1):
+        """Increments a counter"""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: Any):
+        """Sets the current value of a gauge"""
+        with self._lock:
+            self.gauges[name] = value
+
+    def register_gauge(self, name: str, func: Callable[[], Any]):
+        """Registers a gauge whose value is read from the function whenever a snapshot is taken"""
+        with self._lock:
+            self._gauge_funcs[name] = func
+
+    def get(self, name: str, default: Any = 0) -> Any:
+        """Returns the current value of a counter or gauge"""
+        with self._lock:
+            if name in self.counters:
+                return self.counters[name]
+            if name in self.gauges:
+                return self.gauges[name]
+            func = self._gauge_funcs.get(name)
+        return default if func is None else func()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Returns the current values of all counters and gauges"""
+        with self._lock:
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            funcs = dict(self._gauge_funcs)
+        for name, func in funcs.items():
+            try:
+                gauges[name] = func()
+            except Exception as e:
+                gauges[name] = f'error: {e}'
+        return {'counters': counters, 'gauges': gauges}
+
+
+# Process-wide registry
+metrics = Metrics()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Command groups, loaded on first use.
+
+Each plugin is a module in this package with a `setup(bot)` function that returns the object its commands
+    are called on. Only the metadata below is needed to list the commands (e.g., for help), so a plugin's
+    imports and resources are only loaded once one of its commands is actually used.
+"""
+import time
+import threading
+import importlib
+from typing import Any, Dict, List, Optional
+from ..metrics import metrics, Metrics
+
+
+class Command:
+    """A command's metadata: how it's triggered, how it shows up in help and what it does"""
+
+    def __init__(self, regex: str, pattern: str, desc: str, value: Optional[str] = None,
+                 func: Optional[str] = None, args: Optional[List[str]] = None, cat: Optional[str] = None):
+        """
+        Args:
+            regex: str, the regex that triggers the command
+            pattern: str, how the command is written out in help
+            desc: str, what the command does
+            value: str, static response (when there's no func)
+            func: str, name of the method on the plugin's object that handles the command
+            args: list of str, event values the method gets called with (e.g., 'channel', 'message')
+            cat: str, the help category, if other than the plugin's
+        """
+        self.regex = regex
+        self.pattern = pattern
+        self.desc = desc
+        self.value = value
+        self.func = func
+        self.args = [] if args is None else args
+        self.cat = cat
+
+
+class Plugin:
+    """A group of commands, implemented in `module`"""
+
+    def __init__(self, name: str, module: str, commands: List[Command], cat: Optional[str] = None):
+        """
+        Args:
+            name: str, the plugin's name
+            module: str, the module with the plugin's `setup(bot)` function
+            commands: list of Command, the commands the plugin offers
+            cat: str, the help category of the commands (defaults to the name)
+        """
+        self.name = name
+        self.module = module
+        self.commands = commands
+        self.cat = name if cat is None else cat
+
+
+class LazyCommand:
+    """Stands in for a plugin's method, loading the plugin the first time it's called"""
+
+    def __init__(self, plugins: 'PluginRegistry', plugin: str, func: str):
+        self.plugins = plugins
+        self.plugin = plugin
+        self.func = func
+        self.__name__ = func
+
+    def __call__(self, *args, **kwargs):
+        return getattr(self.plugins.load(self.plugin), self.func)(*args, **kwargs)
+
+    def __repr__(self) -> str:
+        return f'LazyCommand({self.plugin}.{self.func})'
+
+
+class PluginRegistry:
+    """Knows about all the plugins, but only loads them when needed"""
+
+    def __init__(self, bot: Any, plugins: Optional[List[Plugin]] = None, registry: Metrics = metrics):
+        """
+        Args:
+            bot: Sasha, handed to each plugin's `setup`
+            plugins: list of Plugin, defaults to all of Sasha's plugins
+            registry: Metrics, where plugin load times get reported
+        """
+        self.bot = bot
+        self.metrics = registry
+        self.plugins = {x.name: x for x in (PLUGINS if plugins is None else plugins)}
+        self._loaded = {}  # type: Dict[str, Any]
+        self._lock = threading.Lock()
+
+    @property
+    def categories(self) -> List[str]:
+        cats = []
+        for plugin in self.plugins.values():
+            for cat in [plugin.cat] + [x.cat for x in plugin.commands if x.cat is not None]:
+                if cat not in cats:
+                    cats.append(cat)
+        return cats
+
+    @property
+    def loaded(self) -> List[str]:
+        return list(self._loaded.keys())
+
+    def load(self, name: str) -> Any:
+        """Returns the plugin's object, importing and setting it up if that hasn't happened yet"""
+        obj = self._loaded.get(name)
+        if obj is not None:
+            return obj
+        with self._lock:
+            if name not in self._loaded:
+                start = time.perf_counter()
+                module = importlib.import_module(self.plugins[name].module)
+                self._loaded[name] = module.setup(self.bot)
+                self.metrics.set_gauge(f'plugins.{name}.load_seconds', time.perf_counter() - start)
+            return self._loaded[name]
+
+    def commands(self) -> Dict[str, dict]:
+        """All the plugins' commands, in the shape SlackBotBase takes them. Doesn't load any plugins."""
+        commands = {}
+        for plugin in self.plugins.values():
+            for cmd in plugin.commands:
+                if cmd.func is None:
+                    value = cmd.value
+                else:
+                    value = [LazyCommand(self, plugin.name, cmd.func)] + cmd.args
+                commands[cmd.regex] = {
+                    'pattern': cmd.pattern,
+                    'cat': plugin.cat if cmd.cat is None else cmd.cat,
+                    'desc': cmd.desc,
+                    'value': value,
+                }
+        return commands
+
+
+PLUGINS = [
+    Plugin('basic', 'sasha.plugins.basic', [
+        Command(r'good bo[tiy]', 'good bo[tiy]', 'Did I do something right for once?', value='thanks <@{user}>!'),
+        Command(r'^time$', 'time', 'Display current server time', func='get_time'),
+        Command(r'^speak$', 'speak', '_Really_ basic response here.', value='woof'),
+    ]),
+    Plugin('useful', 'sasha.plugins.useful', [
+        Command(r'^wfh\s?(time|epoch)', 'wfh (time|epoch)', 'Prints the current WFH epoch time', func='wfh_epoch'),
+    ]),
+    Plugin('not so useful', 'sasha.plugins.notsouseful', [
+        Command(r'.*inspir.*', '<any text with "inspir" in it>', 'Uploads an inspirational picture',
+                func='inspirational', args=['channel']),
+        Command(r'.*tihi.*', '<any text with "tihi" in it>', 'Giggles', func='giggle'),
+    ]),
+    Plugin('language', 'sasha.plugins.language', [
+        Command(r'^e[nt]\s', '(et|en) <word-to-translate>',
+                'Offers a translation of an Estonian word into English or vice-versa',
+                func='prep_message_for_translation', args=['message', 'match_pattern']),
+        Command(r'^ekss\s', 'ekss <word-to-lookup>', 'Offers example usage of the given Estonian word',
+                func='stream_examples', args=['message', 'match_pattern']),
+        Command(r'^lemma\s', 'lemma <word-to-lookup>', 'Determines the lemma of the Estonian word',
+                func='prep_message_for_root', args=['message', 'match_pattern']),
+        Command(r'^ety\s', 'ety <word>', 'Gets the etymology of a given word',
+                func='stream_etymology', args=['message', 'match_pattern'], cat='useful'),
+    ]),
+]
@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from datetime import datetime as dt
+
+
+class Basic:
+    """Basic commands"""
+
+    @staticmethod
+    def get_time() -> str:
+        """Gets the server time"""
+        return f'The server time is `{dt.today():%F %T}`'
+
+
+def setup(bot) -> Basic:
+    return Basic()
@@ -0,0 +1,9 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from ..hedging import Hedger
+from ..linguistics import Linguistics
+
+
+def setup(bot) -> Linguistics:
+    # Dictionary site latencies are long-tailed, so hedge the slowest lookups (at most 10% extra load)
+    return Linguistics(http=bot.http, hedger=Hedger(percentile=95))
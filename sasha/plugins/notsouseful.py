@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from random import randint
+from typing import Tuple
+from ..context import check_deadline
+from ..prefetch import PrefetchPool
+from ..resilience import DependencyUnavailable, friendly_failures
+
+
+class NotSoUseful:
+    """Commands of questionable use"""
+    inspirobot_url = 'https://inspirobot.me/api?generate=true'
+
+    def __init__(self, bot):
+        self.bot = bot
+        # A few inspirational images kept ready, so the command only has to upload one
+        self.pool = PrefetchPool('inspirational', self._fetch_inspirational, size=3, max_age=60 * 60 * 6)
+
+    @staticmethod
+    def giggle() -> str:
+        """Laughs, uncontrollably at times"""
+        # Count the 'no's
+        laugh_cycles = randint(1, 500)
+        response = f'ti{"hi" * laugh_cycles}!'
+        return response
+
+    def _fetch_inspirational(self) -> Tuple[bytes, str]:
+        """Generates and downloads an inspirational image, for the pool"""
+        resp = self.bot.http.get(self.inspirobot_url)
+        if resp.status_code != 200:
+            raise DependencyUnavailable('inspirobot.me', f'status {resp.status_code}')
+        img = self.bot.http.get(resp.text)
+        if img.status_code != 200:
+            raise DependencyUnavailable('generated.inspirobot.me', f'status {img.status_code}')
+        if len(img.content) > self.bot.uploader.max_bytes:
+            raise DependencyUnavailable('generated.inspirobot.me', f'image too large ({len(img.content)} bytes)')
+        return img.content, img.headers.get('Content-Type', 'image/jpeg')
+
+    @friendly_failures
+    def inspirational(self, channel: str):
+        """Sends a random inspirational message"""
+        ready = self.pool.take()
+        # Top the pool back up for next time
+        self.pool.refill_async()
+        if ready is not None:
+            content, content_type = ready
+            self.bot.uploader.upload(channel, [content], 'inspirational-shit.jpg', content_type=content_type,
+                                     length=len(content))
+            return
+        # Nothing ready - generate one on the spot
+        resp = self.bot.http.get(self.inspirobot_url)
+        if resp.status_code == 200:
+            url = resp.text
+            # Download img
+            check_deadline('downloading image')
+            img = self.bot.http.get(url, stream=True)
+            try:
+                if img.status_code == 200:
+                    check_deadline('uploading image')
+                    # Piped straight through to Slack as it downloads
+                    self.bot.uploader.relay(channel, img, 'inspirational-shit.jpg')
+            finally:
+                img.close()
+
+
+def setup(bot) -> NotSoUseful:
+    return NotSoUseful(bot)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from datetime import datetime as dt
+from typing import List
+from slacktools import BlockKitBuilder
+
+
+class Useful:
+    """Commands of some actual use"""
+
+    def __init__(self, bkb: BlockKitBuilder):
+        self.bkb = bkb
+
+    def wfh_epoch(self) -> List[dict]:
+        """Calculates WFH epoch time"""
+        wfh_epoch = dt(year=2020, month=3, day=3, hour=19, minute=15)
+        now = dt.now()
+        diff = (now - wfh_epoch)
+        wfh_secs = diff.total_seconds()
+        strange_units = {
+            'dog years_2': (wfh_secs / (60 * 60 * 24)) / 52,
+            'hollow months_2': wfh_secs / (60 * 60 * 24 * 29),
+            'fortnights_1': wfh_secs / (60 * 60 * 24 * 7 * 2),
+            'kilowarhols_1': wfh_secs / (60 * 15000),
+            'weeks_1': wfh_secs / (60 * 60 * 24 * 7),
+            'sols_1': wfh_secs / (60 * 60 * 24 + 2375),
+            'microcenturies_0': wfh_secs / (52 * 60 + 35.76),
+            'Kermits_1': wfh_secs / 60 / 14.4,
+            'moments_0': wfh_secs / 90,
+            'millidays_2': wfh_secs / 86.4,
+            'microfortnights_2': wfh_secs * 1.2096,
+        }
+
+        units = []
+        for k, v in strange_units.items():
+            unit, decimals = k.split('_')
+            decimals = int(decimals)
+            base_txt = f',.{decimals}f'
+            txt = '`{{:<20}} {{:>15{}}}`'.format(base_txt).format(f'{unit.title()}:', v)
+            units.append(txt)
+
+        unit_txt = '\n'.join(units)
+        return [
+            self.bkb.make_context_section('WFH Epoch'),
+            self.bkb.make_block_section(
+                f'Current WFH epoch time is *`{wfh_secs:.0f}`*.'
+                f'\n ({diff})',
+            ),
+            self.bkb.make_context_section(f'{unit_txt}')
+        ]
+
+
+def setup(bot) -> Useful:
+    return Useful(bot.bkb)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Optional, Tuple
+from .metrics import metrics, Metrics
+
+
+class PrefetchPool:
+    """Keeps a few expensive-to-get items (e.g., generated images) ready ahead of being asked for.
+
+    Items are taken oldest first. Refills happen in the pool's own background thread, fetching at most
+        `per_refill` items each time, so how often `refill` gets called controls the load on the source.
+        Items older than `max_age` are thrown out rather than handed out. `in_use` says whether anything's
+        been asked of the pool yet, so periodic refills can wait until someone actually wants the items.
+    """
+
+    def __init__(self, name: str, fetch_func: Callable[[], Any], size: int = 3, max_age: float = 60 * 60,
+                 per_refill: int = 1, registry: Metrics = metrics):
+        """
+        Args:
+            name: str, the pool's name in metrics
+            fetch_func: callable, gets a new item (raising if it can't)
+            size: int, the most items to keep ready
+            max_age: float, seconds an item stays usable
+            per_refill: int, the most items fetched in one refill
+            registry: Metrics, where hits, misses and fetch failures get reported
+        """
+        self.name = name
+        self.fetch_func = fetch_func
+        self.size = size
+        self.max_age = max_age
+        self.per_refill = per_refill
+        self.metrics = registry
+        self.in_use = False
+        self._items = deque()  # type: Deque[Tuple[float, Any]]
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'prefetch-{name}')
+        self._refilling = None  # type: Optional[Future]
+        self.metrics.register_gauge(f'prefetch.{name}.ready', lambda: len(self._items))
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.max_age
+        with self._lock:
+            while len(self._items) > 0 and self._items[0][0] < cutoff:
+                self._items.popleft()
+                self.metrics.inc(f'prefetch.{self.name}.expired')
+
+    def take(self) -> Optional[Any]:
+        """Hands out the oldest usable item, or None if there's none ready"""
+        self.in_use = True
+        self._expire()
+        with self._lock:
+            if len(self._items) > 0:
+                self.metrics.inc(f'prefetch.{self.name}.hits')
+                return self._items.popleft()[1]
+        self.metrics.inc(f'prefetch.{self.name}.misses')
+        return None
+
+    def refill(self) -> int:
+        """Tops up the pool (at most `per_refill` items)
+
+        Returns:
+            int, the number of items added
+        """
+        self._expire()
+        added = 0
+        while added < self.per_refill and len(self._items) < self.size:
+            try:
+                item = self.fetch_func()
+            except Exception:
+                # Try again next refill
+                self.metrics.inc(f'prefetch.{self.name}.failures')
+                break
+            with self._lock:
+                self._items.append((time.monotonic(), item))
+            added += 1
+        return added
+
+    def refill_async(self) -> Optional[Future]:
+        """Starts a refill in the background, unless one's already going"""
+        with self._lock:
+            if self._refilling is not None and not self._refilling.done():
+                return None
+            full = len(self._items) > 0 and len(self._items) >= self.size
+            if full and time.monotonic() - self._items[0][0] < self.max_age:
+                # Nothing to do until something's taken or expires
+                return None
+            self._refilling = self._pool.submit(self.refill)
+            return self._refilling
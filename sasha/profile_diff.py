@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import time
+from typing import Any, Dict, Optional, Tuple, Union
+from .accumulators import DictAccumulator
+from .avatars import AvatarFingerprinter
+from .metrics import metrics, Metrics
+from .users import REPORTED_FIELDS, UserRecord
+
+
+def reported_values(user: Union[dict, UserRecord]) -> Tuple[str, ...]:
+    """Pulls out the values of the reported fields"""
+    return tuple(user.get(k) or '' for k in REPORTED_FIELDS)
+
+
+def fingerprint(user: Union[dict, UserRecord]) -> int:
+    """A compact fingerprint of the reported fields (only meaningful within the same process)"""
+    return hash(reported_values(user))
+
+
+def _merge_changes(first: dict, last: dict) -> dict:
+    """Collapses two changes to the same user into one first-old -> last-new transition"""
+    return {'old': first['old'], 'new': last['new'], 'at': first['at']}
+
+
+class ProfileDiffer:
+    """Turns `user_change` events into the profile changes worth reporting.
+
+    Keeps one fingerprint of the reported fields per user, so events that don't touch
+        any of them are dropped in O(1). Multiple changes to the same user before the next digest
+        are merged into a single transition, and users that changed back to where they started are dropped.
+        Avatar changes where only the url changed (not the picture) are ignored when an AvatarFingerprinter is given.
+    """
+
+    def __init__(self, avatars: Optional[AvatarFingerprinter] = None, registry: Metrics = metrics):
+        """
+        Args:
+            avatars: AvatarFingerprinter, for checking whether a new avatar url really is a new picture
+            registry: Metrics, where no-op / merged / reverted counts get reported
+        """
+        self.avatars = avatars
+        self.metrics = registry
+        self.fingerprints = {}  # type: Dict[str, int]
+        self.updates = DictAccumulator(merge=_merge_changes)
+
+    def __len__(self) -> int:
+        return len(self.updates)
+
+    def seed(self, users: Dict[str, Union[dict, UserRecord]]):
+        """Sets the baseline fingerprints from the user directory"""
+        self.fingerprints.update({uid: fingerprint(user) for uid, user in users.items()})
+
+    def observe(self, uid: str, old: Union[dict, UserRecord], new: Union[dict, UserRecord]) -> bool:
+        """Registers a user's profile change.
+
+        Args:
+            uid: str, the user's id
+            old: dict or UserRecord, the user's info as we last reported it
+            new: dict or UserRecord, the user's info from the event
+        Returns:
+            bool, False if none of the reported fields changed
+        """
+        new_fp = fingerprint(new)
+        if self.fingerprints.get(uid, fingerprint(old)) == new_fp:
+            self.metrics.inc('profiles.noop_events')
+            return False
+        self.fingerprints[uid] = new_fp
+        change = {'old': UserRecord.from_dict(old, uid=uid), 'new': UserRecord.from_dict(new, uid=uid),
+                  'at': time.time()}
+        if self.avatars is not None and change['old']['avi'] != change['new']['avi']:
+            # Get the images hashed in the background, well before the digest goes out
+            for url in [change['old']['avi'], change['new']['avi']]:
+                if url != '':
+                    self.avatars.prefetch(url)
+        self.updates.put(uid, change)
+        self.metrics.inc('profiles.changes')
+        return True
+
+    def take(self) -> Dict[str, dict]:
+        """Takes all pending changes (uid -> {'old': UserRecord, 'new': UserRecord, 'at': time first seen}),
+        leaving none behind"""
+        changes = self.updates.swap()
+        if self.avatars is not None:
+            for change in changes.values():
+                old_avi, new_avi = change['old']['avi'], change['new']['avi']
+                # The images were prefetched when the change came in, so don't hold up the digest for them
+                if old_avi != new_avi and self.avatars.same_image(old_avi, new_avi, timeout=0):
+                    # Same picture at a new url - not worth reporting
+                    change['new'] = change['new'].replace(avi=old_avi)
+                    self.metrics.inc('profiles.avatar_url_only')
+        reverted = [uid for uid, change in changes.items() if change['old'] == change['new']]
+        for uid in reverted:
+            del changes[uid]
+        self.metrics.inc('profiles.reverted', len(reverted))
+        return changes
+
+    def requeue(self, changes: Dict[str, dict]):
+        """Puts back changes that couldn't be reported"""
+        self.updates.requeue(changes)
+
+    def dump_state(self) -> Dict[str, Tuple[float, dict]]:
+        """Pending changes, in the shape StateStore saves"""
+        return {uid: (change['at'], {'old': change['old'].to_dict(), 'new': change['new'].to_dict(),
+                                     'at': change['at']})
+                for uid, change in self.updates.snapshot().items()}
+
+    def restore_state(self, entries: Dict[str, Any]):
+        """Takes back pending changes saved with `dump_state`"""
+        changes = {}
+        for uid, change in entries.items():
+            new = UserRecord.from_dict(change['new'], uid=uid)
+            changes[uid] = {'old': UserRecord.from_dict(change['old'], uid=uid), 'new': new, 'at': change['at']}
+            self.fingerprints[uid] = fingerprint(new)
+        self.requeue(changes)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import time
+from typing import Any, Callable, List, Optional
+from .metrics import metrics, Metrics
+
+
+# Slack truncates message text well past this, but it's the most it'll show without a "see more"
+MAX_TEXT_CHARS = 4000
+
+
+def split_text(text: str, max_chars: int = MAX_TEXT_CHARS) -> List[str]:
+    """Splits text into pieces of at most max_chars, preferring to break at the end of a line"""
+    pieces = []
+    while len(text) > max_chars:
+        cut = text.rfind('\n', 0, max_chars) + 1
+        if cut <= 0:
+            cut = max_chars
+        pieces.append(text[:cut])
+        text = text[cut:]
+    if text != '' or len(pieces) == 0:
+        pieces.append(text)
+    return pieces
+
+
+class ProgressiveMessage:
+    """A response that's posted as soon as its first part is ready, then updated in place as more come in.
+
+    Updates are batched so there's at most one `chat.update` per `min_interval` (whatever's come in since
+        goes out with the next one, or on `close`). Once the text would go over `max_chars`,
+        the rest continues in a new message.
+    """
+
+    def __init__(self, post: Callable[[str], str], update: Callable[[str, str], Any], ts: Optional[str] = None,
+                 max_chars: int = MAX_TEXT_CHARS, min_interval: float = 1.0, registry: Metrics = metrics,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            post: callable, posts a new message with the text and returns its ts
+            update: callable, replaces the text of the message with the ts
+            ts: str, an already-posted message (e.g., a placeholder) to put the first part in
+            max_chars: int, the most text in one message
+            min_interval: float, seconds between updates of the same message
+            registry: Metrics, where posts, updates and continuations get counted
+            clock: callable, the time
+        """
+        self.post = post
+        self.update = update
+        self.max_chars = max_chars
+        self.min_interval = min_interval
+        self.metrics = registry
+        self.clock = clock
+        self.timestamps = [] if ts is None else [ts]  # type: List[str]
+        self.parts = []  # type: List[str]
+        self._text = ''  # Text of the current (last) message
+        self._ts = ts
+        self._sent = True  # Whether the current message shows all of its text
+        self._last_sent = float('-inf')  # So the first part goes out right away
+
+    @property
+    def text(self) -> str:
+        """Everything that's come in so far"""
+        return ''.join(self.parts)
+
+    def add(self, part: str):
+        """Adds a part to the response, sending it now if the message hasn't been updated too recently"""
+        self.parts.append(part)
+        for piece in split_text(part, self.max_chars):
+            if self._text != '' and len(self._text) + len(piece) > self.max_chars:
+                # No room left - finish this message off and carry on in a new one
+                self.flush()
+                self._text, self._ts = '', None
+                self.metrics.inc('progressive.continuations')
+            self._text += piece
+            self._sent = False
+        if self._ts is None or self.clock() - self._last_sent >= self.min_interval:
+            self.flush()
+
+    def flush(self):
+        """Sends whatever the current message is missing"""
+        if self._sent:
+            return
+        if self._ts is None:
+            self._ts = self.post(self._text)
+            self.timestamps.append(self._ts)
+            self.metrics.inc('progressive.posts')
+        else:
+            self.update(self._ts, self._text)
+            self.metrics.inc('progressive.updates')
+        self._sent = True
+        self._last_sent = self.clock()
+
+    def close(self) -> List[str]:
+        """Sends anything that's still waiting
+
+        Returns:
+            the timestamps of the response's messages
+        """
+        self.flush()
+        return self.timestamps
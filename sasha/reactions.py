@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import time
+import threading
+from collections import deque
+from typing import Callable, Deque, Dict, Optional, Set, Tuple
+from .metrics import metrics, Metrics
+
+
+class _MessageState:
+    """What we know about the reactions on a single message"""
+    __slots__ = ('events', 'reactions', 'sent', 'saturated', 'pending_since', 'last_seen')
+
+    def __init__(self, now: float):
+        self.events = 0  # Reaction events seen since our last reaction
+        self.reactions = set()  # type: Set[str]
+        self.sent = 0  # Reactions we've added
+        self.saturated = False  # Slack told us the message can't take any more reactions
+        self.pending_since = None  # type: Optional[float]
+        self.last_seen = now
+
+
+class ReactionScheduler:
+    """Coalesces `reaction_added` events per message and answers them in controlled bursts
+    (`flush` is expected to be called every `window` / 2 seconds or so).
+
+    Events on the same message within `window` seconds lead to at most one reaction from us.
+        We react at most `per_message_cap` times per message and `per_minute_cap` times per minute overall.
+        Messages already at Slack's reaction limit are skipped. When there are more messages waiting than
+        the per-minute budget allows, the ones with the least activity are dropped first.
+    """
+
+    def __init__(self, react_func: Callable[[str, str, str], None], pick_func: Callable[[], Optional[str]],
+                 window: float = 3, per_message_cap: int = 1, per_minute_cap: int = 20, slack_limit: int = 23,
+                 message_ttl: float = 60 * 60, registry: Metrics = metrics,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            react_func: callable, takes in channel, ts and emoji name and adds the reaction
+            pick_func: callable, returns the name of an emoji to react with
+            window: float, seconds of activity on a message to coalesce before reacting
+            per_message_cap: int, maximum reactions we'll add to a single message
+            per_minute_cap: int, maximum reactions we'll add across all messages in a minute
+            slack_limit: int, number of distinct reactions Slack allows on a message
+            message_ttl: float, seconds of inactivity before we forget about a message
+            registry: Metrics, where sent/skipped/dropped counts get reported
+            clock: callable, the time
+        """
+        self.react_func = react_func
+        self.pick_func = pick_func
+        self.window = window
+        self.per_message_cap = per_message_cap
+        self.per_minute_cap = per_minute_cap
+        self.slack_limit = slack_limit
+        self.message_ttl = message_ttl
+        self.metrics = registry
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._messages = {}  # type: Dict[Tuple[str, str], _MessageState]
+        self._sent_times = deque()  # type: Deque[float]
+
+    def submit(self, channel: str, ts: str, reaction: str):
+        """Records a reaction added to a message, to be answered at the next flush"""
+        now = self.clock()
+        self.metrics.inc('reactions.events')
+        with self._lock:
+            state = self._messages.get((channel, ts))
+            if state is None:
+                state = self._messages[(channel, ts)] = _MessageState(now)
+            state.events += 1
+            state.reactions.add(reaction)
+            state.last_seen = now
+            if state.pending_since is None:
+                state.pending_since = now
+            else:
+                self.metrics.inc('reactions.coalesced')
+
+    def _budget_left(self, now: float) -> int:
+        while len(self._sent_times) > 0 and now - self._sent_times[0] >= 60:
+            self._sent_times.popleft()
+        return self.per_minute_cap - len(self._sent_times)
+
+    def flush(self) -> int:
+        """Reacts to the messages whose coalescing window has passed. Returns the number of reactions added"""
+        now = self.clock()
+        to_send = []
+        with self._lock:
+            ready = []
+            for key, state in list(self._messages.items()):
+                if state.pending_since is None:
+                    if now - state.last_seen >= self.message_ttl:
+                        del self._messages[key]
+                    continue
+                if now - state.pending_since < self.window:
+                    continue
+                state.pending_since = None
+                if state.saturated or len(state.reactions) >= self.slack_limit:
+                    self.metrics.inc('reactions.skipped_full')
+                elif state.sent >= self.per_message_cap:
+                    self.metrics.inc('reactions.skipped_capped')
+                else:
+                    ready.append((key, state))
+            # Busiest messages first, so the least valuable ones are dropped when over budget
+            ready.sort(key=lambda x: x[1].events, reverse=True)
+            budget = self._budget_left(now)
+            for key, state in ready:
+                state.events = 0
+                if budget <= 0:
+                    self.metrics.inc('reactions.dropped_load')
+                    continue
+                budget -= 1
+                state.sent += 1
+                self._sent_times.append(now)
+                to_send.append((key, state))
+
+        sent = 0
+        for (channel, ts), state in to_send:
+            emoji = self.pick_func()
+            if emoji is None:
+                continue
+            try:
+                self.react_func(channel, ts, emoji)
+                sent += 1
+                self.metrics.inc('reactions.sent')
+            except Exception as e:
+                if 'too_many_reactions' in str(e):
+                    with self._lock:
+                        state.saturated = True
+                    self.metrics.inc('reactions.skipped_full')
+                elif 'already_reacted' in str(e):
+                    # Someone beat us to the emoji we picked - nothing went wrong
+                    self.metrics.inc('reactions.already_reacted')
+                else:
+                    self.metrics.inc('reactions.errors')
+        return sent
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import json
+import requests
+from typing import Iterable, Iterator, Optional
+from .metrics import metrics, Metrics
+from .resilience import DependencyUnavailable, ResilientClient
+
+
+class UploadTooLarge(DependencyUnavailable):
+    """Raised when the file being relayed is bigger than we're willing to pass on"""
+    reason = 'sent a file that was too big'
+
+
+class SizedBody:
+    """A request body that's streamed from its chunks, but whose length is known up front
+    (so it goes out with a Content-Length rather than chunked)"""
+
+    def __init__(self, chunks: Iterable[bytes], length: int):
+        """
+        Args:
+            chunks: iterable of bytes, the body
+            length: int, the body's total size in bytes
+        """
+        self.chunks = chunks
+        self.length = length
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __iter__(self) -> Iterator[bytes]:
+        return iter(self.chunks)
+
+
+class SlackUploader:
+    """Uploads files to Slack from a stream of chunks, without holding the whole file or writing it to disk.
+
+    Uses Slack's external upload flow: `files.getUploadURLExternal` for somewhere to send the file,
+        the file itself, then `files.completeUploadExternal` to share it in the channel.
+        Used to relay images straight from the site that serves them: when the size is known up front,
+        only one chunk is in memory at a time (otherwise the file's read in first, up to `max_bytes`).
+        Every upload gets its own body, so concurrent uploads can't interfere with one another.
+    """
+    api_url = 'https://slack.com/api'
+
+    def __init__(self, token: str, http: Optional[ResilientClient] = None, chunk_size: int = 64 * 1024,
+                 max_bytes: int = 20 * 1024 * 1024, registry: Metrics = metrics):
+        """
+        Args:
+            token: str, the bot token
+            http: ResilientClient, for the calls to Slack
+            chunk_size: int, bytes read from the source at a time
+            max_bytes: int, the largest file we'll relay
+            registry: Metrics, where upload sizes get reported
+        """
+        self.token = token
+        self.http = ResilientClient() if http is None else http
+        self.chunk_size = chunk_size
+        self.max_bytes = max_bytes
+        self.metrics = registry
+
+    def _capped(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        total = 0
+        for chunk in chunks:
+            if not chunk:
+                continue
+            total += len(chunk)
+            if total > self.max_bytes:
+                raise UploadTooLarge('slack.com', f'over {self.max_bytes} bytes')
+            yield chunk
+        self.metrics.inc('uploads.bytes', total)
+
+    def _api(self, method: str, **kwargs) -> dict:
+        """Calls a Slack API method, raising if it didn't work"""
+        resp = self.http.post(f'{self.api_url}/{method}', headers={'Authorization': f'Bearer {self.token}'},
+                              **kwargs)
+        try:
+            result = resp.json()
+        except ValueError:
+            result = {}
+        if not result.get('ok', False):
+            self.metrics.inc('uploads.failures')
+            raise DependencyUnavailable('slack.com', result.get('error', f'status {resp.status_code}'))
+        return result
+
+    def upload(self, channel: str, chunks: Iterable[bytes], filename: str, title: Optional[str] = None,
+               content_type: str = 'application/octet-stream', length: Optional[int] = None) -> dict:
+        """Uploads the file to the channel as its chunks come in
+
+        Args:
+            channel: str, the channel to share the file in
+            chunks: iterable of bytes, the file's content
+            filename: str, the file's name
+            title: str, the file's title in Slack. Defaults to the filename.
+            content_type: str, the file's content type
+            length: int, the file's size in bytes, if known
+        Returns:
+            dict, Slack's response to completing the upload
+        """
+        if length is None:
+            # Slack needs the size before it'll take the file
+            content = b''.join(self._capped(chunks))
+            chunks, length = [content], len(content)
+        elif length > self.max_bytes:
+            raise UploadTooLarge('slack.com', f'over {self.max_bytes} bytes')
+        else:
+            chunks = self._capped(chunks)
+        target = self._api('files.getUploadURLExternal', data={'filename': filename, 'length': length})
+        resp = self.http.post(target['upload_url'], data=SizedBody(chunks, length),
+                              headers={'Content-Type': content_type})
+        if resp.status_code != 200:
+            self.metrics.inc('uploads.failures')
+            raise DependencyUnavailable('files.slack.com', f'status {resp.status_code}')
+        files = [{'id': target['file_id'], 'title': filename if title is None else title}]
+        result = self._api('files.completeUploadExternal', data={'files': json.dumps(files), 'channel_id': channel})
+        self.metrics.inc('uploads.files')
+        return result
+
+    def relay(self, channel: str, source: requests.Response, filename: str, title: Optional[str] = None) -> dict:
+        """Uploads the body of a streamed response (`stream=True`) to the channel"""
+        try:
+            length = source.headers.get('Content-Length')
+            # A compressed body's length isn't what iter_content hands us
+            if length is not None and (not length.isdigit() or source.headers.get('Content-Encoding')):
+                length = None
+            return self.upload(channel, source.iter_content(chunk_size=self.chunk_size), filename, title=title,
+                               content_type=source.headers.get('Content-Type', 'application/octet-stream'),
+                               length=None if length is None else int(length))
+        finally:
+            source.close()
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import time
+import inspect
+import threading
+import requests
+from functools import wraps
+from urllib.parse import urlparse
+from typing import Callable, Dict, Optional
+from .context import DeadlineExceeded, current_deadline
+from .metrics import metrics, Metrics
+
+
+class DependencyUnavailable(Exception):
+    """Raised when an external site can't be reached (or we've decided not to try)"""
+    reason = 'is not responding'
+
+    def __init__(self, host: str, detail: str = ''):
+        self.host = host
+        super().__init__(f'{host} {self.reason}{f": {detail}" if detail != "" else ""}')
+
+    @property
+    def friendly_message(self) -> str:
+        """A message suitable for posting back to Slack"""
+        return f'Looks like `{self.host}` {self.reason} right now. Try again in a bit :sweat_smile:'
+
+
+class CircuitOpenError(DependencyUnavailable):
+    """Raised when a host's circuit breaker is open"""
+    reason = 'seems to be down'
+
+
+class BulkheadFullError(DependencyUnavailable):
+    """Raised when all the request slots for a host are taken"""
+    reason = 'is swamped with my requests'
+
+
+class DependencyTimeoutError(DependencyUnavailable):
+    """Raised when a host didn't answer in time or the connection failed"""
+    reason = 'is not responding'
+
+
+def friendly_failures(func: Callable) -> Callable:
+    """Decorator for bot commands: when an external site is unavailable or the request ran out of time,
+    responds with a friendly message instead of raising. For a command that yields its response in parts,
+    the message comes after whatever parts were already yielded"""
+    if inspect.isgeneratorfunction(func):
+        @wraps(func)
+        def gen_wrapper(*args, **kwargs):
+            yielded = False
+            try:
+                for part in func(*args, **kwargs):
+                    yielded = True
+                    yield part
+            except (DependencyUnavailable, DeadlineExceeded) as e:
+                # On a line of its own, after whatever made it out
+                yield f'\n{e.friendly_message}' if yielded else e.friendly_message
+        return gen_wrapper
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except (DependencyUnavailable, DeadlineExceeded) as e:
+            return e.friendly_message
+    return wrapper
+
+
+class HostPolicy:
+    """Resilience settings for a single external host"""
+
+    def __init__(self, timeout: float = 5, max_concurrent: int = 4, queue_timeout: float = 0.5,
+                 failure_threshold: int = 5, reset_timeout: float = 30):
+        """
+        Args:
+            timeout: float, seconds to wait for the host to answer a request
+            max_concurrent: int, maximum number of requests in flight to the host (the bulkhead)
+            queue_timeout: float, seconds to wait for a free request slot before giving up
+            failure_threshold: int, consecutive failures before the circuit breaker opens
+            reset_timeout: float, seconds the breaker stays open before letting a trial request through
+        """
+        self.timeout = timeout
+        self.max_concurrent = max_concurrent
+        self.queue_timeout = queue_timeout
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+
+# Settings for the sites we know about. Anything else gets the default HostPolicy
+HOST_POLICIES = {
+    'www.eki.ee': HostPolicy(timeout=6, max_concurrent=4),
+    'www.filosoft.ee': HostPolicy(timeout=5, max_concurrent=4),
+    'www.etymonline.com': HostPolicy(timeout=6, max_concurrent=3),
+    'inspirobot.me': HostPolicy(timeout=5, max_concurrent=2),
+    'generated.inspirobot.me': HostPolicy(timeout=10, max_concurrent=2),
+    'avatars.slack-edge.com': HostPolicy(timeout=5, max_concurrent=2),
+    # Where Slack has us send uploaded files (the body is streamed in while the request's open, so give it longer)
+    'files.slack.com': HostPolicy(timeout=20, max_concurrent=4),
+}
+
+
+class CircuitBreaker:
+    """Tracks consecutive failures of a host and fails fast while it's down"""
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        """Determines whether a request may go through.
+        Once the reset timeout passes, a single trial request is let through to probe the host.
+        """
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = self.HALF_OPEN
+            # Half-open
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def cancel_trial(self):
+        """Frees up the half-open trial slot when the trial request never got sent"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+
+class Bulkhead:
+    """Caps the number of concurrent requests to a host"""
+
+    def __init__(self, max_concurrent: int):
+        self.max_concurrent = max_concurrent
+        self._sem = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self.in_use = 0
+
+    def acquire(self, timeout: float) -> bool:
+        if not self._sem.acquire(timeout=timeout):
+            return False
+        with self._lock:
+            self.in_use += 1
+        return True
+
+    def release(self):
+        with self._lock:
+            self.in_use -= 1
+        self._sem.release()
+
+
+class ResilientClient:
+    """Makes HTTP requests with per-host timeouts, bulkheads and circuit breakers"""
+    # Breaker states, as reported in metrics
+    state_codes = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+
+    def __init__(self, policies: Optional[Dict[str, HostPolicy]] = None,
+                 default_policy: Optional[HostPolicy] = None, registry: Metrics = metrics):
+        """
+        Args:
+            policies: dict, host -> HostPolicy. Defaults to HOST_POLICIES
+            default_policy: HostPolicy, used for hosts not in policies
+            registry: Metrics, where request counts and breaker states get reported
+        """
+        self.policies = HOST_POLICIES if policies is None else policies
+        self.default_policy = HostPolicy() if default_policy is None else default_policy
+        self.metrics = registry
+        self._lock = threading.Lock()
+        self.breakers = {}  # type: Dict[str, CircuitBreaker]
+        self.bulkheads = {}  # type: Dict[str, Bulkhead]
+
+    def _get_host_tools(self, host: str):
+        """Returns the policy, breaker and bulkhead for the host, making them on first use"""
+        policy = self.policies.get(host, self.default_policy)
+        with self._lock:
+            if host not in self.breakers:
+                breaker = CircuitBreaker(policy.failure_threshold, policy.reset_timeout)
+                bulkhead = Bulkhead(policy.max_concurrent)
+                self.breakers[host] = breaker
+                self.bulkheads[host] = bulkhead
+                self.metrics.register_gauge(f'http.{host}.breaker', lambda b=breaker: self.state_codes[b.state])
+                self.metrics.register_gauge(f'http.{host}.in_flight', lambda b=bulkhead: b.in_use)
+            return policy, self.breakers[host], self.bulkheads[host]
+
+    def call(self, host: str, func: Callable[[float], requests.Response]) -> requests.Response:
+        """Runs the request function under the host's protections.
+        When the current request has a deadline, the timeouts are capped by the time it has left.
+
+        Args:
+            host: str, the host being called
+            func: callable, takes in the timeout to use and returns the response
+        """
+        policy, breaker, bulkhead = self._get_host_tools(host)
+        deadline = current_deadline()
+        self.metrics.inc(f'http.{host}.requests')
+        if deadline is not None and deadline.expired:
+            self.metrics.inc(f'http.{host}.deadline_exceeded')
+            raise DeadlineExceeded(f'calling {host}')
+        if not breaker.allow():
+            self.metrics.inc(f'http.{host}.rejected_open')
+            raise CircuitOpenError(host)
+        queue_timeout = policy.queue_timeout if deadline is None else deadline.timeout(policy.queue_timeout)
+        if not bulkhead.acquire(timeout=max(0.0, queue_timeout)):
+            # Not the host's fault, so this doesn't count against the breaker
+            self.metrics.inc(f'http.{host}.rejected_full')
+            breaker.cancel_trial()
+            raise BulkheadFullError(host)
+        timeout = policy.timeout if deadline is None else deadline.timeout(policy.timeout)
+        start = time.monotonic()
+        try:
+            if timeout <= 0:
+                raise DeadlineExceeded(f'calling {host}')
+            resp = func(timeout)
+        except DeadlineExceeded:
+            breaker.cancel_trial()
+            self.metrics.inc(f'http.{host}.deadline_exceeded')
+            raise
+        except requests.Timeout as e:
+            if timeout < policy.timeout:
+                # We cut the host short to meet the request's deadline, so don't hold it against them
+                breaker.cancel_trial()
+                self.metrics.inc(f'http.{host}.deadline_exceeded')
+                raise DeadlineExceeded(f'{host} answered')
+            breaker.record_failure()
+            self.metrics.inc(f'http.{host}.failures')
+            raise DependencyTimeoutError(host, e.__class__.__name__)
+        except requests.ConnectionError as e:
+            breaker.record_failure()
+            self.metrics.inc(f'http.{host}.failures')
+            raise DependencyTimeoutError(host, e.__class__.__name__)
+        except Exception:
+            # Not a sign of the host being down, but a trial request mustn't be left hanging
+            breaker.cancel_trial()
+            raise
+        finally:
+            bulkhead.release()
+            self.metrics.inc(f'http.{host}.seconds', time.monotonic() - start)
+        if resp.status_code >= 500:
+            breaker.record_failure()
+            self.metrics.inc(f'http.{host}.failures')
+        else:
+            breaker.record_success()
+        return resp
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """Sends a GET request to the url under its host's protections"""
+        host = urlparse(url).hostname or ''
+        return self.call(host, lambda timeout: requests.get(url, timeout=timeout, **kwargs))
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        """Sends a POST request to the url under its host's protections"""
+        host = urlparse(url).hostname or ''
+        return self.call(host, lambda timeout: requests.post(url, timeout=timeout, **kwargs))
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import threading
+import requests
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Hashable, Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .cache import TTLCache
+from .metrics import metrics, Metrics
+from .work import INTERACTIVE, WorkScheduler
+
+
+def _retry_policy(retries: int) -> Retry:
+    """Retries for posts to Slack's response urls (which are safe to repeat)"""
+    kwargs = dict(total=retries, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504])
+    try:
+        return Retry(allowed_methods=frozenset(['POST']), **kwargs)
+    except TypeError:
+        # Older urllib3
+        return Retry(method_whitelist=frozenset(['POST']), **kwargs)
+
+
+def response_body(response: Any, response_type: str = 'in_channel') -> dict:
+    """Makes a command's response (text or blocks) into a response url body"""
+    if isinstance(response, str):
+        return {'response_type': response_type, 'text': response}
+    return {'response_type': response_type, 'text': '', 'blocks': response}
+
+
+class Responder:
+    """Posts to interaction `response_url`s in the background, over a pool of kept-alive connections.
+
+    A response tied to a key (e.g., the action's block_id) is only ever sent once, so when Slack retries
+        an interaction we don't update the message again. Posts that can't wait on (or be shed by) the
+        WorkScheduler, e.g., telling a user their command was turned away, go out on a thread of their own.
+    """
+
+    def __init__(self, work: WorkScheduler, pool_size: int = 8, retries: int = 3, timeout: float = 5,
+                 dedupe_ttl: float = 60 * 60, registry: Metrics = metrics):
+        """
+        Args:
+            work: WorkScheduler, runs the posts
+            pool_size: int, connections kept open to Slack
+            retries: int, attempts at a post that fails with a connection error or a retryable status
+            timeout: float, seconds to wait on Slack for each attempt
+            dedupe_ttl: float, seconds a key is remembered for
+            registry: Metrics, where sent / duplicate / failed counts get reported
+        """
+        self.work = work
+        self.timeout = timeout
+        self.metrics = registry
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=2, pool_maxsize=pool_size,
+                                                   max_retries=_retry_policy(retries)))
+        self._sent = TTLCache(ttl=dedupe_ttl, max_size=10000)
+        self._lock = threading.Lock()
+        self._urgent = ThreadPoolExecutor(max_workers=1, thread_name_prefix='responder-urgent')
+
+    def respond(self, response_url: str, body: dict, key: Optional[Hashable] = None) -> Optional[Future]:
+        """Sends the body to the response url in the background
+
+        Args:
+            response_url: str, the interaction's response url
+            body: dict, the response (e.g., {'replace_original': True, 'text': ...})
+            key: hashable, if given, only the first response with this key gets sent
+        Returns:
+            Future of the post, or None if it was a duplicate
+        """
+        if key is not None:
+            with self._lock:
+                if self._sent.get(key) is not None:
+                    self.metrics.inc('responder.duplicates')
+                    return None
+                self._sent.set(key, True)
+        return self.work.submit(self._post, response_url, body, priority=INTERACTIVE)
+
+    def respond_urgently(self, response_url: str, body: dict) -> Future:
+        """Sends the body to the response url on the responder's own thread, skipping the WorkScheduler"""
+        return self._urgent.submit(self._post, response_url, body)
+
+    def _post(self, response_url: str, body: dict) -> requests.Response:
+        try:
+            resp = self.session.post(response_url, json=body, timeout=self.timeout)
+        except requests.RequestException:
+            self.metrics.inc('responder.failures')
+            raise
+        self.metrics.inc('responder.sent' if resp.status_code < 400 else 'responder.failures')
+        return resp
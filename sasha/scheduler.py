@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import time
+import heapq
+import itertools
+import threading
+from typing import Callable, Dict, Optional, Tuple
+from .metrics import metrics, Metrics
+
+
+class Job:
+    """A task run periodically by the Scheduler"""
+    __slots__ = ('name', 'func', 'interval', 'pending', 'min_delay', 'max_delay', 'generation', 'forced',
+                 'pending_since', 'last_change', 'last_count', 'last_run')
+
+    def __init__(self, name: str, func: Callable[[], None], interval: float,
+                 pending: Optional[Callable[[], int]] = None, min_delay: float = 0,
+                 max_delay: Optional[float] = None):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.pending = pending
+        self.min_delay = min_delay
+        self.max_delay = min_delay if max_delay is None else max(min_delay, max_delay)
+        self.generation = 0  # Bumped whenever the job is rescheduled, invalidating older heap entries
+        self.forced = False
+        self.pending_since = None  # type: Optional[float]
+        self.last_change = 0.0
+        self.last_count = 0
+        self.last_run = None  # type: Optional[float]
+
+
+class Scheduler:
+    """Runs jobs from a heap of due times in a single background thread.
+
+    Jobs without a `pending` function simply run every `interval` seconds.
+    Jobs with one (returning how many items are waiting) only run when there's something to flush:
+        once the count has stopped changing for `min_delay` seconds,
+        or `max_delay` seconds after items first showed up, whichever comes first.
+    """
+
+    def __init__(self, registry: Metrics = metrics, clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            registry: Metrics, where job runs, errors and durations get reported
+            clock: callable, the time. Without the background thread, `run_pending` runs whatever's due by it
+        """
+        self.metrics = registry
+        self.clock = clock
+        self.jobs = {}  # type: Dict[str, Job]
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread = None  # type: Optional[threading.Thread]
+
+    def add_job(self, name: str, func: Callable[[], None], interval: float,
+                pending: Optional[Callable[[], int]] = None, min_delay: float = 0,
+                max_delay: Optional[float] = None):
+        """Registers a job
+
+        Args:
+            name: str, unique name of the job
+            func: callable, the work to do
+            interval: float, seconds between runs (or between checks for pending items)
+            pending: callable, returns the number of items waiting to be flushed
+            min_delay: float, seconds the pending count must hold steady before flushing
+            max_delay: float, the longest pending items may wait before they're flushed
+        """
+        job = Job(name, func, interval, pending=pending, min_delay=min_delay, max_delay=max_delay)
+        with self._cond:
+            self.jobs[name] = job
+            self._push(job, self.clock() + interval)
+
+    def _push(self, job: Job, when: float):
+        job.generation += 1
+        heapq.heappush(self._heap, (when, next(self._seq), job.name, job.generation))
+        self._cond.notify()
+
+    def trigger(self, name: str):
+        """Has the job run as soon as possible, skipping its delays (it still won't run with nothing pending)"""
+        with self._cond:
+            job = self.jobs[name]
+            job.forced = True
+            self._push(job, self.clock())
+
+    def _evaluate(self, job: Job, now: float, forced: bool = False) -> Tuple[bool, float]:
+        """Decides whether the job should run now, and when it should next be looked at"""
+        if job.pending is None:
+            return True, now + job.interval
+        count = job.pending()
+        if count <= 0:
+            job.pending_since = None
+            return False, now + job.interval
+        if job.pending_since is None:
+            job.pending_since = job.last_change = now
+            job.last_count = count
+        elif count != job.last_count:
+            job.last_change = now
+            job.last_count = count
+        due = min(job.last_change + job.min_delay, job.pending_since + job.max_delay)
+        if forced or now >= due:
+            job.pending_since = None
+            return True, now + job.interval
+        return False, min(now + job.interval, due)
+
+    def _run_job(self, job: Job):
+        start = time.monotonic()
+        try:
+            job.func()
+            self.metrics.inc(f'scheduler.{job.name}.runs')
+        except Exception:
+            self.metrics.inc(f'scheduler.{job.name}.errors')
+        job.last_run = time.monotonic()
+        self.metrics.inc(f'scheduler.{job.name}.seconds', job.last_run - start)
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._stop:
+                    if len(self._heap) > 0:
+                        wait_for = self._heap[0][0] - self.clock()
+                        if wait_for <= 0:
+                            break
+                    else:
+                        wait_for = None
+                    self._cond.wait(wait_for)
+                if self._stop:
+                    return
+            self.run_pending()
+
+    def run_pending(self):
+        """Looks at every job that's due, running the ones that should run"""
+        while True:
+            with self._cond:
+                if self._stop or len(self._heap) == 0 or self._heap[0][0] > self.clock():
+                    return
+                _, _, name, generation = heapq.heappop(self._heap)
+                job = self.jobs.get(name)
+                if job is None or job.generation != generation:
+                    # Stale entry for a job that's been rescheduled since
+                    continue
+                # Taken now, so a trigger that comes in while the job's running isn't lost
+                forced, job.forced = job.forced, False
+            try:
+                should_run, next_check = self._evaluate(job, self.clock(), forced)
+            except Exception:
+                self.metrics.inc(f'scheduler.{job.name}.errors')
+                should_run, next_check = False, self.clock() + job.interval
+            if should_run:
+                self._run_job(job)
+            with self._cond:
+                if job.generation == generation:
+                    self._push(job, next_check)
+
+    def start(self):
+        """Starts running jobs in a background thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
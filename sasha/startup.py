@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import time
+import threading
+from collections import deque
+from functools import wraps
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
+from .metrics import metrics, Metrics
+
+
+READY = 'ready'  # The gate that opens once the critical stages are done
+
+
+class Stage:
+    """One step of the bot's startup"""
+    __slots__ = ('name', 'func', 'critical', 'state', 'error', 'attempts', 'seconds')
+
+    def __init__(self, name: str, func: Callable[[], None], critical: bool = False):
+        self.name = name
+        self.func = func
+        self.critical = critical
+        self.state = 'pending'  # pending -> running -> done / failed
+        self.error = None  # type: Optional[str]
+        self.attempts = 0
+        self.seconds = 0.0
+
+
+class Startup:
+    """Runs the bot's startup in stages on a background thread, so the web server can take requests right away.
+
+    Critical stages (the bare minimum needed to handle an event, e.g., connecting to Slack) run first, in order,
+        retrying with backoff until they succeed. Once they're all done the bot is ready, and events that came in
+        beforehand (held back with `defer_until_ready`) get handled. The other stages (e.g., announcing the boot,
+        rendering help, fetching the user directory) then run in order, each one's failure only affecting itself.
+        Events that need one of them (held back with `defer_until_stage`) get handled once it's been run.
+    Held-back events are handled in the order they came in, and all of them before any that come in afterwards.
+    """
+
+    def __init__(self, max_deferred: int = 500, max_backoff: float = 60, registry: Metrics = metrics):
+        """
+        Args:
+            max_deferred: int, the most events to hold back for ready or a stage (the oldest get dropped after that)
+            max_backoff: float, the longest wait between attempts at a critical stage
+            registry: Metrics, where stage timings and deferred event counts get reported
+        """
+        self.max_backoff = max_backoff
+        self.metrics = registry
+        self.stages = []  # type: List[Stage]
+        self.max_deferred = max_deferred
+        self.ready = threading.Event()
+        self._lock = threading.Lock()
+        # Calls held back until a gate opens: READY, or the name of a non-critical stage
+        self._deferred = {}  # type: Dict[str, Deque[Tuple[Callable, tuple, dict]]]
+        self._open = set()  # type: Set[str]
+        self._thread = None  # type: Optional[threading.Thread]
+
+    def add_stage(self, name: str, func: Callable[[], None], critical: bool = False):
+        """Adds a stage (stages run in the order they're added, critical ones first)"""
+        self.stages.append(Stage(name, func, critical=critical))
+
+    def is_open(self, gate: str) -> bool:
+        """Whether the gate (READY, or the name of a non-critical stage) has opened"""
+        return gate in self._open
+
+    def status(self) -> Dict[str, dict]:
+        """Where each stage is at"""
+        return {x.name: {'state': x.state, 'critical': x.critical, 'attempts': x.attempts,
+                         'seconds': round(x.seconds, 3), 'error': x.error} for x in self.stages}
+
+    def _run_stage(self, stage: Stage) -> bool:
+        stage.state = 'running'
+        stage.attempts += 1
+        start = time.monotonic()
+        try:
+            stage.func()
+        except Exception as e:
+            stage.state = 'failed'
+            stage.error = f'{e.__class__.__name__}: {e}'
+            self.metrics.inc(f'startup.{stage.name}.failures')
+            return False
+        finally:
+            stage.seconds = time.monotonic() - start
+            self.metrics.set_gauge(f'startup.{stage.name}.seconds', stage.seconds)
+        stage.state = 'done'
+        stage.error = None
+        return True
+
+    def _run(self):
+        backoff = 1.0
+        for stage in [x for x in self.stages if x.critical]:
+            while not self._run_stage(stage):
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+        self._open_gate(READY)
+        for stage in [x for x in self.stages if not x.critical]:
+            self._run_stage(stage)
+            # Whether it worked or not, there's no point holding events back for it any longer
+            self._open_gate(stage.name)
+
+    def _open_gate(self, gate: str):
+        """Handles the calls held back for the gate, then lets new ones straight through.
+        Calls that come in while the held ones are being handled join the back of the line."""
+        while True:
+            with self._lock:
+                deferred = self._deferred.pop(gate, None)
+                if deferred is None or len(deferred) == 0:
+                    self._open.add(gate)
+                    if gate == READY:
+                        self.ready.set()
+                    return
+            for func, args, kwargs in deferred:
+                try:
+                    func(*args, **kwargs)
+                except Exception:
+                    self.metrics.inc('startup.deferred_failures')
+
+    def start(self):
+        """Kicks off the startup in the background"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='startup', daemon=True)
+            self._thread.start()
+
+    def run(self):
+        """Runs the whole startup in the current thread"""
+        self._run()
+
+    def defer_until_ready(self, func: Callable) -> Callable:
+        """Decorator that holds back calls made before the bot's ready, running them once it is"""
+        return self._defer(READY, func)
+
+    def defer_until_stage(self, name: str) -> Callable[[Callable], Callable]:
+        """Decorator that holds back calls made before the (non-critical) stage has run, running them after it"""
+        return lambda func: self._defer(name, func)
+
+    def _defer(self, gate: str, func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if gate not in self._open:
+                with self._lock:
+                    if gate not in self._open:
+                        deferred = self._deferred.get(gate)
+                        if deferred is None:
+                            deferred = self._deferred[gate] = deque(maxlen=self.max_deferred)
+                        if len(deferred) == deferred.maxlen:
+                            self.metrics.inc('startup.deferred_dropped')
+                        deferred.append((func, args, kwargs))
+                        self.metrics.inc('startup.deferred')
+                        return None
+            return func(*args, **kwargs)
+        return wrapper
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import gzip
+import json
+import time
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+from .metrics import metrics, Metrics
+
+
+# A section's entries: key -> (unix time the entry came about or None if unknown, JSON-able value)
+Entries = Dict[str, Tuple[Optional[float], Any]]
+
+
+class StateStore:
+    """Checkpoints the bot's runtime state (pending digests, duplicate-event guards, etc.) to a local file,
+    so a restart picks up where the last run left off.
+
+    State is split into named sections, each registered with a function that dumps its entries and one that
+        takes them back in. Entries older than `max_age` are dropped, both when saving and when restoring.
+        The file is gzipped JSON, written atomically.
+    """
+    version = 1
+
+    def __init__(self, path: str, max_age: float = 60 * 60 * 24, registry: Metrics = metrics):
+        """
+        Args:
+            path: str, path to the checkpoint file
+            max_age: float, seconds after which an entry is no longer worth keeping
+            registry: Metrics, where checkpoint / restore counts get reported
+        """
+        self.path = path
+        self.max_age = max_age
+        self.metrics = registry
+        self._lock = threading.Lock()
+        self._sections = {}  # type: Dict[str, Tuple[Callable[[], Entries], Callable[[Dict[str, Any]], None]]]
+
+    def register(self, name: str, dump: Callable[[], Entries], restore: Callable[[Dict[str, Any]], None]):
+        """Adds a section of state
+
+        Args:
+            name: str, the section's name in the file
+            dump: callable, returns the section's entries (key -> (timestamp, value))
+            restore: callable, takes in the restored entries (key -> value) that weren't too old
+        """
+        self._sections[name] = (dump, restore)
+
+    def _is_fresh(self, ts: float, now: float) -> bool:
+        return now - ts <= self.max_age
+
+    def checkpoint(self) -> int:
+        """Writes all sections to disk
+
+        Returns:
+            int, the number of entries written
+        """
+        now = time.time()
+        sections = {}
+        n_entries = 0
+        for name, (dump, _) in self._sections.items():
+            entries = []
+            for key, (ts, value) in dump().items():
+                ts = now if ts is None else ts
+                if self._is_fresh(ts, now):
+                    entries.append([key, round(ts, 3), value])
+            sections[name] = entries
+            n_entries += len(entries)
+        data = json.dumps({'version': self.version, 'saved_at': now, 'sections': sections},
+                          separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(gzip.compress(data))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        self.metrics.inc('state.checkpoints')
+        self.metrics.set_gauge('state.entries', n_entries)
+        return n_entries
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        """Reads the checkpoint file, leaving out entries that are too old
+
+        Returns:
+            dict, section name -> {key: value}. Empty if there's no usable file.
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                data = json.loads(gzip.decompress(f.read()).decode('utf-8'))
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError, EOFError):
+            self.metrics.inc('state.load_errors')
+            return {}
+        if not isinstance(data, dict) or data.get('version') != self.version:
+            self.metrics.inc('state.load_errors')
+            return {}
+        now = time.time()
+        sections = {}
+        for name, entries in data.get('sections', {}).items():
+            fresh = {key: value for key, ts, value in entries if self._is_fresh(ts, now)}
+            self.metrics.inc('state.expired', len(entries) - len(fresh))
+            sections[name] = fresh
+        return sections
+
+    def restore(self) -> int:
+        """Hands the checkpointed entries back to their sections
+
+        Returns:
+            int, the number of entries restored
+        """
+        n_entries = 0
+        for name, entries in self.load().items():
+            if name not in self._sections or len(entries) == 0:
+                continue
+            _, restore = self._sections[name]
+            try:
+                restore(entries)
+            except (KeyError, TypeError, ValueError):
+                # Shape of the section changed since it was saved - start it fresh
+                self.metrics.inc('state.load_errors')
+                continue
+            n_entries += len(entries)
+        self.metrics.inc('state.restored', n_entries)
+        return n_entries
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import sys
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple, Union
+
+
+# The profile fields we report on in the digest
+REPORTED_FIELDS = ('avi', 'display_name', 'real_name', 'title', 'status_emoji', 'status_text')
+
+
+def _str(value: Any) -> str:
+    return '' if value is None else value if type(value) is str else str(value)
+
+
+def _intern(value: Any) -> str:
+    """Interns the string, so values many users share (e.g., status emojis, titles) are only stored once"""
+    return sys.intern(_str(value))
+
+
+class UserRecord:
+    """Compact record of only the parts of a user's info that Sasha reports on"""
+    __slots__ = ('uid',) + REPORTED_FIELDS
+
+    def __init__(self, uid: str, avi: str = '', display_name: str = '', real_name: str = '', title: str = '',
+                 status_emoji: str = '', status_text: str = ''):
+        # Ids, urls and names are mostly unique, so interning them would only cost memory
+        self.uid = _str(uid)
+        self.avi = _str(avi)
+        self.display_name = _str(display_name)
+        self.real_name = _str(real_name)
+        self.title = _intern(title)
+        self.status_emoji = _intern(status_emoji)
+        self.status_text = _intern(status_text)
+
+    @classmethod
+    def from_dict(cls, user: Union[dict, 'UserRecord'], uid: Optional[str] = None) -> 'UserRecord':
+        """Builds the record from a cleaned user info dict (or copies another record)"""
+        if uid is None:
+            uid = user.get('id', '')
+        return cls(uid, **{k: user.get(k) for k in REPORTED_FIELDS})
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Dict-style access to the fields"""
+        if key == 'id':
+            return self.uid
+        return getattr(self, key, default) if key in REPORTED_FIELDS else default
+
+    def __getitem__(self, key: str) -> str:
+        if key not in REPORTED_FIELDS and key != 'id':
+            raise KeyError(key)
+        return self.get(key)
+
+    def values(self) -> Tuple[str, ...]:
+        """Values of the reported fields"""
+        return tuple(getattr(self, k) for k in REPORTED_FIELDS)
+
+    def to_dict(self) -> Dict[str, str]:
+        """The dict shape the digest templates use"""
+        return dict(zip(REPORTED_FIELDS, self.values()))
+
+    def replace(self, **kwargs) -> 'UserRecord':
+        """Returns a copy of the record with some of the fields changed"""
+        fields = self.to_dict()
+        fields.update(kwargs)
+        return UserRecord(self.uid, **fields)
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, UserRecord):
+            return NotImplemented
+        return self.values() == other.values()
+
+    def __hash__(self) -> int:
+        return hash(self.values())
+
+    def __repr__(self) -> str:
+        return f'UserRecord({self.uid!r}, display_name={self.display_name!r})'
+
+
+class UserDirectory:
+    """The workspace's users, kept as compact records"""
+
+    def __init__(self, users: Optional[Iterable[Union[dict, UserRecord]]] = None):
+        """
+        Args:
+            users: iterable of cleaned user info dicts (with an 'id' key) or records
+        """
+        self._records = {}  # type: Dict[str, UserRecord]
+        if users is not None:
+            for user in users:
+                record = user if isinstance(user, UserRecord) else UserRecord.from_dict(user)
+                self._records[record.uid] = record
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __contains__(self, uid: str) -> bool:
+        return uid in self._records
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._records)
+
+    def __getitem__(self, uid: str) -> UserRecord:
+        return self._records[uid]
+
+    def __setitem__(self, uid: str, user: Union[dict, UserRecord]):
+        self._records[uid] = user if isinstance(user, UserRecord) else UserRecord.from_dict(user, uid=uid)
+
+    def get(self, uid: str, default: Any = None) -> Optional[UserRecord]:
+        return self._records.get(uid, default)
+
+    def keys(self):
+        return self._records.keys()
+
+    def items(self):
+        return self._records.items()
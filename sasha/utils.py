@@ -1,20 +1,40 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+import os
 import sys
-import requests
+import logging
 import pandas as pd
-from typing import List, Optional, Tuple, Union
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Tuple, Union
 from datetime import datetime as dt
-from random import randint
 from slacktools import SlackBotBase, BlockKitBuilder
-from .linguistics import Linguistics
+from .accumulators import DictAccumulator
+from .avatars import AvatarFingerprinter
+from .digest import DigestMessage
+from .dispatch import CommandDispatcher, parse_action, parse_slash_command
+from .emoji_catalog import EmojiCatalog
+from .logs import LogWriter
+from .plugins import PluginRegistry
+from .profile_diff import ProfileDiffer
+from .progressive import ProgressiveMessage
+from .reactions import ReactionScheduler
+from .relay import SlackUploader
+from .responder import Responder, response_body
+from .resilience import ResilientClient
+from .startup import Startup
+from .state import StateStore
+from .users import UserDirectory
+from .watchdog import LatencyWatchdog, Watch
+from .work import DIGEST, WorkScheduler, WorkShed
 from ._version import get_versions
 
 
 class Sasha:
     """Handles messaging to and from Slack API"""
 
-    def __init__(self, log_name: str, creds: dict, debug: bool = False):
+    def __init__(self, log_name: str, creds: dict, debug: bool = False, data_dir: Optional[str] = None,
+                 state_max_age: float = 60 * 60 * 24, slow_command_threshold: float = 1.5,
+                 log_sampling: Optional[Dict[str, int]] = None, log_queue_size: int = 10000):
         """
         Args:
             log_name: str, name of the kavalkilu.Log object to retrieve
@@ -27,14 +47,29 @@ class Sasha:
                     cookie: str, cookie used for special processes outside
                         the realm of common API calls e.g., emoji uploads
             debug: bool, if True, will use a different set of triggers for testing purposes
+            data_dir: str, directory where local state (e.g., the emoji catalog) is kept.
+                Defaults to ~/data/sasha
+            state_max_age: float, seconds after which saved runtime state (pending digests, handled actions)
+                is too old to restore
+            slow_command_threshold: float, seconds a command can take before a placeholder message is posted
+            log_sampling: dict, Slack event type -> N, to only log every Nth record while handling that type
+                of event (warnings and errors are always logged). Defaults to every 10th for messages
+            log_queue_size: int, the most log records waiting to be written before they start getting dropped
         """
         self.debug = debug
+        self.data_dir = os.path.join(os.path.expanduser('~'), 'data', 'sasha') if data_dir is None else data_dir
         self.bot_name = f'Sasha {"Debugnova" if debug else "Produdnika"}'
         self.triggers = ['sasha', 's!']
         self.test_channel = 'C016XDV8XM0'  # test
         self.approved_users = ['U015WMFQ0DV', 'U016N5RJZ9C']    # b, m
         self.bkb = BlockKitBuilder()
-        self.ling = Linguistics()
+        # Log records are written in the background (the logger's handlers get moved behind it once connected)
+        self.log_writer = LogWriter(max_queue=log_queue_size,
+                                    sample_every={'message': 10} if log_sampling is None else log_sampling)
+        # Shared client for calls to external sites (timeouts, circuit breakers, concurrency caps)
+        self.http = ResilientClient()
+        # For relaying files from other sites to Slack
+        self.uploader = SlackUploader(creds.get('xoxb-token'), http=self.http)
         # Bot version stuff
         version_dict = get_versions()
         self.version = version_dict['version']
@@ -51,207 +86,294 @@ class Sasha:
                 f"Here's what I can do:"
         avi_url = "https://avatars.slack-edge.com/2020-07-10/1219810342855_04c9966e835417fadde7_512.png"
         avi_alt = 'avatar'
-        cat_basic = 'basic'
-        cat_useful = 'useful'
-        cat_notsouseful = 'not so useful'
-        cat_lang = 'language'
-        cmd_categories = [cat_basic, cat_useful, cat_notsouseful, cat_lang]
-
+        # Commands come from plugins, which only get loaded once one of their commands is used
+        self.plugins = PluginRegistry(self)
+        cmd_categories = self.plugins.categories
         commands = {
             r'^help': {
                 'pattern': 'help',
-                'cat': cat_basic,
+                'cat': 'basic',
                 'desc': 'Description of all the commands I respond to!',
                 'value': '',
             },
             r'^about$': {
                 'pattern': 'about',
-                'cat': cat_useful,
+                'cat': 'useful',
                 'desc': 'Bootup time of Sasha\'s current instance, his version and last update date',
                 'value': self.bootup_msg,
             },
-            r'good bo[tiy]': {
-                'pattern': 'good bo[tiy]',
-                'cat': cat_basic,
-                'desc': 'Did I do something right for once?',
-                'value': 'thanks <@{user}>!',
-            },
-            r'^time$': {
-                'pattern': 'time',
-                'cat': cat_basic,
-                'desc': 'Display current server time',
-                'value': [self.get_time],
-            },
-            r'^speak$': {
-                'pattern': 'speak',
-                'cat': cat_basic,
-                'desc': '_Really_ basic response here.',
-                'value': 'woof',
-            },
-            r'.*inspir.*': {
-                'pattern': '<any text with "inspir" in it>',
-                'cat': cat_notsouseful,
-                'desc': 'Uploads an inspirational picture',
-                'value': [self.inspirational, 'channel'],
-            },
-            r'.*tihi.*': {
-                'pattern': '<any text with "tihi" in it>',
-                'cat': cat_notsouseful,
-                'desc': 'Giggles',
-                'value': [self.giggle],
-            },
-            r'^e[nt]\s': {
-                'pattern': '(et|en) <word-to-translate>',
-                'cat': cat_lang,
-                'desc': 'Offers a translation of an Estonian word into English or vice-versa',
-                'value': [self.ling.prep_message_for_translation, 'message', 'match_pattern']
-            },
-            r'^ekss\s': {
-                'pattern': 'ekss <word-to-lookup>',
-                'cat': cat_lang,
-                'desc': 'Offers example usage of the given Estonian word',
-                'value': [self.ling.prep_message_for_examples, 'message', 'match_pattern']
-            },
-            r'^lemma\s': {
-                'pattern': 'lemma <word-to-lookup>',
-                'cat': cat_lang,
-                'desc': 'Determines the lemma of the Estonian word',
-                'value': [self.ling.prep_message_for_root, 'message', 'match_pattern']
-            },
-            r'^wfh\s?(time|epoch)': {
-                'pattern': 'wfh (time|epoch)',
-                'cat': cat_useful,
-                'desc': 'Prints the current WFH epoch time',
-                'value': [self.wfh_epoch]
-            },
-            r'^ety\s': {
-                'pattern': 'ety <word>',
-                'cat': cat_useful,
-                'desc': 'Gets the etymology of a given word',
-                'value': [self.ling.get_etymology, 'message', 'match_pattern']
-            }
         }
-        # Initiate the bot, which comes with common tools for interacting with Slack's API
-        self.st = SlackBotBase(log_name, triggers=self.triggers, creds=creds, test_channel=self.test_channel,
-                               commands=commands, cmd_categories=cmd_categories, debug=debug)
+        commands.update(self.plugins.commands())
+        self.commands = commands
+        self.cmd_categories = cmd_categories
+        # Runs commands from messages and actions alike
+        self.dispatcher = CommandDispatcher(commands, self.triggers)
+        self._help_args = (intro, avi_url, avi_alt)
+        self._log_name = log_name
+        # Same logger kavalkilu sets up for the bot, so these end up next to everything else it logs
+        self.log = logging.getLogger(log_name)
+        self._creds = creds
+        # Slack's client & friends - set once the 'connect' stage has run
+        self.st = None  # type: Optional[SlackBotBase]
+        self.bot_id = self.user_id = self.bot = None
+
+        # Custom emojis in the workspace, for reacting with
+        self.emojis = EmojiCatalog(os.path.join(self.data_dir, 'emojis.json'), fetch_func=self.fetch_emojis)
+        # Answers reactions on messages in controlled bursts
+        self.reactions = ReactionScheduler(react_func=self.add_reaction, pick_func=self.emojis.sample_weighted)
+        # Runs the bot's background work, most important first (replies, then deletions, digests, reactions)
+        self.work = WorkScheduler('work', max_workers=8, max_pending=200)
+        # Answers interactions (e.g., button clicks) through their response urls
+        self.responder = Responder(self.work)
+        # Lets users know we're on it when a command's slow
+        self.placeholder_text = 'Working on it... :hourglass_flowing_sand:'
+        # Placeholders get posted off the WorkScheduler, so they can't end up queued behind the command itself
+        self._placeholders = ThreadPoolExecutor(max_workers=2, thread_name_prefix='placeholders')
+        self.watchdog = LatencyWatchdog(threshold=slow_command_threshold, run_func=self._placeholders.submit)
+
+        # Dictionary of all users in the workspace (for determining changes in name, status), filled at startup
+        #   Only the fields we report on are kept, in compact records
+        self.users_dict = UserDirectory()
+        # For tracking updates to these dicts (taken away when the digest is sent)
+        self.profile_diff = ProfileDiffer(
+            avatars=AvatarFingerprinter(os.path.join(self.data_dir, 'avatars'), http=self.http))
+        # Emojis added since the last digest (name -> when it was first seen), earliest sighting kept
+        self.new_emojis = DictAccumulator(merge=min)
+
+        # Pending digests survive restarts. Other parts of the app can register their own state too,
+        #   then `self.state.restore()` gets called once everything's registered.
+        self.state = StateStore(os.path.join(self.data_dir, 'state.json.gz'), max_age=state_max_age)
+        self.state.register('new_emojis', dump=lambda: {k: (v, v) for k, v in self.new_emojis.snapshot().items()},
+                            restore=self.new_emojis.requeue)
+        self.state.register('profile_updates', dump=self.profile_diff.dump_state,
+                            restore=self.profile_diff.restore_state)
+
+        # Everything that talks to Slack happens in stages once the web server's up.
+        #   Only connecting is needed before events can be handled - the rest follows in the background.
+        self.startup = Startup()
+        self.startup.add_stage('connect', self._connect, critical=True)
+        self.startup.add_stage('announce', self._announce)
+        self.startup.add_stage('help', self._render_help)
+        self.startup.add_stage('emojis', self.emojis.load)
+        self.startup.add_stage('directory', self._load_directory)
+
+    def _connect(self):
+        """Initiates the bot, which comes with common tools for interacting with Slack's API"""
+        self.st = SlackBotBase(self._log_name, triggers=self.triggers, creds=self._creds,
+                               test_channel=self.test_channel, commands=self.commands,
+                               cmd_categories=self.cmd_categories, debug=self.debug)
         self.bot_id = self.st.bot_id
         self.user_id = self.st.user_id
         self.bot = self.st.bot
+        # The logger's set up by now, so its writes can be taken off the request threads
+        self.log_writer.install_tree(self._log_name)
 
+    def _announce(self):
         self.st.message_test_channel(blocks=self.bootup_msg)
 
-        # Lastly, build the help text based on the commands above and insert back into the commands dict
-        commands[r'^help']['value'] = self.st.build_help_block(intro, avi_url, avi_alt)
-        # Update the command dict in SlackBotBase
-        self.st.update_commands(commands)
+    def _render_help(self):
+        """Builds the help text based on the commands and inserts it back into the commands dict"""
+        self.commands[r'^help']['value'] = self.st.build_help_block(*self._help_args)
+        # Update the command dict in SlackBotBase and our dispatcher
+        self.st.update_commands(self.commands)
+        self.dispatcher.update(self.commands)
 
-        # Build a dictionary of all users in the workspace (for determining changes in name, status)
-        self.users_dict = {x['id']: x for x in self.st.get_channel_members('CM3E3E82J', True)}
-        # This dictionary is for tracking updates to these dicts
-        self.user_updates_dict = {}
+    def _load_directory(self):
+        """Fetches the workspace's users, the baseline for reporting profile changes"""
+        for user in self.st.get_channel_members('CM3E3E82J', True):
+            self.users_dict[user['id']] = user
+        self.profile_diff.seed(self.users_dict)
+
+    @property
+    def ling(self):
+        """The language tools (loads the language plugin if it hasn't been yet)"""
+        return self.plugins.load('language')
 
     def cleanup(self, *args):
         """Runs just before instance is destroyed"""
-        notify_block = [
-            self.bkb.make_context_section(f'{self.bot_name} died. :death-drops::party-dead::death-drops:')
-        ]
-        self.st.message_test_channel(blocks=notify_block)
+        # Hang on to the emoji usage counts and anything not yet reported
+        self.emojis.save()
+        self.state.checkpoint()
+        if self.st is not None:
+            notify_block = [
+                self.bkb.make_context_section(f'{self.bot_name} died. :death-drops::party-dead::death-drops:')
+            ]
+            self.st.message_test_channel(blocks=notify_block)
+        self.log_writer.stop()
         sys.exit(0)
 
-    @staticmethod
-    def process_incoming_action(user: str, channel: str, action: dict) -> Optional:
-        """Handles an incoming action (e.g., when a button is clicked)"""
-        if action['type'] == 'multi_static_select':
-            # Multiselect
-            selections = action['selected_options']
-            parsed_command = ''
-            for selection in selections:
-                value = selection['value'].replace('-', ' ')
-                if 'all' in value:
-                    # Only used for randpick/choose. Results in just the command 'rand(pick|choose)'
-                    #   If we're selecting all, we don't need to know any of the other selections.
-                    parsed_command = f'{value.split()[0]}'
-                    break
-                if parsed_command == '':
-                    # Put the entire first value into the parsed command (e.g., 'pick 1'
-                    parsed_command = f'{value}'
-                else:
-                    # Build on the already-made command by concatenating the number to the end
-                    #   e.g. 'pick 1' => 'pick 12'
-                    parsed_command += value.split()[1]
+    def fetch_emojis(self) -> Dict[str, str]:
+        """Collects all the custom emojis in the workspace (name -> url or alias)"""
+        return self.bot.emoji_list()['emoji']
 
-        elif action['type'] == 'button':
-            # Normal button clicks just send a 'value' key in the payload dict
-            parsed_command = action['value'].replace('-', ' ')
-        else:
-            # Command not parsed
-            # Probably should notify the user, but I'm not sure if Slack will attempt
-            #   to send requests multiple times if it doesn't get a response in time.
+    def send_digest(self, channel: str, messages: List[DigestMessage],
+                    on_failure: Optional[Callable[[List[Hashable]], None]] = None,
+                    on_sent: Optional[Callable[[List[Hashable]], None]] = None) -> Future:
+        """Sends the digest's messages in order, in the background
+
+        Args:
+            channel: str, the channel to send to
+            messages: list of DigestMessage, the packed digest
+            on_failure: callable, receives the keys of every item that didn't get sent if a send fails
+                (or if the digest got shed because the bot was too busy)
+            on_sent: callable, receives the keys of the items in each message once it's been sent
+        """
+        def _send():
+            for i, msg in enumerate(messages):
+                try:
+                    self.st.send_message(channel, '', blocks=msg.blocks)
+                except Exception:
+                    if on_failure is not None:
+                        on_failure([key for x in messages[i:] for key in x.keys])
+                    raise
+                if on_sent is not None:
+                    on_sent(msg.keys)
+
+        def _on_done(future: Future):
+            if on_failure is not None and not future.cancelled() and isinstance(future.exception(), WorkShed):
+                on_failure([key for x in messages for key in x.keys])
+
+        future = self.work.submit(_send, priority=DIGEST)
+        future.add_done_callback(_on_done)
+        return future
+
+    def add_reaction(self, channel: str, ts: str, emoji: str):
+        """Reacts to a message with the emoji"""
+        self.bot.reactions_add(name=emoji, channel=channel, timestamp=ts)
+
+    def command_in(self, event: dict) -> Optional[str]:
+        """The command in a message event, or None if the message isn't meant for Sasha"""
+        if event.get('subtype') is not None or event.get('bot_id') is not None:
+            # Edits, joins, bot messages and the like
             return None
+        return self.dispatcher.strip_trigger(event.get('text', ''))
 
-    # Basic / Static standalone methods
-    # ====================================================
-    @staticmethod
-    def giggle() -> str:
-        """Laughs, uncontrollably at times"""
-        # Count the 'no's
-        laugh_cycles = randint(1, 500)
-        response = f'ti{"hi" * laugh_cycles}!'
+    def handle_event(self, event_data: dict):
+        """Runs the command in a message, if the message is meant for Sasha"""
+        event = event_data['event']
+        command = self.command_in(event)
+        if command is None:
+            return
+        try:
+            self.run_command(command, channel=event['channel'], user=event.get('user'), ts=event.get('ts'))
+        except Exception:
+            # The command's been dealt with - it's the response that didn't make it
+            self.log.exception(f'Failed to send the response to `{command}`')
+
+    def handle_action(self, user: str, channel: str, action: dict):
+        """Runs the command a button click or selection stands for"""
+        try:
+            command = self.process_incoming_action(user, channel, action)
+        except Exception:
+            self.log.exception(f'Failed to parse action: {action}')
+            return
+        if command is None:
+            self.log.warning(f'No command for action of type {action.get("type")}')
+            return
+        try:
+            self.run_command(command, channel=channel, user=user)
+        except Exception:
+            self.log.exception(f'Failed to send the response to `{command}`')
+
+    def handle_slash_command(self, event_data: dict):
+        """Runs a slash command, delivering the result to the command's response url"""
+        command = parse_slash_command(event_data, self.triggers)
+        try:
+            response = self.dispatcher.dispatch(command, {'channel': event_data.get('channel_id'),
+                                                          'user': event_data.get('user_id')})
+            if isinstance(response, Iterator):
+                # A response url can only take a few posts, so a response in parts is sent all at once
+                response = ''.join(response)
+        except Exception:
+            self.log.exception(f'Failed to run `{command}`')
+            response = None
+            body = response_body(f'Something went wrong with `{command}` :sweat_smile:', 'ephemeral')
+        else:
+            if response is None or response == '':
+                body = response_body(f"I don't know what to do with `{command}`. Try `help`", 'ephemeral')
+            else:
+                body = response_body(response)
+        self.responder.respond(event_data['response_url'], body)
         return response
 
-    @staticmethod
-    def get_time() -> str:
-        """Gets the server time"""
-        return f'The server time is `{dt.today():%F %T}`'
+    def run_command(self, command: str, channel: str, user: Optional[str], **context) -> Any:
+        """Runs the command and sends its response to the channel.
+        If it takes a while, a placeholder gets posted in the meantime, which the response then replaces.
+        A response that comes in parts is posted as soon as the first one's ready.
+        A command that isn't known or that fails gets a reply saying so."""
+        # A placeholder posted too late to be replaced gets cleaned up once it's in
+        watch = self.watchdog.watch(lambda: self._post_placeholder(channel),
+                                    on_late=lambda ts: self.bot.chat_delete(channel=channel, ts=ts))
+        streamed = False
+        try:
+            if self.dispatcher.match(command) is None:
+                response = f"I don't know what to do with `{command}`. Try `help`"
+            else:
+                response = self.dispatcher.dispatch(command, dict(context, channel=channel, user=user))
+                if isinstance(response, Iterator):
+                    streamed = True
+                    return self.stream_response(channel, response, watch)
+        except Exception:
+            self.log.exception(f'Failed to run `{command}`')
+            response = f'Something went wrong with `{command}` :sweat_smile:'
+        # Nothing gets posted if the command was quick enough. What was streamed before a failure stays put
+        self.send_response(channel, response, replace_ts=None if streamed else watch.finish())
+        return response
 
-    def wfh_epoch(self) -> List[dict]:
-        """Calculates WFH epoch time"""
-        wfh_epoch = dt(year=2020, month=3, day=3, hour=19, minute=15)
-        now = dt.now()
-        diff = (now - wfh_epoch)
-        wfh_secs = diff.total_seconds()
-        strange_units = {
-            'dog years_2': (wfh_secs / (60 * 60 * 24)) / 52,
-            'hollow months_2': wfh_secs / (60 * 60 * 24 * 29),
-            'fortnights_1': wfh_secs / (60 * 60 * 24 * 7 * 2),
-            'kilowarhols_1': wfh_secs / (60 * 15000),
-            'weeks_1': wfh_secs / (60 * 60 * 24 * 7),
-            'sols_1': wfh_secs / (60 * 60 * 24 + 2375),
-            'microcenturies_0': wfh_secs / (52 * 60 + 35.76),
-            'Kermits_1': wfh_secs / 60 / 14.4,
-            'moments_0': wfh_secs / 90,
-            'millidays_2': wfh_secs / 86.4,
-            'microfortnights_2': wfh_secs * 1.2096,
-        }
+    def stream_response(self, channel: str, parts: Iterator[str], watch: Watch) -> str:
+        """Sends a command's response to the channel part by part, as they come in
+
+        Args:
+            channel: str, the channel to send to
+            parts: iterator of str, the response's parts
+            watch: Watch, the command's latency watch. The first part replaces its placeholder, if one was posted
+        Returns:
+            the whole response
+        """
+        message = None
+        try:
+            for part in parts:
+                if message is None:
+                    message = ProgressiveMessage(
+                        post=lambda text: self.bot.chat_postMessage(channel=channel, text=text)['ts'],
+                        update=lambda ts, text: self.bot.chat_update(channel=channel, ts=ts, text=text),
+                        ts=watch.finish())
+                message.add(part)
+        finally:
+            if message is None:
+                # Nothing came in (or it failed before anything did)
+                self.send_response(channel, None, replace_ts=watch.finish())
+            else:
+                message.close()
+        return '' if message is None else message.text
 
-        units = []
-        for k, v in strange_units.items():
-            unit, decimals = k.split('_')
-            decimals = int(decimals)
-            base_txt = f',.{decimals}f'
-            txt = '`{{:<20}} {{:>15{}}}`'.format(base_txt).format(f'{unit.title()}:', v)
-            units.append(txt)
+    def _post_placeholder(self, channel: str) -> str:
+        return self.bot.chat_postMessage(channel=channel, text=self.placeholder_text)['ts']
 
-        unit_txt = '\n'.join(units)
-        return [
-            self.bkb.make_context_section('WFH Epoch'),
-            self.bkb.make_block_section(
-                f'Current WFH epoch time is *`{wfh_secs:.0f}`*.'
-                f'\n ({diff})',
-            ),
-            self.bkb.make_context_section(f'{unit_txt}')
-        ]
+    def send_response(self, channel: str, response: Any, replace_ts: Optional[str] = None):
+        """Sends a command's response (text or blocks) to the channel
 
-    # Misc. methods
-    # ====================================================
-    def inspirational(self, channel: str):
-        """Sends a random inspirational message"""
-        resp = requests.get('https://inspirobot.me/api?generate=true')
-        if resp.status_code == 200:
-            url = resp.text
-            # Download img
-            img = requests.get(url)
-            if img.status_code == 200:
-                with open('/tmp/inspirational.jpg', 'wb') as f:
-                    f.write(img.content)
-                self.st.upload_file(channel, '/tmp/inspirational.jpg', 'inspirational-shit.jpg')
+        Args:
+            channel: str, the channel to send to
+            response: str or list of dict, the response
+            replace_ts: str, timestamp of a placeholder message to replace with the response
+        """
+        empty = response is None or response == ''
+        if replace_ts is not None:
+            if empty:
+                self.bot.chat_delete(channel=channel, ts=replace_ts)
+            elif isinstance(response, str):
+                self.bot.chat_update(channel=channel, ts=replace_ts, text=response)
+            else:
+                self.bot.chat_update(channel=channel, ts=replace_ts, text='', blocks=response)
+        elif empty:
+            return
+        elif isinstance(response, str):
+            self.st.send_message(channel, response)
+        else:
+            self.st.send_message(channel, '', blocks=response)
+
+    @staticmethod
+    def process_incoming_action(user: str, channel: str, action: dict) -> Optional[str]:
+        """Turns an incoming action (e.g., when a button is clicked) into the command it stands for"""
+        return parse_action(action)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import time
+import heapq
+import itertools
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional
+from .metrics import metrics, Metrics
+
+
+class Watch:
+    """A single watched piece of work. `finish` it once the work's done"""
+    __slots__ = ('due', 'on_slow', 'on_late', 'state', 'result', '_lock', '_fired')
+
+    def __init__(self, due: float, on_slow: Callable[[], Any], on_late: Optional[Callable[[Any], Any]] = None):
+        self.due = due
+        self.on_slow = on_slow
+        self.on_late = on_late
+        # waiting -> cancelled, or waiting -> firing -> fired (or -> abandoned, if `finish` gave up on it)
+        self.state = 'waiting'
+        self.result = None
+        self._lock = threading.Lock()
+        self._fired = threading.Event()
+
+    def _claim(self) -> bool:
+        """Called by the watchdog when the work's taking too long. False if it's already finished"""
+        with self._lock:
+            if self.state != 'waiting':
+                return False
+            self.state = 'firing'
+            return True
+
+    def _set_result(self, result: Any) -> bool:
+        """Returns True if `finish` gave up waiting, so nobody's going to use the result"""
+        with self._lock:
+            if self._fired.is_set():
+                return False
+            self.result = result
+            abandoned = self.state == 'abandoned'
+            if not abandoned:
+                self.state = 'fired'
+            self._fired.set()
+        return abandoned
+
+    def finish(self, timeout: float = 5) -> Optional[Any]:
+        """Marks the work as done.
+
+        Returns:
+            None if `on_slow` never ran (it won't now), otherwise what it returned
+                (waiting up to `timeout` for it to finish, if it's still going). If it's still not done by then,
+                None, and what it returns gets handed to `on_late` instead.
+        """
+        with self._lock:
+            if self.state == 'waiting':
+                self.state = 'cancelled'
+                return None
+        if not self._fired.wait(timeout):
+            with self._lock:
+                if not self._fired.is_set():
+                    self.state = 'abandoned'
+                    return None
+        return self.result
+
+
+class LatencyWatchdog:
+    """Calls `on_slow` for work that's been going longer than the threshold (e.g., to tell the user we're on it).
+
+    All watches share one timer thread and a heap of due times, so watching is cheap, and finishing before
+        the threshold is just flipping a flag. `on_slow` is handed to `run_func` so slow callbacks
+        don't hold up the timer. If `run_func` never gets around to it (its future fails or is cancelled),
+        the watch's `finish` stops waiting on it right away.
+    """
+
+    def __init__(self, threshold: float = 1.5, run_func: Optional[Callable[[Callable], Any]] = None,
+                 registry: Metrics = metrics):
+        """
+        Args:
+            threshold: float, seconds before work counts as slow
+            run_func: callable, runs the `on_slow` callbacks (e.g., an executor's submit). Defaults to the timer thread.
+            registry: Metrics, where slow work gets counted
+        """
+        self.threshold = threshold
+        self.run_func = run_func
+        self.metrics = registry
+        self._heap = []  # type: List[tuple]
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._loop, name='watchdog', daemon=True)
+        self._thread.start()
+
+    def watch(self, on_slow: Callable[[], Any], threshold: Optional[float] = None,
+              on_late: Optional[Callable[[Any], Any]] = None) -> Watch:
+        """Starts watching a piece of work
+
+        Args:
+            on_slow: callable, called once if the work isn't finished by the threshold
+            threshold: float, overrides the watchdog's threshold
+            on_late: callable, called with what `on_slow` returned if the work's `finish` stopped waiting for it
+                (e.g., to delete a placeholder nobody's going to replace)
+        """
+        due = time.monotonic() + (self.threshold if threshold is None else threshold)
+        watch = Watch(due, on_slow, on_late=on_late)
+        with self._cond:
+            heapq.heappush(self._heap, (due, next(self._seq), watch))
+            if self._heap[0][2] is watch:
+                self._cond.notify()
+        return watch
+
+    def _fire(self, watch: Watch):
+        try:
+            result = watch.on_slow()
+        except Exception:
+            self.metrics.inc('watchdog.errors')
+            result = None
+        if watch._set_result(result) and result is not None and watch.on_late is not None:
+            self.metrics.inc('watchdog.late')
+            try:
+                watch.on_late(result)
+            except Exception:
+                self.metrics.inc('watchdog.errors')
+
+    def _dropped(self, watch: Watch, future: Future):
+        """The `on_slow` call never ran (e.g., it was shed), so there's nothing to wait on"""
+        if future.cancelled() or future.exception() is not None:
+            self.metrics.inc('watchdog.dropped')
+            watch._set_result(None)
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while len(self._heap) == 0 or self._heap[0][0] > time.monotonic():
+                    self._cond.wait(None if len(self._heap) == 0 else self._heap[0][0] - time.monotonic())
+                _, _, watch = heapq.heappop(self._heap)
+            if not watch._claim():
+                # Finished in time
+                continue
+            self.metrics.inc('watchdog.slow')
+            if self.run_func is None:
+                self._fire(watch)
+                continue
+            try:
+                future = self.run_func(lambda w=watch: self._fire(w))
+            except Exception:
+                self.metrics.inc('watchdog.dropped')
+                watch._set_result(None)
+                continue
+            if isinstance(future, Future):
+                future.add_done_callback(lambda f, w=watch: self._dropped(w, f))
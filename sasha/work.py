@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import time
+import heapq
+import itertools
+import threading
+import contextvars
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+from .metrics import metrics, Metrics
+
+
+# Classes of work, most important first
+INTERACTIVE = 0  # Replies to commands and actions
+MODERATION = 1  # Message deletions
+DIGEST = 2  # Emoji / profile digests
+COSMETIC = 3  # Random reactions
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', MODERATION: 'moderation', DIGEST: 'digest', COSMETIC: 'cosmetic'}
+# How full the queue (as a share of max_pending) can be before a class stops being let in
+DEFAULT_ADMISSION = {INTERACTIVE: 1.0, MODERATION: 0.9, DIGEST: 0.6, COSMETIC: 0.3}
+
+
+class WorkShed(Exception):
+    """Set on the future of work that was dropped to keep the bot responsive"""
+
+    def __init__(self, priority: int):
+        self.priority = priority
+        super().__init__(f'{PRIORITY_NAMES.get(priority, priority)} work shed under load')
+
+
+class WorkScheduler:
+    """Thread pool that always picks the most important queued work first.
+
+    Each class of work is only let in while the queue is below its share of `max_pending`, so under load
+        cosmetic work is turned away first, then digests, then moderation. When a class is turned away but
+        less important work is queued, that work gets dropped instead to make room. Every dropped item is counted.
+    """
+
+    def __init__(self, name: str, max_workers: int = 8, max_pending: int = 200,
+                 admission: Optional[Dict[int, float]] = None, registry: Metrics = metrics):
+        """
+        Args:
+            name: str, the scheduler's name in metrics
+            max_workers: int, number of worker threads
+            max_pending: int, the most work that can be queued
+            admission: dict, priority -> share of max_pending at which that class stops being let in
+            registry: Metrics, where queue depths, waits and shed work get reported
+        """
+        self.name = name
+        self.max_pending = max_pending
+        self.admission = DEFAULT_ADMISSION if admission is None else admission
+        self.metrics = registry
+        self._heap = []  # type: List[tuple]
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stop = False
+        self._threads = [threading.Thread(target=self._worker, name=f'{name}-{i}', daemon=True)
+                         for i in range(max_workers)]
+        for thread in self._threads:
+            thread.start()
+        for priority, pname in PRIORITY_NAMES.items():
+            self.metrics.register_gauge(f'work.{name}.queued.{pname}', lambda p=priority: self.queued(p))
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def queued(self, priority: int) -> int:
+        with self._cond:
+            return sum(1 for x in self._heap if x[0] == priority)
+
+    def _shed(self, priority: int, future: Future):
+        self.metrics.inc(f'work.{self.name}.shed.{PRIORITY_NAMES.get(priority, priority)}')
+        future.set_exception(WorkShed(priority))
+
+    def submit(self, func: Callable, *args, priority: int = INTERACTIVE, **kwargs) -> Future:
+        """Queues the work, unless the bot's too busy for its class
+
+        Returns:
+            Future, holds the work's result (or WorkShed if it got dropped)
+        """
+        future = Future()
+        ctx = contextvars.copy_context()
+        limit = self.max_pending * self.admission.get(priority, 1.0)
+        with self._cond:
+            if len(self._heap) >= limit:
+                # Make room by dropping the least important (and newest) queued work, if there's any below this
+                victim = max(self._heap, default=None, key=lambda x: (x[0], x[1]))
+                if victim is None or victim[0] <= priority:
+                    self._shed(priority, future)
+                    return future
+                self._heap.remove(victim)
+                heapq.heapify(self._heap)
+                self._shed(victim[0], victim[2])
+            heapq.heappush(self._heap, (priority, next(self._seq), future, time.monotonic(), ctx,
+                                        lambda: func(*args, **kwargs)))
+            self._cond.notify()
+        return future
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while len(self._heap) == 0 and not self._stop:
+                    self._cond.wait()
+                if self._stop:
+                    return
+                priority, _, future, enqueued_at, ctx, work = heapq.heappop(self._heap)
+            pname = PRIORITY_NAMES.get(priority, priority)
+            self.metrics.inc(f'work.{self.name}.wait_seconds.{pname}', time.monotonic() - enqueued_at)
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(ctx.run(work))
+            except BaseException as e:
+                self.metrics.inc(f'work.{self.name}.errors.{pname}')
+                future.set_exception(e)
+
+    def shutdown(self, wait: bool = True):
+        """Stops the workers once they're done with what they're on (queued work is cancelled)"""
+        with self._cond:
+            self._stop = True
+            for item in self._heap:
+                item[2].cancel()
+            self._heap = []
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
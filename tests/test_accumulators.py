@@ -0,0 +1,67 @@
+"""Accumulator tests"""
+import time
+import threading
+import unittest
+from sasha.accumulators import DictAccumulator, SetAccumulator
+
+
+class TestAccumulators(unittest.TestCase):
+    n_writers = 8
+    n_items = 5000
+
+    def _hammer(self, write, swap) -> list:
+        """Runs writers against a flusher that keeps swapping; returns every batch taken"""
+        batches = []
+        done = threading.Event()
+
+        def writer(wid: int):
+            for i in range(self.n_items):
+                write(wid, i)
+
+        def flusher():
+            while not done.is_set():
+                batches.append(swap())
+                time.sleep(0.0005)
+
+        writers = [threading.Thread(target=writer, args=(w,)) for w in range(self.n_writers)]
+        flush_thread = threading.Thread(target=flusher)
+        flush_thread.start()
+        for t in writers:
+            t.start()
+        for t in writers:
+            t.join()
+        done.set()
+        flush_thread.join()
+        # Whatever's left after the last flush
+        batches.append(swap())
+        return batches
+
+    def test_set_swap_loses_nothing(self):
+        acc = SetAccumulator()
+        batches = self._hammer(lambda w, i: acc.add((w, i)), acc.swap)
+        seen = [item for batch in batches for item in batch]
+        self.assertEqual(len(seen), self.n_writers * self.n_items)
+        self.assertEqual(len(set(seen)), len(seen))
+        self.assertGreater(len(batches), 2)
+
+    def test_dict_swap_loses_nothing(self):
+        acc = DictAccumulator()
+        batches = self._hammer(lambda w, i: acc.put((w, i), i), acc.swap)
+        seen = [key for batch in batches for key in batch.keys()]
+        self.assertEqual(len(seen), self.n_writers * self.n_items)
+        self.assertEqual(len(set(seen)), len(seen))
+
+    def test_dict_merge_and_requeue(self):
+        acc = DictAccumulator(merge=lambda old, new: {'old': old['old'], 'new': new['new']})
+        acc.put('u1', {'old': 1, 'new': 2})
+        acc.put('u1', {'old': 2, 'new': 3})
+        batch = acc.swap()
+        self.assertEqual(batch, {'u1': {'old': 1, 'new': 3}})
+        # A change that comes in while the failed batch was out gets merged after it
+        acc.put('u1', {'old': 3, 'new': 4})
+        acc.requeue(batch)
+        self.assertEqual(acc.swap(), {'u1': {'old': 1, 'new': 4}})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+"""Web app tests (Sasha herself is mocked out - nothing connects to Slack)"""
+import os
+import sys
+import tempfile
+import subprocess
+import unittest
+
+
+KEYS = ['SIGNING_SECRET', 'XOXB_TOKEN', 'XOXP_TOKEN', 'VERIFY_TOKEN', 'ONBOARDING_KEY', 'SPREADSHEET_KEY']
+# Run in a fresh interpreter, so nothing other tests imported is in sys.modules yet
+IMPORT_APP = '''
+import sys
+from unittest import mock
+import sasha.utils
+from sasha.plugins import PluginRegistry
+with mock.patch('sasha.utils.Sasha'):
+    import sasha.app
+print('lxml' in sys.modules)
+PluginRegistry(bot=mock.Mock()).load('language')
+print('lxml' in sys.modules)
+'''
+# Startup's emojis and directory stages hang until told otherwise
+START_APP = '''
+import time
+import threading
+from unittest import mock
+import sasha.utils
+from sasha.metrics import Metrics
+from sasha.startup import Startup
+loaded = threading.Event()
+with mock.patch('sasha.utils.Sasha') as sasha_cls:
+    bot = sasha_cls.return_value
+    bot.startup = Startup(registry=Metrics())
+    bot.startup.add_stage('connect', lambda: None, critical=True)
+    bot.startup.add_stage('emojis', loaded.wait)
+    bot.startup.add_stage('directory', loaded.wait)
+    bot.profile_diff = ['U1', 'U2']
+    import sasha.app
+jobs = sasha.app.scheduler.jobs
+
+
+def refreshed():
+    jobs['emoji_refresh'].func()
+    return any(x[0][0] is bot.emojis.refresh_if_stale for x in bot.work.submit.call_args_list)
+
+
+bot.startup.ready.wait(10)
+print(sasha.app.scheduler._thread is not None, jobs['profile_update'].pending(), refreshed())
+loaded.set()
+while not bot.startup.is_open('directory'):
+    time.sleep(0.01)
+print(jobs['profile_update'].pending(), refreshed())
+sasha.app.scheduler.stop()
+'''
+# Slack delivering the same button click twice at once
+DUPLICATE_ACTION = '''
+import json
+import time
+import threading
+from unittest import mock
+import sasha.utils
+with mock.patch('sasha.utils.Sasha'):
+    import sasha.app
+
+
+class SlowDict(dict):
+    def __contains__(self, key):
+        found = super().__contains__(key)
+        # Gives the other delivery time to check too
+        time.sleep(0.05)
+        return found
+
+
+sasha.app.action_timestamps = SlowDict()
+sasha.app.handlers = mock.Mock()
+payload = json.dumps({'user': {'id': 'U1'}, 'channel': {'id': 'C1'}, 'actions': [{'block_id': 'b1'}],
+                      'container': {'is_ephemeral': False}, 'response_url': 'https://hooks.slack.com/x'})
+barrier = threading.Barrier(2)
+
+
+def deliver():
+    client = sasha.app.app.test_client()
+    barrier.wait()
+    client.post('/sasha/vikapi/actions', data={'payload': payload})
+
+
+threads = [threading.Thread(target=deliver) for _ in range(2)]
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+print(sasha.app.handlers.submit.call_count)
+'''
+
+
+class TestApp(unittest.TestCase):
+
+    def run_script(self, script: str) -> list:
+        """Runs the script with dummy keys, returning what it printed"""
+        with tempfile.TemporaryDirectory() as home:
+            os.makedirs(os.path.join(home, 'keys'))
+            for key in KEYS:
+                with open(os.path.join(home, 'keys', f'SASHA_SLACK_{key}'), 'w') as f:
+                    f.write('test')
+            env = dict(os.environ, HOME=home, SASHA_DEBUG='1')
+            root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            result = subprocess.run([sys.executable, '-c', script], cwd=root, env=env, capture_output=True,
+                                    text=True, timeout=60)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return result.stdout.split()
+
+    def test_language_tools_load_on_first_use(self):
+        self.assertEqual(self.run_script(IMPORT_APP), ['False', 'True'])
+
+    def test_scheduler_starts_before_the_slow_stages(self):
+        # Running once connected, but leaving the jobs that need the emojis or directory be until they're loaded
+        self.assertEqual(self.run_script(START_APP), ['True', '0', 'False', '2', 'True'])
+
+    def test_duplicate_actions_at_once_run_once(self):
+        self.assertEqual(self.run_script(DUPLICATE_ACTION), ['1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+"""Avatar fingerprinting tests"""
+import os
+import tempfile
+import threading
+import unittest
+from sasha.avatars import AvatarFingerprinter, DiskCache
+from sasha.metrics import Metrics
+
+
+class FakeResponse:
+
+    def __init__(self, content: bytes, status_code: int = 200):
+        self.content = content
+        self.status_code = status_code
+
+
+class FakeHttp:
+    """Serves images by url, optionally holding requests until released"""
+
+    def __init__(self, images: dict):
+        self.images = images
+        self.requested = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def get(self, url: str, **kwargs):
+        self.requested.append(url)
+        self.release.wait(5)
+        if url not in self.images:
+            return FakeResponse(b'', status_code=404)
+        return FakeResponse(self.images[url])
+
+
+class TestDiskCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = DiskCache(self.tmp_dir.name, max_bytes=25)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_round_trip(self):
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.set('a', b'1234')
+        self.assertEqual(self.cache.get('a'), b'1234')
+
+    def test_evicts_least_recently_used(self):
+        for i, key in enumerate(['a', 'b']):
+            self.cache.set(key, b'x' * 10)
+            os.utime(self.cache._fpath(key), (1000 + i, 1000 + i))
+        # Reading 'a' makes it the most recently used
+        self.cache.get('a')
+        self.cache.set('c', b'x' * 10)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertIsNotNone(self.cache.get('a'))
+        self.assertIsNotNone(self.cache.get('c'))
+        self.assertEqual(self.cache._total, 20)
+
+    def test_replacing_a_file_isnt_counted_twice(self):
+        for _ in range(5):
+            self.cache.set('a', b'x' * 10)
+        self.cache.set('b', b'x' * 10)
+        self.assertIsNotNone(self.cache.get('a'))
+        self.assertEqual(self.cache._total, 20)
+
+
+class TestAvatarFingerprinter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.metrics = Metrics()
+        self.http = FakeHttp({'https://avatars/1.png': b'cat', 'https://avatars/1-rotated.png': b'cat',
+                              'https://avatars/2.png': b'dog'})
+        self.avatars = AvatarFingerprinter(self.tmp_dir.name, http=self.http, registry=self.metrics)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_same_image(self):
+        self.assertTrue(self.avatars.same_image('https://avatars/1.png', 'https://avatars/1-rotated.png'))
+        self.assertFalse(self.avatars.same_image('https://avatars/1.png', 'https://avatars/2.png'))
+        self.assertIsNone(self.avatars.same_image('https://avatars/1.png', 'https://avatars/missing.png'))
+        # Each image was only fetched once
+        self.assertEqual(self.http.requested.count('https://avatars/1.png'), 1)
+
+    def test_no_wait_without_hashes(self):
+        self.http.release.clear()
+        self.assertIsNone(self.avatars.same_image('https://avatars/1.png', 'https://avatars/1-rotated.png',
+                                                  timeout=0))
+        self.http.release.set()
+
+    def test_images_are_kept_on_disk(self):
+        self.avatars.fingerprint('https://avatars/2.png')
+        avatars = AvatarFingerprinter(self.tmp_dir.name, http=self.http, registry=self.metrics)
+        avatars.fingerprint('https://avatars/2.png')
+        self.assertEqual(self.http.requested.count('https://avatars/2.png'), 1)
+        self.assertEqual(self.metrics.get('avatars.disk_hits'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
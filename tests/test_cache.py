@@ -0,0 +1,89 @@
+"""Cache tests"""
+import time
+import threading
+import unittest
+from sasha.cache import TTLCache
+
+
+class TestTTLCache(unittest.TestCase):
+
+    def test_expiry_and_eviction(self):
+        cache = TTLCache(ttl=0.05, max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('c'), 3)
+        time.sleep(0.06)
+        self.assertIsNone(cache.get('c'))
+
+    def test_negative_results_expire_sooner(self):
+        cache = TTLCache(ttl=10, negative_ttl=0.05)
+        cache.set('miss', None)
+        cache.set('empty', [])
+        cache.set('hit', ['dog'])
+        calls = []
+        self.assertIsNone(cache.get_or_compute('miss', lambda: calls.append(1)))
+        self.assertEqual(calls, [])
+        time.sleep(0.06)
+        cache.get_or_compute('miss', lambda: calls.append(1))
+        self.assertEqual(calls, [1])
+        self.assertIsNone(cache.get('empty'))
+        self.assertEqual(cache.get('hit'), ['dog'])
+
+    def test_stale_while_revalidate(self):
+        cache = TTLCache(ttl=0.05, stale_ttl=10)
+        cache.set('word', 'old')
+        time.sleep(0.06)
+        refreshed = threading.Event()
+
+        def refresh():
+            refreshed.set()
+            return 'new'
+
+        # The stale value comes back right away, the refresh happens in the background
+        self.assertEqual(cache.get_or_compute('word', refresh), 'old')
+        self.assertTrue(refreshed.wait(1))
+        for _ in range(100):
+            if cache.get('word') == 'new':
+                break
+            time.sleep(0.01)
+        self.assertEqual(cache.get('word'), 'new')
+
+    def test_concurrent_misses_compute_once(self):
+        cache = TTLCache()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.05)
+            return 'value'
+
+        threads = [threading.Thread(target=cache.get_or_compute, args=('key', compute)) for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(calls), 1)
+
+
+    def test_bounded_by_bytes(self):
+        cache = TTLCache(max_size=100, max_bytes=10)
+        cache.set('a', b'1234')
+        cache.set('b', b'5678')
+        self.assertEqual(cache.total_bytes, 8)
+        # Replacing an entry doesn't count it twice
+        cache.set('b', b'56')
+        self.assertEqual(cache.total_bytes, 6)
+        cache.set('c', b'abcdef')
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('c'), b'abcdef')
+        self.assertEqual(cache.total_bytes, 8)
+        # Too big to keep at all
+        cache.set('d', b'x' * 11)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.total_bytes, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+"""Command handling tests (Slack is faked - nothing gets sent)"""
+import time
+import logging
+import unittest
+from sasha.dispatch import CommandDispatcher
+from sasha.utils import Sasha
+from sasha.watchdog import LatencyWatchdog
+
+
+class FakeSlack:
+    """Stands in for both the Slack client and SlackBotBase, recording what gets sent"""
+
+    def __init__(self):
+        self.sent = []
+
+    def send_message(self, channel: str, message: str, blocks=None):
+        self.sent.append(('send', channel, message, blocks))
+
+    def chat_postMessage(self, channel: str, text: str):
+        self.sent.append(('post', channel, text))
+        return {'ts': f'ts{len(self.sent)}'}
+
+    def chat_update(self, channel: str, ts: str, text: str, blocks=None):
+        self.sent.append(('update', ts, text, blocks))
+
+    def chat_delete(self, channel: str, ts: str):
+        self.sent.append(('delete', ts))
+
+
+def broken():
+    raise ValueError('oops')
+
+
+COMMANDS = {
+    r'^hello': {'value': 'hello <@{user}>'},
+    r'^blocks': {'value': [{'type': 'divider'}]},
+    r'^broken': {'value': [broken]},
+    r'^quiet': {'value': [lambda: None]},
+}
+
+
+class TestCommands(unittest.TestCase):
+
+    def setUp(self):
+        self.slack = FakeSlack()
+        self.bot = Sasha.__new__(Sasha)
+        self.bot.log = logging.getLogger('sasha-test')
+        self.bot.dispatcher = CommandDispatcher(COMMANDS, ['sasha'])
+        self.bot.watchdog = LatencyWatchdog(threshold=60)
+        self.bot.placeholder_text = 'Working on it...'
+        self.bot.bot = self.bot.st = self.slack
+
+    def test_run_command(self):
+        self.assertEqual(self.bot.run_command('hello', channel='C1', user='U1'), 'hello <@U1>')
+        self.bot.run_command('blocks', channel='C1', user='U1')
+        self.assertEqual(self.slack.sent, [('send', 'C1', 'hello <@U1>', None),
+                                           ('send', 'C1', '', [{'type': 'divider'}])])
+
+    def test_unknown_command_gets_a_reply(self):
+        self.bot.run_command('dance', channel='C1', user='U1')
+        self.assertEqual(self.slack.sent, [('send', 'C1', "I don't know what to do with `dance`. Try `help`", None)])
+
+    def test_quiet_command_sends_nothing(self):
+        self.bot.run_command('quiet', channel='C1', user='U1')
+        self.assertEqual(self.slack.sent, [])
+
+    def test_failed_command_is_logged_and_answered(self):
+        with self.assertLogs('sasha-test', level='ERROR') as logs:
+            self.bot.run_command('broken', channel='C1', user='U1')
+        self.assertIn('ValueError: oops', logs.output[0])
+        self.assertEqual(self.slack.sent, [('send', 'C1', 'Something went wrong with `broken` :sweat_smile:', None)])
+
+    def test_slow_command_replaces_its_placeholder(self):
+        self.bot.watchdog = LatencyWatchdog(threshold=0.01)
+        self.bot.dispatcher.update(dict(COMMANDS, **{r'^slow': {'value': [lambda: time.sleep(0.1) or 'done']}}))
+        self.bot.run_command('slow', channel='C1', user='U1')
+        self.assertEqual(self.slack.sent, [('post', 'C1', 'Working on it...'), ('update', 'ts1', 'done', None)])
+
+    def test_stream_response(self):
+        sent_before_second = []
+
+        def parts():
+            yield 'a\n'
+            sent_before_second.extend(self.slack.sent)
+            yield 'b\n'
+
+        self.bot.dispatcher.update(dict(COMMANDS, **{r'^parts': {'value': [parts]}}))
+        self.assertEqual(self.bot.run_command('parts', channel='C1', user='U1'), 'a\nb\n')
+        # The first part went out before the second came in
+        self.assertEqual(sent_before_second, [('post', 'C1', 'a\n')])
+        self.assertEqual(self.slack.sent, [('post', 'C1', 'a\n'), ('update', 'ts1', 'a\nb\n', None)])
+
+    def test_stream_response_replaces_placeholder(self):
+        watch = self.bot.watchdog.watch(lambda: 'ts0')
+        watch._claim()
+        watch._set_result('ts0')
+        self.assertEqual(self.bot.stream_response('C1', iter(['a\n', 'b\n']), watch), 'a\nb\n')
+        self.assertEqual(self.slack.sent, [('update', 'ts0', 'a\n', None), ('update', 'ts0', 'a\nb\n', None)])
+
+    def test_stream_failure_keeps_what_was_sent(self):
+        def parts():
+            yield 'a\n'
+            raise ValueError('oops')
+
+        self.bot.dispatcher.update(dict(COMMANDS, **{r'^parts': {'value': [parts]}}))
+        with self.assertLogs('sasha-test', level='ERROR'):
+            self.bot.run_command('parts', channel='C1', user='U1')
+        self.assertEqual(self.slack.sent, [('post', 'C1', 'a\n'),
+                                           ('send', 'C1', 'Something went wrong with `parts` :sweat_smile:', None)])
+
+    def test_handle_event(self):
+        self.bot.handle_event({'event': {'text': 'sasha hello', 'channel': 'C1', 'user': 'U1'}})
+        self.bot.handle_event({'event': {'text': 'sasha hello', 'channel': 'C1', 'bot_id': 'B1'}})
+        self.bot.handle_event({'event': {'text': 'hello', 'channel': 'C1', 'user': 'U1'}})
+        self.assertEqual(self.slack.sent, [('send', 'C1', 'hello <@U1>', None)])
+
+    def test_handle_action(self):
+        self.bot.handle_action('U1', 'C1', {'type': 'button', 'value': 'hello'})
+        self.assertEqual(self.slack.sent, [('send', 'C1', 'hello <@U1>', None)])
+
+    def test_unknown_action_is_logged(self):
+        with self.assertLogs('sasha-test', level='WARNING'):
+            self.bot.handle_action('U1', 'C1', {'type': 'datepicker'})
+        with self.assertLogs('sasha-test', level='ERROR'):
+            self.bot.handle_action('U1', 'C1', {'type': 'button'})
+        self.assertEqual(self.slack.sent, [])
+
+    def test_send_response_replaces_placeholder(self):
+        self.bot.send_response('C1', 'done', replace_ts='ts1')
+        self.bot.send_response('C1', [{'type': 'divider'}], replace_ts='ts2')
+        self.bot.send_response('C1', None, replace_ts='ts3')
+        self.bot.send_response('C1', '')
+        self.assertEqual(self.slack.sent, [('update', 'ts1', 'done', None),
+                                           ('update', 'ts2', '', [{'type': 'divider'}]),
+                                           ('delete', 'ts3')])
+
+
+if __name__ == '__main__':
+    unittest.main()
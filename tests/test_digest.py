@@ -0,0 +1,63 @@
+"""Digest packing tests"""
+import unittest
+from sasha.digest import MAX_BLOCKS, DigestBuilder, block_chars, pack_lines, split_line
+
+
+def section(text: str) -> dict:
+    return {'type': 'section', 'text': {'type': 'mrkdwn', 'text': text}}
+
+
+class TestPackLines(unittest.TestCase):
+
+    def test_packs_into_few_chunks(self):
+        lines = [(i, 'x' * 10) for i in range(10)]
+        chunks = pack_lines(lines, max_chars=32)
+        # 3 lines (plus 2 newlines) fit in each chunk
+        self.assertEqual([keys for keys, _ in chunks], [[0, 1, 2], [3, 4, 5], [6, 7, 8], [9]])
+        self.assertTrue(all(len(text) <= 32 for _, text in chunks))
+
+    def test_long_lines_continue_instead_of_being_cut(self):
+        line = ' '.join(['word'] * 20)
+        chunks = pack_lines([('a', 'short'), ('b', line)], max_chars=30)
+        self.assertTrue(all(len(text) <= 30 for _, text in chunks))
+        self.assertEqual(' '.join(' '.join(text.split('\n')) for _, text in chunks), f'short {line}')
+        self.assertEqual(chunks[-1][0], ['b'])
+
+    def test_split_line(self):
+        self.assertEqual(split_line('abc def', 4), ['abc', 'def'])
+        self.assertEqual(split_line('abcdefgh', 3), ['abc', 'def', 'gh'])
+        self.assertEqual(split_line('ok', 3), ['ok'])
+
+
+class TestDigestBuilder(unittest.TestCase):
+
+    def test_splits_at_block_limit(self):
+        digest = DigestBuilder()
+        for i in range(30):
+            digest.add_group([section(f'user {i}'), {'type': 'divider'}], key=i)
+        messages = digest.build()
+        self.assertEqual(len(messages), 2)
+        self.assertTrue(all(len(x.blocks) <= MAX_BLOCKS for x in messages))
+        # Groups aren't split across messages
+        self.assertEqual(len(messages[0].blocks), 50)
+        self.assertEqual(messages[0].keys, list(range(25)))
+        self.assertEqual(messages[1].keys, list(range(25, 30)))
+
+    def test_splits_at_char_limit(self):
+        digest = DigestBuilder(max_chars=100)
+        for i in range(5):
+            digest.add_group([section('x' * 40)], key=i)
+        messages = digest.build()
+        self.assertEqual([x.keys for x in messages], [[0, 1], [2, 3], [4]])
+        self.assertTrue(all(block_chars(x.blocks) <= 100 for x in messages))
+
+    def test_oversized_group_is_split(self):
+        digest = DigestBuilder(max_blocks=3)
+        digest.add_group([section(str(i)) for i in range(7)], key='big')
+        messages = digest.build()
+        self.assertEqual([len(x.blocks) for x in messages], [3, 3, 1])
+        self.assertTrue(all(x.keys == ['big'] for x in messages))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+"""Command dispatch tests"""
+import unittest
+from sasha.dispatch import CommandDispatcher, parse_action, parse_slash_command
+
+
+class TestCommandDispatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        commands = {
+            r'^help': {'value': [{'type': 'section'}]},
+            r'good bo[tiy]': {'value': 'thanks <@{user}>!'},
+            r'^ety\s': {'value': [lambda *args: self.calls.append(args) or 'ety!', 'message', 'match_pattern']},
+        }
+        self.dispatcher = CommandDispatcher(commands, triggers=['sasha', 's!'])
+
+    def test_strip_trigger(self):
+        self.assertEqual(self.dispatcher.strip_trigger('Sasha, ety koer'), 'ety koer')
+        self.assertEqual(self.dispatcher.strip_trigger('s! help'), 'help')
+        self.assertIsNone(self.dispatcher.strip_trigger('sashay away'))
+        self.assertIsNone(self.dispatcher.strip_trigger('hello sasha'))
+
+    def test_values(self):
+        self.assertEqual(self.dispatcher.dispatch('good bot', {'user': 'U1'}), 'thanks <@U1>!')
+        self.assertEqual(self.dispatcher.dispatch('help', {}), [{'type': 'section'}])
+        self.assertEqual(self.dispatcher.dispatch('ety koer', {}), 'ety!')
+        self.assertEqual(self.calls, [('ety koer', r'^ety\s')])
+        self.assertIsNone(self.dispatcher.dispatch('nope', {}))
+
+    def test_update_recompiles(self):
+        self.dispatcher.update({r'^speak$': {'value': 'woof'}})
+        self.assertEqual(self.dispatcher.dispatch('SPEAK', {}), 'woof')
+        self.assertIsNone(self.dispatcher.dispatch('good bot', {'user': 'U1'}))
+
+
+class TestParseAction(unittest.TestCase):
+
+    def test_button(self):
+        self.assertEqual(parse_action({'type': 'button', 'value': 'ety-koer'}), 'ety koer')
+
+    def test_multiselect(self):
+        action = {'type': 'multi_static_select',
+                  'selected_options': [{'value': 'pick-1'}, {'value': 'pick-2'}]}
+        self.assertEqual(parse_action(action), 'pick 12')
+
+    def test_unknown(self):
+        self.assertIsNone(parse_action({'type': 'datepicker'}))
+
+
+class TestParseSlashCommand(unittest.TestCase):
+
+    def test_bot_command(self):
+        self.assertEqual(parse_slash_command({'command': '/sasha', 'text': ' ety koer '}, ['sasha', 's!']), 'ety koer')
+
+    def test_named_command(self):
+        self.assertEqual(parse_slash_command({'command': '/ety', 'text': 'koer'}, ['sasha']), 'ety koer')
+        self.assertEqual(parse_slash_command({'command': '/time', 'text': ''}, ['sasha']), 'time')
+
+
+if __name__ == '__main__':
+    unittest.main()
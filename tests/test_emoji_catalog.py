@@ -0,0 +1,91 @@
+"""Emoji catalog tests"""
+import os
+import tempfile
+import unittest
+from collections import Counter
+from sasha.emoji_catalog import EmojiCatalog
+
+
+class TestEmojiCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'emojis.json')
+        self.fetches = 0
+
+        def fetch():
+            self.fetches += 1
+            return {f'emoji{i}': f'https://emoji.slack-edge.com/{i}.png' for i in range(10)}
+
+        self.fetch = fetch
+        self.catalog = EmojiCatalog(self.path, fetch_func=fetch, rebuild_interval=0, save_delay=60)
+        self.catalog.load()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_loads_once_then_from_disk(self):
+        self.assertEqual(self.fetches, 1)
+        catalog = EmojiCatalog(self.path, fetch_func=lambda: self.fail('should load from disk'))
+        catalog.load()
+        self.assertEqual(len(catalog), 10)
+
+    def test_events_update_catalog(self):
+        self.catalog.apply_event({'subtype': 'add', 'name': 'party-parrot', 'value': 'url'})
+        self.catalog.apply_event({'subtype': 'remove', 'names': ['emoji0', 'emoji5', 'nonexistent']})
+        self.catalog.apply_event({'subtype': 'rename', 'old_name': 'emoji1', 'new_name': 'uno', 'value': 'url'})
+        names = {'party-parrot', 'uno'} | {f'emoji{i}' for i in [2, 3, 4, 6, 7, 8, 9]}
+        self.assertEqual({self.catalog.sample() for _ in range(1000)}, names)
+        # The file gets written once for the whole burst of changes
+        catalog = EmojiCatalog(self.path, fetch_func=dict)
+        catalog.load()
+        self.assertIn('emoji0', catalog.emojis)
+        self.catalog.save()
+        catalog = EmojiCatalog(self.path, fetch_func=dict)
+        catalog.load()
+        self.assertEqual(set(catalog.emojis.keys()), names)
+
+    def test_nothing_saved_or_lost_before_loading(self):
+        catalog = EmojiCatalog(self.path, fetch_func=self.fetch, save_delay=60)
+        catalog.apply_event({'subtype': 'add', 'name': 'party-parrot', 'value': 'url'})
+        catalog.save()
+        self.assertEqual(len(catalog), 0)
+        # The file on disk's still the full catalog
+        catalog.load()
+        self.assertEqual(self.fetches, 1)
+        self.assertEqual(len(catalog), 11)
+        self.assertIn('party-parrot', catalog)
+
+    def test_refreshes_once_stale(self):
+        self.catalog.record_use('emoji2')
+        self.catalog.save()
+        catalog = EmojiCatalog(self.path, fetch_func=self.fetch, max_age=60)
+        catalog.load()
+        self.assertEqual(self.fetches, 1)
+        self.assertFalse(catalog.refresh_if_stale())
+        catalog.refreshed_at -= 61
+        self.assertTrue(catalog.refresh_if_stale())
+        self.assertEqual(self.fetches, 2)
+        # Use counts survive the refresh
+        self.assertEqual(catalog.counts, {'emoji2': 1})
+
+    def test_old_format_is_refetched(self):
+        with open(self.path, 'w') as f:
+            f.write('{"version": 0, "emojis": {"stale": ""}}')
+        catalog = EmojiCatalog(self.path, fetch_func=self.fetch)
+        catalog.load()
+        self.assertEqual(self.fetches, 2)
+        self.assertNotIn('stale', catalog)
+
+    def test_weighted_sampling_favors_used_emojis(self):
+        for _ in range(990):
+            self.catalog.record_use('emoji3')
+        counts = Counter(self.catalog.sample_weighted() for _ in range(10000))
+        # emoji3 has a weight of 991 out of 1000
+        self.assertGreater(counts['emoji3'], 9700)
+        self.catalog.remove(['emoji3'])
+        self.assertNotIn('emoji3', {self.catalog.sample_weighted() for _ in range(1000)})
+
+
+if __name__ == '__main__':
+    unittest.main()
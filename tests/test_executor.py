@@ -0,0 +1,62 @@
+"""Keyed executor tests"""
+import time
+import threading
+import unittest
+from sasha.context import current_deadline, deadline_scope
+from sasha.executor import KeyedExecutor, KeyQueueFull, conversation_key
+from sasha.metrics import Metrics
+
+
+class TestKeyedExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+        self.executor = KeyedExecutor('test', max_workers=4, max_queue=50, registry=self.metrics)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_fifo_per_key(self):
+        results = {'a': [], 'b': []}
+
+        def work(key, i):
+            # Earlier items are slower, so they'd finish last if run in parallel
+            time.sleep(0.001 * (10 - i))
+            results[key].append(i)
+
+        futures = [self.executor.submit(key, work, key, i) for i in range(10) for key in ['a', 'b']]
+        for f in futures:
+            f.result(5)
+        self.assertEqual(results['a'], list(range(10)))
+        self.assertEqual(results['b'], list(range(10)))
+
+    def test_keys_run_in_parallel(self):
+        barrier = threading.Barrier(2, timeout=2)
+        futures = [self.executor.submit(key, barrier.wait) for key in ['a', 'b']]
+        for f in futures:
+            f.result(5)
+
+    def test_queue_is_bounded(self):
+        executor = KeyedExecutor('small', max_workers=1, max_queue=2, registry=self.metrics)
+        release = threading.Event()
+        executor.submit('a', release.wait)
+        executor.submit('a', lambda: None)
+        rejected = executor.submit('a', lambda: None)
+        self.assertIsInstance(rejected.exception(0), KeyQueueFull)
+        self.assertEqual(self.metrics.get('executor.small.rejected'), 1)
+        self.assertEqual(executor.submit('b', lambda: 'ok').done(), False)
+        release.set()
+        executor.shutdown()
+
+    def test_context_is_carried_over(self):
+        with deadline_scope(30):
+            future = self.executor.submit('a', current_deadline)
+        self.assertIsNotNone(future.result(5))
+
+    def test_conversation_key(self):
+        self.assertEqual(conversation_key({'channel': 'C1'}), 'C1')
+        self.assertEqual(conversation_key({'channel': 'C1', 'thread_ts': '1.2'}), 'C1:1.2')
+
+
+if __name__ == '__main__':
+    unittest.main()
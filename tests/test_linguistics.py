@@ -0,0 +1,185 @@
+"""Linguistics tests (no requests go out - the fetches are replaced)"""
+import unittest
+from sasha.batch import BadBatchRequest, parse_batch_request
+from sasha.linguistics import Linguistics
+from sasha.resilience import CircuitOpenError
+
+
+OPERATIONS = Linguistics.batch_operations
+
+
+class TestParseBatchRequest(unittest.TestCase):
+
+    def test_valid(self):
+        body = {'operation': 'lemma', 'words': ['koerad'], 'workers': 20}
+        self.assertEqual(parse_batch_request(body, OPERATIONS, 10, 8), ('lemma', ['koerad'], 8))
+
+    def test_not_an_object(self):
+        for body in [None, ['koer'], 'koer']:
+            with self.assertRaises(BadBatchRequest) as ctx:
+                parse_batch_request(body, OPERATIONS, 10, 8)
+            self.assertEqual(ctx.exception.status, 400)
+
+    def test_bad_fields(self):
+        for body in [{'operation': 'nope', 'words': []}, {'operation': 'lemma', 'words': 'koer'},
+                     {'operation': 'lemma', 'words': [1]}, {'operation': 'lemma', 'words': [], 'workers': 'x'}]:
+            with self.assertRaises(BadBatchRequest):
+                parse_batch_request(body, OPERATIONS, 10, 8)
+
+    def test_too_many_words(self):
+        with self.assertRaises(BadBatchRequest) as ctx:
+            parse_batch_request({'operation': 'lemma', 'words': ['a'] * 11}, OPERATIONS, 10, 8)
+        self.assertEqual(ctx.exception.status, 413)
+
+
+class TestLookup(unittest.TestCase):
+
+    def setUp(self):
+        self.ling = Linguistics()
+        self.fetched = []
+        roots = {'koerad': 'koer', 'kassid': 'kass'}
+        self.ling._fetch_root = lambda word: self.fetched.append(('root', word)) or roots.get(word)
+        self.ling._fetch_translations = lambda word, target='en': self.fetched.append(('tr', word)) or [f'{word}-en']
+        self.ling._fetch_examples = lambda word: ['Koer haugub', 'Koer magab']
+
+    def test_lookup(self):
+        self.assertEqual(self.ling.lookup('koerad', 'translate-en'),
+                         {'word': 'koerad', 'operation': 'translate-en', 'lemma': 'koer', 'result': ['koer-en']})
+        self.assertEqual(self.ling.lookup('koerad', 'lemma')['result'], 'koer')
+        self.assertEqual(self.ling.lookup('xyz', 'examples')['result'], [])
+        self.assertEqual(self.ling.lookup('dog', 'translate-et')['result'], ['dog-en'])
+        # The root was only fetched once
+        self.assertEqual(self.fetched.count(('root', 'koerad')), 1)
+
+    def test_unknown_operation(self):
+        with self.assertRaises(ValueError):
+            self.ling.lookup('koer', 'nope')
+
+    def test_batch_lookup(self):
+        results = list(self.ling.batch_lookup(['koerad', 'kassid', 'koerad', ' '], 'lemma'))
+        self.assertEqual(sorted(x['result'] for x in results), ['kass', 'koer'])
+
+    def test_batch_lookup_errors_are_reported(self):
+        def fail(word):
+            raise RuntimeError('down')
+        self.ling._fetch_root = fail
+        results = list(self.ling.batch_lookup(['koerad'], 'lemma'))
+        self.assertEqual(results, [{'word': 'koerad', 'operation': 'lemma', 'error': 'down'}])
+
+
+ETYMONLINE_PAGE = (b'<html><body>'
+                   b'<div class="word--C9UPa"><object><a>koer</a></object>'
+                   b'<object><section>dog, from Proto-Finnic\nsee also</section></object></div>'
+                   b'<div class="word--C9UPa"><object><a>kass</a></object><object><section>cat</section></object></div>'
+                   b'<div class="word--C9UPa"><object><a>koerus</a></object>'
+                   b'<object><section>prank</section></object></div>'
+                   b'</body></html>')
+
+
+class TestStreaming(unittest.TestCase):
+
+    def setUp(self):
+        self.ling = Linguistics()
+        self.ling._stream = lambda url: iter([ETYMONLINE_PAGE])
+        self.ling._fetch_root = {'koerad': 'koer'}.get
+        self.ling._fetch_examples = lambda word: ['Koer haugub', 'Koer magab'] if word == 'koer' else []
+
+    def test_stream_etymology(self):
+        parts = list(self.ling.stream_etymology('ety koer', r'^ety\s'))
+        self.assertEqual(parts, [':word:\n*`koer`*:\n_dog, from Proto-Finnic_ _see also_\n',
+                                 '*`koerus`*:\n_prank_\n'])
+        self.assertEqual(self.ling.get_etymology('ety koer', r'^ety\s'), ''.join(parts))
+        self.assertEqual(list(self.ling.stream_etymology('ety hobune', r'^ety\s')),
+                         ['No etymological data found for `hobune`.'])
+
+    def test_entries_yielded_as_page_comes_in(self):
+        fetched = []
+
+        def stream(url):
+            for i in range(0, len(ETYMONLINE_PAGE), 50):
+                fetched.append(i)
+                yield ETYMONLINE_PAGE[i:i + 50]
+
+        self.ling._stream = stream
+        parts = self.ling.stream_etymology('ety koer', r'^ety\s')
+        self.assertTrue(next(parts).startswith(':word:\n*`koer`*'))
+        # The first entry was out before the whole page was
+        self.assertLess(max(fetched) + 50, len(ETYMONLINE_PAGE))
+
+    def test_examples_page_not_read_past_the_word(self):
+        page = (b'<html><body><div class="tervikart"><p><span class="m leitud_id">koer</span>'
+                b'<span class="n">Koer haugub. Koer magab!</span></p></div>' + b'<p>x</p>' * 1000 + b'</body></html>')
+        fetched = []
+
+        def stream(url):
+            for i in range(0, len(page), 100):
+                fetched.append(i)
+                yield page[i:i + 100]
+
+        self.ling._stream = stream
+        self.assertEqual(Linguistics._fetch_examples(self.ling, 'koer'), ['Koer haugub', 'Koer magab'])
+        self.assertLess(len(fetched), 10)
+
+    def test_stream_examples(self):
+        parts = list(self.ling.stream_examples('ekss koerad', r'^ekss\s'))
+        self.assertEqual(parts[0].split('\n')[0], 'Examples for `koer`:')
+        self.assertEqual(sorted(x.strip('\n`') for x in [parts[0].split(':\n')[1]] + parts[1:]),
+                         ['Koer haugub', 'Koer magab'])
+        self.assertEqual(list(self.ling.stream_examples('ekss xyz', r'^ekss\s')), ['No examples found for `xyz`.'])
+
+    def test_unavailable_site(self):
+        def down(url):
+            raise CircuitOpenError('www.etymonline.com')
+
+        self.ling._stream = down
+        parts = list(self.ling.stream_etymology('ety koer', r'^ety\s'))
+        self.assertEqual(len(parts), 1)
+        self.assertIn('`www.etymonline.com`', parts[0])
+
+
+class FakeResponse:
+
+    def __init__(self, status_code: int, content: bytes = b'', headers: dict = None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = {} if headers is None else headers
+
+    def iter_content(self, chunk_size: int = 1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+
+class FakeHttp:
+
+    def __init__(self, responses: list):
+        self.responses = responses
+        self.requests = []
+
+    def get(self, url: str, headers: dict = None, stream: bool = False):
+        self.requests.append(headers)
+        return self.responses.pop(0)
+
+
+class TestConditionalRequests(unittest.TestCase):
+
+    def test_not_modified_reuses_body(self):
+        http = FakeHttp([FakeResponse(200, b'page', {'ETag': '"v1"'}), FakeResponse(304)])
+        ling = Linguistics(http=http)
+        self.assertEqual(ling._get('https://example.com/x'), b'page')
+        self.assertEqual(ling._get('https://example.com/x'), b'page')
+        self.assertEqual(http.requests[1], {'If-None-Match': '"v1"'})
+
+    def test_page_cache_bounded(self):
+        http = FakeHttp([FakeResponse(200, b'x' * 8, {'ETag': '"a"'}), FakeResponse(200, b'y' * 8, {'ETag': '"b"'})])
+        ling = Linguistics(http=http, page_cache_bytes=10)
+        ling._get('https://example.com/a')
+        ling._get('https://example.com/b')
+        self.assertIsNone(ling.validators.get('https://example.com/a'))
+        self.assertLessEqual(ling.validators.total_bytes, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
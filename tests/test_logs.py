@@ -0,0 +1,125 @@
+"""Background logging tests"""
+import io
+import logging
+import threading
+import unittest
+from sasha.logs import LogWriter, QueueLogHandler, event_scope
+from sasha.metrics import Metrics
+
+
+class BlockingHandler(logging.Handler):
+    """Holds up the writer until it's let go"""
+
+    def __init__(self):
+        super().__init__()
+        self.release_event = threading.Event()
+        self.records = []
+        self.formatted = []
+
+    def emit(self, record: logging.LogRecord):
+        self.release_event.wait(5)
+        self.records.append(record.getMessage())
+        self.formatted.append(self.format(record))
+
+
+class TestLogWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+        self.stream = io.StringIO()
+        self.target = logging.StreamHandler(self.stream)
+        self.target.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
+        self.logger = logging.getLogger(f'sasha-test-{self.id()}')
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.propagate = False
+        self.logger.addHandler(self.target)
+
+    def tearDown(self):
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+
+    def test_writes_in_background(self):
+        writer = LogWriter(registry=self.metrics)
+        writer.install(self.logger)
+        self.assertIsInstance(self.logger.handlers[0], QueueLogHandler)
+        for i in range(50):
+            self.logger.info('line %d', i)
+        writer.stop()
+        self.assertEqual(self.stream.getvalue().splitlines(), [f'INFO line {i}' for i in range(50)])
+        self.assertEqual(self.metrics.get('logs.written'), 50)
+        # The logger gets its handler back
+        self.assertEqual(self.logger.handlers, [self.target])
+
+    def test_full_queue_drops(self):
+        blocking = BlockingHandler()
+        self.logger.addHandler(blocking)
+        writer = LogWriter(max_queue=5, batch_size=1, registry=self.metrics)
+        writer.install(self.logger)
+        for i in range(20):
+            self.logger.info('line %d', i)
+        # The writer's stuck on the first record, so the queue fills up and the rest are dropped
+        self.assertGreater(self.metrics.get('logs.dropped'), 0)
+        blocking.release_event.set()
+        writer.stop()
+        self.assertEqual(len(blocking.records) + self.metrics.get('logs.dropped'), 20)
+
+    def test_sampling_keeps_whole_events(self):
+        writer = LogWriter(sample_every={'message': 5}, registry=self.metrics)
+        writer.install(self.logger)
+        for i in range(10):
+            with event_scope('message'):
+                self.logger.info('message %d received', i)
+                self.logger.info('message %d handled', i)
+                if i == 1:
+                    self.logger.warning('always kept')
+        self.logger.info('untagged')
+        writer.stop()
+        lines = self.stream.getvalue().splitlines()
+        self.assertEqual(lines, ['INFO message 0 received', 'INFO message 0 handled', 'WARNING always kept',
+                                 'INFO message 5 received', 'INFO message 5 handled', 'INFO untagged'])
+        self.assertEqual(self.metrics.get('logs.sampled_out'), 16)
+
+    def test_args_and_tracebacks_captured_when_logged(self):
+        blocking = BlockingHandler()
+        blocking.setFormatter(logging.Formatter('%(message)s'))
+        self.logger.handlers = [blocking]
+        writer = LogWriter(batch_size=1, registry=self.metrics)
+        writer.install(self.logger)
+        self.logger.info('first')
+        items = ['a']
+        self.logger.info('items: %s', items)
+        try:
+            raise ValueError('oops')
+        except ValueError:
+            self.logger.exception('failed')
+        # Changed while the records are still queued
+        items.append('b')
+        blocking.release_event.set()
+        writer.stop()
+        self.assertEqual(blocking.records[:2], ['first', "items: ['a']"])
+        self.assertIn('ValueError: oops', blocking.formatted[-1])
+
+    def test_handler_level_respected(self):
+        self.target.setLevel(logging.WARNING)
+        writer = LogWriter(registry=self.metrics)
+        writer.install(self.logger)
+        self.logger.info('quiet')
+        self.logger.error('loud')
+        writer.stop()
+        self.assertEqual(self.stream.getvalue(), 'ERROR loud\n')
+
+    def test_install_tree(self):
+        child = logging.getLogger(f'{self.logger.name}.child')
+        child_stream = io.StringIO()
+        child.addHandler(logging.StreamHandler(child_stream))
+        writer = LogWriter(registry=self.metrics)
+        writer.install_tree(self.logger.name)
+        self.assertIsInstance(child.handlers[0], QueueLogHandler)
+        child.warning('from the child')
+        writer.stop()
+        self.assertEqual(child_stream.getvalue(), 'from the child\n')
+        child.handlers = []
+
+
+if __name__ == '__main__':
+    unittest.main()
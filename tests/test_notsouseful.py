@@ -0,0 +1,36 @@
+"""Inspirational image fetching tests (the sites are faked)"""
+import unittest
+from unittest import mock
+from sasha.plugins.notsouseful import NotSoUseful
+from sasha.resilience import DependencyUnavailable
+
+
+class TestFetchInspirational(unittest.TestCase):
+
+    def setUp(self):
+        self.bot = mock.Mock()
+        self.bot.uploader.max_bytes = 5
+        self.img = mock.Mock(status_code=200, content=b'abc', headers={'Content-Type': 'image/png'})
+        self.bot.http.get.side_effect = [mock.Mock(status_code=200, text='https://generated.inspirobot.me/a.jpg'),
+                                         self.img]
+        self.plugin = NotSoUseful(self.bot)
+
+    def test_fetch(self):
+        self.assertEqual(self.plugin._fetch_inspirational(), (b'abc', 'image/png'))
+
+    def test_failed_download(self):
+        self.img.status_code = 404
+        with self.assertRaises(DependencyUnavailable) as ctx:
+            self.plugin._fetch_inspirational()
+        self.assertIn('status 404', str(ctx.exception))
+
+    def test_image_too_large(self):
+        self.img.content = b'x' * 6
+        with self.assertRaises(DependencyUnavailable) as ctx:
+            self.plugin._fetch_inspirational()
+        self.assertIn('image too large (6 bytes)', str(ctx.exception))
+        self.assertNotIn('status', str(ctx.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
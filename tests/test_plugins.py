@@ -0,0 +1,43 @@
+"""Plugin loading tests"""
+import sys
+import unittest
+from sasha.metrics import Metrics
+from sasha.plugins import Command, Plugin, PluginRegistry, PLUGINS
+
+
+class TestPluginRegistry(unittest.TestCase):
+
+    def setUp(self):
+        sys.modules.pop('sasha.plugins.basic', None)
+        self.plugins = PluginRegistry(bot=None, plugins=[
+            Plugin('basic', 'sasha.plugins.basic', [
+                Command(r'^time$', 'time', 'Display current server time', func='get_time'),
+                Command(r'^speak$', 'speak', '_Really_ basic response here.', value='woof', cat='noise'),
+            ]),
+        ], registry=Metrics())
+
+    def test_commands_dont_load_plugins(self):
+        commands = self.plugins.commands()
+        self.assertEqual(commands[r'^speak$']['value'], 'woof')
+        self.assertEqual(commands[r'^speak$']['cat'], 'noise')
+        self.assertEqual(commands[r'^time$']['cat'], 'basic')
+        self.assertEqual(self.plugins.categories, ['basic', 'noise'])
+        self.assertNotIn('sasha.plugins.basic', sys.modules)
+        self.assertEqual(self.plugins.loaded, [])
+
+    def test_first_call_loads_plugin(self):
+        get_time = self.plugins.commands()[r'^time$']['value'][0]
+        self.assertIn('server time', get_time())
+        self.assertEqual(self.plugins.loaded, ['basic'])
+        first = self.plugins.load('basic')
+        get_time()
+        self.assertIs(self.plugins.load('basic'), first)
+
+    def test_every_command_has_a_handler_or_value(self):
+        for plugin in PLUGINS:
+            for cmd in plugin.commands:
+                self.assertTrue((cmd.func is None) != (cmd.value is None), cmd.regex)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+"""Prefetch pool tests"""
+import time
+import itertools
+import unittest
+from sasha.metrics import Metrics
+from sasha.prefetch import PrefetchPool
+
+
+class TestPrefetchPool(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+        self.counter = itertools.count()
+
+    def _pool(self, **kwargs) -> PrefetchPool:
+        return PrefetchPool('test', lambda: next(self.counter), registry=self.metrics, **kwargs)
+
+    def test_refills_are_rate_limited(self):
+        pool = self._pool(size=3, per_refill=2)
+        self.assertEqual(pool.refill(), 2)
+        self.assertEqual(pool.refill(), 1)
+        self.assertEqual(pool.refill(), 0)
+        self.assertEqual([pool.take() for _ in range(4)], [0, 1, 2, None])
+        self.assertEqual(self.metrics.get('prefetch.test.misses'), 1)
+
+    def test_in_use_once_asked(self):
+        pool = self._pool()
+        self.assertFalse(pool.in_use)
+        pool.take()
+        self.assertTrue(pool.in_use)
+
+    def test_stale_items_are_dropped(self):
+        pool = self._pool(max_age=0.01)
+        pool.refill()
+        time.sleep(0.02)
+        self.assertIsNone(pool.take())
+        self.assertEqual(self.metrics.get('prefetch.test.expired'), 1)
+
+    def test_failed_fetches_wait_for_next_refill(self):
+        def broken():
+            raise ConnectionError()
+
+        pool = PrefetchPool('test', broken, registry=self.metrics)
+        self.assertEqual(pool.refill(), 0)
+        self.assertEqual(self.metrics.get('prefetch.test.failures'), 1)
+
+    def test_refill_async_skips_full_pool(self):
+        pool = self._pool(size=1)
+        pool.refill_async().result(1)
+        self.assertEqual(len(pool), 1)
+        self.assertIsNone(pool.refill_async())
+
+
+if __name__ == '__main__':
+    unittest.main()
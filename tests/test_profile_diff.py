@@ -0,0 +1,77 @@
+"""Profile diff tests"""
+import tempfile
+import unittest
+from sasha.avatars import AvatarFingerprinter
+from sasha.metrics import Metrics
+from sasha.profile_diff import ProfileDiffer
+
+
+def user(**kwargs) -> dict:
+    info = {'id': 'U1', 'avi': 'https://avatars/1.png', 'display_name': 'b', 'real_name': 'B',
+            'title': '', 'status_emoji': '', 'status_text': '', 'tz': 'Europe/Tallinn'}
+    info.update(kwargs)
+    return info
+
+
+class FakeResponse:
+
+    def __init__(self, content: bytes):
+        self.content = content
+        self.status_code = 200
+
+
+class FakeHttp:
+
+    def __init__(self, images: dict):
+        self.images = images
+        self.requested = []
+
+    def get(self, url: str, **kwargs):
+        self.requested.append(url)
+        return FakeResponse(self.images[url])
+
+
+class TestProfileDiffer(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+        self.differ = ProfileDiffer(registry=self.metrics)
+        self.differ.seed({'U1': user()})
+
+    def test_unreported_fields_are_dropped(self):
+        self.assertFalse(self.differ.observe('U1', user(), user(tz='America/Chicago')))
+        self.assertEqual(len(self.differ), 0)
+        self.assertEqual(self.metrics.get('profiles.noop_events'), 1)
+
+    def test_changes_are_coalesced(self):
+        self.differ.observe('U1', user(), user(status_emoji=':coffee:'))
+        self.differ.observe('U1', user(), user(status_emoji=':coffee:', status_text='brb'))
+        changes = self.differ.take()
+        self.assertEqual(changes['U1']['old']['status_emoji'], '')
+        self.assertEqual(changes['U1']['new']['status_text'], 'brb')
+        self.assertNotIn('tz', changes['U1']['new'].to_dict())
+        self.assertEqual(len(self.differ), 0)
+
+    def test_reverted_changes_are_dropped(self):
+        self.differ.observe('U1', user(), user(title='boss'))
+        self.differ.observe('U1', user(), user())
+        self.assertEqual(self.differ.take(), {})
+
+    def test_rotated_avatar_url_is_ignored(self):
+        http = FakeHttp({'https://avatars/1.png': b'cat', 'https://avatars/1-rotated.png': b'cat'})
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            avatars = AvatarFingerprinter(tmp_dir, http=http, registry=self.metrics)
+            differ = ProfileDiffer(avatars=avatars, registry=self.metrics)
+            differ.observe('U1', user(), user(avi='https://avatars/1-rotated.png'))
+            differ.observe('U2', user(), user(avi='https://avatars/1-rotated.png', title='boss'))
+            # The images are fetched as the changes come in, so the digest doesn't wait on them
+            for url in http.images:
+                avatars.prefetch(url).result(5)
+            self.assertIn('https://avatars/1-rotated.png', http.requested)
+            changes = differ.take()
+        self.assertNotIn('U1', changes)
+        self.assertEqual(changes['U2']['new']['avi'], changes['U2']['old']['avi'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+"""Progressive message tests"""
+import unittest
+from sasha.metrics import Metrics
+from sasha.progressive import ProgressiveMessage, split_text
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestProgressiveMessage(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+        self.clock = FakeClock()
+        self.messages = {}
+        self.calls = []
+
+    def _post(self, text: str) -> str:
+        ts = f'ts-{len(self.messages)}'
+        self.messages[ts] = text
+        self.calls.append(('post', ts))
+        return ts
+
+    def _update(self, ts: str, text: str):
+        self.messages[ts] = text
+        self.calls.append(('update', ts))
+
+    def _message(self, **kwargs) -> ProgressiveMessage:
+        return ProgressiveMessage(self._post, self._update, registry=self.metrics, clock=self.clock, **kwargs)
+
+    def test_first_part_posted_right_away(self):
+        msg = self._message()
+        msg.add('first\n')
+        self.assertEqual(self.messages, {'ts-0': 'first\n'})
+
+    def test_updates_are_batched(self):
+        msg = self._message(min_interval=1.0)
+        msg.add('a\n')
+        for part in ['b\n', 'c\n', 'd\n']:
+            self.clock.now += 0.1
+            msg.add(part)
+        # Too soon after the post for an update
+        self.assertEqual(self.calls, [('post', 'ts-0')])
+        self.clock.now += 1.0
+        msg.add('e\n')
+        self.assertEqual(self.calls, [('post', 'ts-0'), ('update', 'ts-0')])
+        self.assertEqual(self.messages['ts-0'], 'a\nb\nc\nd\ne\n')
+        msg.add('f\n')
+        self.assertEqual(msg.close(), ['ts-0'])
+        self.assertEqual(self.messages['ts-0'], msg.text)
+        self.assertEqual(self.metrics.get('progressive.updates'), 2)
+
+    def test_first_part_replaces_placeholder(self):
+        msg = self._message(ts='placeholder')
+        msg.add('first')
+        self.assertEqual(self.calls, [('update', 'placeholder')])
+        self.assertEqual(msg.close(), ['placeholder'])
+
+    def test_continues_in_new_message(self):
+        msg = self._message(max_chars=10, min_interval=60)
+        msg.add('aaaa\n')
+        self.clock.now += 1
+        msg.add('bbbb\n')
+        msg.add('cccc\n')
+        timestamps = msg.close()
+        self.assertEqual(timestamps, ['ts-0', 'ts-1'])
+        # The full message is brought up to date before the continuation is posted
+        self.assertEqual(self.messages, {'ts-0': 'aaaa\nbbbb\n', 'ts-1': 'cccc\n'})
+        self.assertEqual(self.metrics.get('progressive.continuations'), 1)
+
+    def test_oversized_part_is_split(self):
+        msg = self._message(max_chars=10)
+        msg.add('aaaa\nbbbb\ncccccccccccccc')
+        msg.close()
+        self.assertEqual(list(self.messages.values()), ['aaaa\nbbbb\n', 'cccccccccc', 'cccc'])
+        self.assertTrue(all(len(x) <= 10 for x in self.messages.values()))
+
+    def test_split_text(self):
+        self.assertEqual(split_text('', 10), [''])
+        self.assertEqual(split_text('abc\ndef', 5), ['abc\n', 'def'])
+        self.assertEqual(''.join(split_text('x' * 25 + '\n' + 'y' * 3, 10)), 'x' * 25 + '\n' + 'y' * 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+"""Reaction scheduler tests"""
+import unittest
+from sasha.metrics import Metrics
+from sasha.reactions import ReactionScheduler
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestReactionScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+        self.clock = FakeClock()
+        self.reacted = []
+        self.error = None
+
+    def _react(self, channel: str, ts: str, emoji: str):
+        if self.error is not None:
+            raise Exception(self.error)
+        self.reacted.append((channel, ts, emoji))
+
+    def _scheduler(self, **kwargs) -> ReactionScheduler:
+        return ReactionScheduler(self._react, pick_func=lambda: 'party-parrot', window=3, registry=self.metrics,
+                                 clock=self.clock, **kwargs)
+
+    def test_reactions_on_a_message_are_merged(self):
+        scheduler = self._scheduler()
+        for reaction in ['a', 'b', 'c']:
+            scheduler.submit('C1', '1.0', reaction)
+            self.clock.now += 0.5
+        # Still within the window
+        self.assertEqual(scheduler.flush(), 0)
+        self.clock.now += 3
+        self.assertEqual(scheduler.flush(), 1)
+        self.assertEqual(self.reacted, [('C1', '1.0', 'party-parrot')])
+        self.assertEqual(self.metrics.get('reactions.coalesced'), 2)
+
+    def test_per_message_cap(self):
+        scheduler = self._scheduler(per_message_cap=2)
+        for _ in range(3):
+            scheduler.submit('C1', '1.0', 'a')
+            self.clock.now += 3
+            scheduler.flush()
+        self.assertEqual(len(self.reacted), 2)
+        self.assertEqual(self.metrics.get('reactions.skipped_capped'), 1)
+
+    def test_per_minute_cap_drops_quietest(self):
+        scheduler = self._scheduler(per_minute_cap=2)
+        for i, events in enumerate([1, 5, 3]):
+            for _ in range(events):
+                scheduler.submit('C1', f'{i}.0', 'a')
+        self.clock.now += 3
+        self.assertEqual(scheduler.flush(), 2)
+        self.assertEqual({x[1] for x in self.reacted}, {'1.0', '2.0'})
+        self.assertEqual(self.metrics.get('reactions.dropped_load'), 1)
+        # The budget frees up a minute later
+        scheduler.submit('C1', '3.0', 'a')
+        self.clock.now += 3
+        self.assertEqual(scheduler.flush(), 0)
+        scheduler.submit('C1', '4.0', 'a')
+        self.clock.now += 60
+        self.assertEqual(scheduler.flush(), 1)
+
+    def test_slack_limit(self):
+        scheduler = self._scheduler(slack_limit=3, per_message_cap=5)
+        for reaction in ['a', 'b', 'c']:
+            scheduler.submit('C1', '1.0', reaction)
+        self.clock.now += 3
+        self.assertEqual(scheduler.flush(), 0)
+        self.assertEqual(self.metrics.get('reactions.skipped_full'), 1)
+        # Slack saying so counts too
+        self.error = 'too_many_reactions'
+        scheduler.submit('C1', '2.0', 'a')
+        self.clock.now += 3
+        scheduler.flush()
+        self.error = None
+        scheduler.submit('C1', '2.0', 'b')
+        self.clock.now += 3
+        self.assertEqual(scheduler.flush(), 0)
+        self.assertEqual(self.metrics.get('reactions.skipped_full'), 3)
+
+    def test_already_reacted_is_not_an_error(self):
+        scheduler = self._scheduler()
+        self.error = 'The request to the Slack API failed. already_reacted'
+        scheduler.submit('C1', '1.0', 'a')
+        self.clock.now += 3
+        self.assertEqual(scheduler.flush(), 0)
+        self.assertEqual(self.metrics.get('reactions.already_reacted'), 1)
+        self.assertEqual(self.metrics.get('reactions.errors'), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+"""Streaming upload tests (no requests go out - the calls to Slack are faked)"""
+import json
+import unittest
+from unittest import mock
+from sasha.metrics import Metrics
+from sasha.relay import SizedBody, SlackUploader, UploadTooLarge
+from sasha.resilience import HOST_POLICIES, DependencyUnavailable, HostPolicy, ResilientClient
+
+
+class FakeResponse:
+
+    def __init__(self, status_code: int = 200, body=None, headers=None, chunks=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = {} if headers is None else headers
+        self.chunks = [] if chunks is None else chunks
+        self.closed = False
+
+    def json(self):
+        if self.body is None:
+            raise ValueError('not json')
+        return self.body
+
+    def iter_content(self, chunk_size: int = 1):
+        return iter(self.chunks)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSlack:
+    """Stands in for the ResilientClient, answering the upload flow's calls"""
+
+    def __init__(self, complete_ok: bool = True, upload_status: int = 200):
+        self.complete_ok = complete_ok
+        self.upload_status = upload_status
+        self.calls = []
+        self.uploaded = None
+
+    def post(self, url: str, **kwargs):
+        self.calls.append((url, kwargs))
+        if url.endswith('/files.getUploadURLExternal'):
+            return FakeResponse(body={'ok': True, 'upload_url': 'https://files.slack.com/upload/v1/abc',
+                                      'file_id': 'F1'})
+        if url.endswith('/files.completeUploadExternal'):
+            return FakeResponse(body={'ok': True, 'files': [{'id': 'F1'}]} if self.complete_ok
+                                else {'ok': False, 'error': 'channel_not_found'})
+        body = kwargs['data']
+        self.uploaded = (len(body), b''.join(body))
+        return FakeResponse(self.upload_status)
+
+
+class TestSizedBody(unittest.TestCase):
+
+    def test_chunks_are_passed_through_lazily(self):
+        pulled = []
+
+        def chunks():
+            for x in [b'a', b'b']:
+                pulled.append(x)
+                yield x
+
+        body = iter(SizedBody(chunks(), 2))
+        self.assertEqual(pulled, [])
+        self.assertEqual(next(body), b'a')
+        self.assertEqual(pulled, [b'a'])
+
+
+class TestSlackUploader(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+        self.slack = FakeSlack()
+        self.uploader = SlackUploader('xoxb', http=self.slack, max_bytes=10, registry=self.metrics)
+
+    def test_oversized_files_are_cut_off(self):
+        capped = self.uploader._capped(iter([b'abc', b'', b'defghijk']))
+        self.assertEqual(next(capped), b'abc')
+        with self.assertRaises(UploadTooLarge):
+            next(capped)
+
+    def test_byte_count_is_reported(self):
+        self.assertEqual(b''.join(self.uploader._capped(iter([b'abc', b'de']))), b'abcde')
+        self.assertEqual(self.metrics.get('uploads.bytes'), 5)
+
+    def test_upload(self):
+        result = self.uploader.upload('C1', [b'abc', b'de'], 'x.jpg', title='hi', content_type='image/jpeg')
+        self.assertTrue(result['ok'])
+        urls = [x[0] for x in self.slack.calls]
+        self.assertEqual(urls, ['https://slack.com/api/files.getUploadURLExternal',
+                                'https://files.slack.com/upload/v1/abc',
+                                'https://slack.com/api/files.completeUploadExternal'])
+        self.assertEqual(self.slack.calls[0][1]['data'], {'filename': 'x.jpg', 'length': 5})
+        self.assertEqual(self.slack.uploaded, (5, b'abcde'))
+        complete = self.slack.calls[2][1]['data']
+        self.assertEqual(complete['channel_id'], 'C1')
+        self.assertEqual(json.loads(complete['files']), [{'id': 'F1', 'title': 'hi'}])
+        self.assertEqual(self.metrics.get('uploads.files'), 1)
+
+    def test_known_length_is_too_large(self):
+        with self.assertRaises(UploadTooLarge):
+            self.uploader.upload('C1', [b'x' * 11], 'x.jpg', length=11)
+        self.assertEqual(self.slack.calls, [])
+
+    def test_failed_upload(self):
+        self.slack.upload_status = 500
+        with self.assertRaises(DependencyUnavailable):
+            self.uploader.upload('C1', [b'abc'], 'x.jpg')
+        self.assertEqual(self.metrics.get('uploads.failures'), 1)
+
+    def test_failed_completion(self):
+        self.slack.complete_ok = False
+        with self.assertRaises(DependencyUnavailable) as ctx:
+            self.uploader.upload('C1', [b'abc'], 'x.jpg')
+        self.assertIn('channel_not_found', str(ctx.exception))
+
+    def test_relay_streams_with_content_length(self):
+        source = FakeResponse(headers={'Content-Length': '5', 'Content-Type': 'image/png'}, chunks=[b'ab', b'cde'])
+        self.uploader.relay('C1', source, 'x.png')
+        self.assertTrue(source.closed)
+        self.assertEqual(self.slack.uploaded, (5, b'abcde'))
+        self.assertEqual(self.slack.calls[1][1]['headers'], {'Content-Type': 'image/png'})
+
+    def test_relay_without_content_length(self):
+        source = FakeResponse(headers={'Content-Length': '3', 'Content-Encoding': 'gzip'}, chunks=[b'abcdef'])
+        self.uploader.relay('C1', source, 'x.png')
+        self.assertEqual(self.slack.uploaded, (6, b'abcdef'))
+
+    def test_relay_too_large(self):
+        source = FakeResponse(chunks=[b'x' * 6, b'x' * 6])
+        with self.assertRaises(UploadTooLarge):
+            self.uploader.relay('C1', source, 'x.png')
+        self.assertTrue(source.closed)
+        self.assertEqual(self.slack.calls, [])
+
+    def test_file_goes_out_under_the_upload_host_policy(self):
+        timeouts = {}
+
+        def post(url, timeout, **kwargs):
+            timeouts[url] = timeout
+            return self.slack.post(url, **kwargs)
+
+        http = ResilientClient(default_policy=HostPolicy(timeout=5), registry=self.metrics)
+        uploader = SlackUploader('xoxb', http=http, registry=self.metrics)
+        with mock.patch('sasha.resilience.requests.post', side_effect=post):
+            uploader.upload('C1', [b'abc'], 'x.jpg')
+        self.assertEqual(timeouts['https://files.slack.com/upload/v1/abc'], HOST_POLICIES['files.slack.com'].timeout)
+        self.assertGreater(HOST_POLICIES['files.slack.com'].timeout, 5)
+        self.assertEqual(timeouts['https://slack.com/api/files.getUploadURLExternal'], 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+"""Resilience tests"""
+import time
+import threading
+import unittest
+import requests
+from sasha.context import DeadlineExceeded, deadline_scope
+from sasha.hedging import HedgeBudget, Hedger
+from sasha.metrics import Metrics
+from sasha.resilience import BulkheadFullError, CircuitBreaker, CircuitOpenError, DependencyTimeoutError, \
+    HostPolicy, ResilientClient, friendly_failures
+
+
+class FakeResponse:
+    def __init__(self, status_code: int = 200):
+        self.status_code = status_code
+
+
+class TestResilientClient(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+        policy = HostPolicy(timeout=1, max_concurrent=1, queue_timeout=0.01, failure_threshold=2,
+                            reset_timeout=0.05)
+        self.client = ResilientClient(policies={}, default_policy=policy, registry=self.metrics)
+
+    @staticmethod
+    def _timeout(timeout):
+        raise requests.Timeout()
+
+    def test_breaker_opens_and_recovers(self):
+        for _ in range(2):
+            with self.assertRaises(DependencyTimeoutError):
+                self.client.call('eki.ee', self._timeout)
+        self.assertEqual(self.client.breakers['eki.ee'].state, CircuitBreaker.OPEN)
+        self.assertEqual(self.metrics.get('http.eki.ee.breaker'), 2)
+        with self.assertRaises(CircuitOpenError):
+            self.client.call('eki.ee', lambda timeout: FakeResponse())
+        time.sleep(0.06)
+        # Trial request goes through and closes the breaker
+        self.assertEqual(self.client.call('eki.ee', lambda timeout: FakeResponse()).status_code, 200)
+        self.assertEqual(self.metrics.get('http.eki.ee.breaker'), 0)
+
+    def test_trial_released_after_unexpected_error(self):
+        for _ in range(2):
+            with self.assertRaises(DependencyTimeoutError):
+                self.client.call('eki.ee', self._timeout)
+        time.sleep(0.06)
+
+        def broken(timeout):
+            raise ValueError('bad url')
+
+        # The trial request blew up before getting an answer - that says nothing about the host
+        with self.assertRaises(ValueError):
+            self.client.call('eki.ee', broken)
+        # ...so the next request gets to be the trial, instead of being turned away forever
+        self.assertEqual(self.client.call('eki.ee', lambda timeout: FakeResponse()).status_code, 200)
+        self.assertEqual(self.client.breakers['eki.ee'].state, CircuitBreaker.CLOSED)
+
+    def test_bulkhead_rejects_when_full(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow(timeout):
+            started.set()
+            release.wait(1)
+            return FakeResponse()
+
+        t = threading.Thread(target=self.client.call, args=('slow.site', slow))
+        t.start()
+        started.wait(1)
+        with self.assertRaises(BulkheadFullError):
+            self.client.call('slow.site', lambda timeout: FakeResponse())
+        # Other hosts are unaffected
+        self.assertEqual(self.client.call('fast.site', lambda timeout: FakeResponse()).status_code, 200)
+        release.set()
+        t.join()
+        self.assertEqual(self.metrics.get('http.slow.site.rejected_full'), 1)
+
+    def test_deadline_caps_timeout(self):
+        timeouts = []
+
+        def record(timeout):
+            timeouts.append(timeout)
+            return FakeResponse()
+
+        with deadline_scope(0.5):
+            self.client.call('eki.ee', record)
+        self.assertLessEqual(timeouts[0], 0.5)
+        with deadline_scope(0.2):
+            with self.assertRaises(DeadlineExceeded):
+                self.client.call('eki.ee', self._timeout)
+        # Running out of budget isn't the host's fault
+        self.assertEqual(self.client.breakers['eki.ee'].state, CircuitBreaker.CLOSED)
+        with deadline_scope(10, started_at=time.time() - 11):
+            with self.assertRaises(DeadlineExceeded):
+                self.client.call('eki.ee', record)
+        self.assertEqual(len(timeouts), 1)
+
+    def test_friendly_failures(self):
+        @friendly_failures
+        def cmd():
+            raise CircuitOpenError('www.eki.ee')
+        self.assertIn('`www.eki.ee`', cmd())
+
+    def test_friendly_failures_in_parts(self):
+        @friendly_failures
+        def cmd():
+            yield 'first entry'
+            raise CircuitOpenError('www.etymonline.com')
+        parts = list(cmd())
+        self.assertEqual(parts[0], 'first entry')
+        self.assertIn('`www.etymonline.com`', parts[1])
+        self.assertTrue(parts[1].startswith('\n'))
+
+        @friendly_failures
+        def nothing_yet():
+            raise CircuitOpenError('www.etymonline.com')
+            yield 'never'
+        self.assertFalse(list(nothing_yet())[0].startswith('\n'))
+
+
+class TestHedger(unittest.TestCase):
+
+    def test_slow_first_attempt_is_hedged(self):
+        metrics = Metrics()
+        hedger = Hedger(default_delay=0.05, budget=HedgeBudget(ratio=1), registry=metrics)
+        attempts = []
+        lock = threading.Lock()
+
+        def lookup():
+            with lock:
+                attempts.append(1)
+                n = len(attempts)
+            # The first attempt hangs, the backup answers quickly
+            time.sleep(1 if n == 1 else 0.01)
+            return n
+
+        start = time.monotonic()
+        self.assertEqual(hedger.run('eki.ee', lookup), 2)
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(metrics.get('hedge.eki.ee.hedge_rate'), 1)
+        self.assertEqual(metrics.get('hedge.eki.ee.win_rate'), 1)
+
+    def test_budget_caps_hedges(self):
+        metrics = Metrics()
+        hedger = Hedger(default_delay=0.01, min_delay=0.01, budget=HedgeBudget(ratio=0.25), registry=metrics)
+        for _ in range(10):
+            hedger.run('eki.ee', lambda: time.sleep(0.03))
+        self.assertEqual(metrics.get('hedge.eki.ee.hedged'), 2)
+
+
+    def test_runs_inline_without_budget(self):
+        metrics = Metrics()
+        hedger = Hedger(budget=HedgeBudget(ratio=0), registry=metrics)
+        # No hedge could be sent, so there's no reason to hand the call to the pool
+        self.assertEqual(hedger.run('eki.ee', lambda: threading.current_thread()), threading.current_thread())
+        self.assertEqual(metrics.get('hedge.eki.ee.hedged'), 0)
+
+    def test_wait_is_bounded(self):
+        metrics = Metrics()
+        hedger = Hedger(default_delay=0.02, budget=HedgeBudget(ratio=1), max_wait=0.1, registry=metrics)
+        start = time.monotonic()
+        with self.assertRaises(DependencyTimeoutError):
+            hedger.run('eki.ee', lambda: time.sleep(1))
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(metrics.get('hedge.eki.ee.timeouts'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
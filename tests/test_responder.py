@@ -0,0 +1,69 @@
+"""Response url tests"""
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from sasha.metrics import Metrics
+from sasha.responder import Responder, response_body
+from sasha.work import WorkScheduler
+
+
+class _Handler(BaseHTTPRequestHandler):
+    received = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.received.append(json.loads(body))
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class TestResponder(unittest.TestCase):
+
+    def setUp(self):
+        _Handler.received = []
+        self.server = HTTPServer(('127.0.0.1', 0), _Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}/response'
+        self.metrics = Metrics()
+        self.work = WorkScheduler('test', max_workers=2, registry=self.metrics)
+        self.responder = Responder(self.work, registry=self.metrics)
+        self.responder.session.mount('http://', self.responder.session.get_adapter('https://'))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.work.shutdown()
+
+    def test_each_block_id_responds_once(self):
+        first = self.responder.respond(self.url, {'text': 'Thanks!'}, key='B1')
+        self.assertIsNone(self.responder.respond(self.url, {'text': 'Thanks!'}, key='B1'))
+        self.assertEqual(first.result(5).status_code, 200)
+        self.responder.respond(self.url, {'text': 'Another'}, key='B2').result(5)
+        self.assertEqual(_Handler.received, [{'text': 'Thanks!'}, {'text': 'Another'}])
+        self.assertEqual(self.metrics.get('responder.duplicates'), 1)
+        self.assertEqual(self.metrics.get('responder.sent'), 2)
+
+
+    def test_urgent_responses_skip_the_work_queue(self):
+        self.work.shutdown()
+        resp = self.responder.respond_urgently(self.url, {'text': 'Too busy'}).result(5)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(_Handler.received, [{'text': 'Too busy'}])
+
+
+class TestResponseBody(unittest.TestCase):
+
+    def test_text_and_blocks(self):
+        self.assertEqual(response_body('hi'), {'response_type': 'in_channel', 'text': 'hi'})
+        blocks = [{'type': 'divider'}]
+        self.assertEqual(response_body(blocks, 'ephemeral'),
+                         {'response_type': 'ephemeral', 'text': '', 'blocks': blocks})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+"""Scheduler tests"""
+import time
+import unittest
+from sasha.metrics import Metrics
+from sasha.scheduler import Scheduler
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        # Driven by hand with run_pending, no background thread
+        self.scheduler = Scheduler(registry=Metrics(), clock=self.clock)
+
+    def _advance(self, seconds: float, step: float = 0.01):
+        """Moves the clock forward, running whatever comes due along the way"""
+        end = self.clock.now + seconds
+        while self.clock.now < end - 1e-9:
+            self.clock.now = min(end, self.clock.now + step)
+            self.scheduler.run_pending()
+
+    def test_periodic_job(self):
+        runs = []
+        self.scheduler.add_job('tick', lambda: runs.append(1), interval=0.02)
+        self._advance(0.15)
+        self.assertEqual(len(runs), 7)
+
+    def test_flushes_only_when_pending(self):
+        items = []
+        flushes = []
+
+        def flush():
+            flushes.append(list(items))
+            items.clear()
+
+        self.scheduler.add_job('digest', flush, interval=0.01, pending=lambda: len(items),
+                               min_delay=0.05, max_delay=1)
+        self._advance(0.1)
+        self.assertEqual(flushes, [])
+        items.extend(['a', 'b'])
+        self._advance(0.02)
+        # Still inside min_delay
+        self.assertEqual(flushes, [])
+        self._advance(0.1)
+        self.assertEqual(flushes, [['a', 'b']])
+
+    def test_max_delay_caps_wait(self):
+        items = []
+        flushes = []
+        self.scheduler.add_job('digest', lambda: flushes.append(items.copy()) or items.clear(), interval=0.01,
+                               pending=lambda: len(items), min_delay=0.05, max_delay=0.1)
+        # Keep the count changing so min_delay never settles
+        for i in range(15):
+            items.append(i)
+            self._advance(0.01)
+        self.assertEqual(len(flushes), 1)
+
+    def test_trigger_skips_delays(self):
+        items = ['a']
+        flushes = []
+        self.scheduler.add_job('digest', lambda: flushes.append(1) or items.clear(), interval=10,
+                               pending=lambda: len(items), min_delay=10)
+        self.scheduler.trigger('digest')
+        self.scheduler.run_pending()
+        self.assertEqual(flushes, [1])
+
+    def test_trigger_during_run_is_kept(self):
+        items = ['a']
+        flushes = []
+
+        def flush():
+            flushes.append(list(items))
+            items.clear()
+            if len(flushes) == 1:
+                # More comes in and someone asks for it to go out while we're still flushing
+                items.append('b')
+                self.scheduler.trigger('digest')
+
+        self.scheduler.add_job('digest', flush, interval=10, pending=lambda: len(items), min_delay=10)
+        self.scheduler.trigger('digest')
+        self.scheduler.run_pending()
+        self.assertEqual(flushes, [['a'], ['b']])
+
+    def test_background_thread(self):
+        scheduler = Scheduler(registry=Metrics())
+        runs = []
+        scheduler.add_job('tick', lambda: runs.append(1), interval=0.01)
+        scheduler.start()
+        try:
+            deadline = time.monotonic() + 5
+            while len(runs) == 0 and time.monotonic() < deadline:
+                time.sleep(0.01)
+        finally:
+            scheduler.stop()
+        self.assertGreater(len(runs), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+"""Staged startup tests"""
+import threading
+import unittest
+from sasha.metrics import Metrics
+from sasha.startup import Startup
+
+
+class TestStartup(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+        self.startup = Startup(max_deferred=2, max_backoff=0.01, registry=self.metrics)
+
+    def test_events_are_held_until_ready(self):
+        handled = []
+        connected = threading.Event()
+        self.startup.add_stage('connect', connected.wait, critical=True)
+        handle = self.startup.defer_until_ready(handled.append)
+        self.startup.start()
+        handle('early')
+        self.assertFalse(self.startup.ready.is_set())
+        self.assertEqual(handled, [])
+        connected.set()
+        self.assertTrue(self.startup.ready.wait(1))
+        # Ready's only published once the held events have been handled
+        self.assertEqual(handled, ['early'])
+        handle('late')
+        self.assertEqual(handled, ['early', 'late'])
+
+    def test_events_during_replay_keep_their_order(self):
+        handled = []
+
+        def handle_event(x):
+            handled.append(x)
+            if x == 0:
+                # Comes in while the held events are being handled
+                handle(2)
+
+        handle = self.startup.defer_until_ready(handle_event)
+        handle(0)
+        handle(1)
+        self.startup.run()
+        self.assertEqual(handled, [0, 1, 2])
+
+    def test_events_held_until_their_stage_has_run(self):
+        handled = []
+        directory = {}
+        self.startup.add_stage('connect', lambda: None, critical=True)
+        self.startup.add_stage('directory', lambda: directory.update({'U1': 'Ava'}))
+        self.startup.add_stage('broken', lambda: 1 / 0)
+        handle = self.startup.defer_until_stage('directory')(lambda uid: handled.append(directory.get(uid)))
+        handle_broken = self.startup.defer_until_stage('broken')(handled.append)
+        handle('U1')
+        handle_broken('anyway')
+        self.startup.run()
+        self.assertEqual(handled, ['Ava', 'anyway'])
+
+    def test_critical_stages_dont_wait_on_slow_ones(self):
+        loaded = threading.Event()
+        started = threading.Event()
+        self.startup.add_stage('connect', lambda: None, critical=True)
+        self.startup.add_stage('directory', loaded.wait)
+        self.startup.add_stage('scheduler', started.set, critical=True)
+        self.startup.start()
+        self.assertTrue(started.wait(1))
+        self.assertTrue(self.startup.ready.wait(1))
+        self.assertTrue(self.startup.is_open('ready'))
+        self.assertFalse(self.startup.is_open('directory'))
+        loaded.set()
+        self.startup._thread.join(1)
+        self.assertTrue(self.startup.is_open('directory'))
+
+    def test_oldest_deferred_events_get_dropped(self):
+        handled = []
+        handle = self.startup.defer_until_ready(handled.append)
+        for i in range(3):
+            handle(i)
+        self.startup.run()
+        self.assertEqual(handled, [1, 2])
+        self.assertEqual(self.metrics.get('startup.deferred_dropped'), 1)
+
+    def test_critical_stages_retry_and_others_fail_alone(self):
+        attempts = []
+
+        def flaky_connect():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise ConnectionError('slack is down')
+
+        def broken_announce():
+            raise ValueError('no channel')
+
+        self.startup.add_stage('announce', broken_announce)
+        self.startup.add_stage('connect', flaky_connect, critical=True)
+        self.startup.add_stage('help', lambda: None)
+        self.startup.run()
+        status = self.startup.status()
+        self.assertTrue(self.startup.ready.is_set())
+        self.assertEqual(status['connect']['attempts'], 3)
+        self.assertEqual(status['announce']['state'], 'failed')
+        self.assertEqual(status['help']['state'], 'done')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+"""State checkpoint tests"""
+import os
+import time
+import tempfile
+import unittest
+from sasha.accumulators import DictAccumulator
+from sasha.metrics import Metrics
+from sasha.profile_diff import ProfileDiffer
+from sasha.state import StateStore
+
+
+class TestStateStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'state.json.gz')
+        self.metrics = Metrics()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _store(self, **kwargs) -> StateStore:
+        return StateStore(self.path, registry=self.metrics, **kwargs)
+
+    def test_round_trip(self):
+        now = time.time()
+        emojis = DictAccumulator(merge=min, items={'party-parrot': now - 5, 'blob': now})
+        store = self._store()
+        store.register('emojis', dump=lambda: {k: (v, v) for k, v in emojis.snapshot().items()},
+                       restore=emojis.requeue)
+        self.assertEqual(store.checkpoint(), 2)
+        self.assertFalse(os.path.exists(f'{self.path}.tmp'))
+
+        restored = DictAccumulator(merge=min)
+        store = self._store()
+        store.register('emojis', dump=lambda: {}, restore=restored.requeue)
+        self.assertEqual(store.restore(), 2)
+        self.assertEqual(set(restored.swap()), {'party-parrot', 'blob'})
+
+    def test_entries_age_from_first_sighting(self):
+        # Checkpointed over and over, an entry still expires max_age after it was first seen
+        emojis = DictAccumulator(merge=min, items={'blob': time.time() - 7200})
+        emojis.put('blob', time.time())
+        store = self._store(max_age=3600)
+        store.register('emojis', dump=lambda: {k: (v, v) for k, v in emojis.snapshot().items()},
+                       restore=lambda entries: None)
+        self.assertEqual(store.checkpoint(), 0)
+
+    def test_old_entries_are_dropped(self):
+        now = time.time()
+        limits = {'old': (now - 7200, 1), 'new': (now - 10, 2)}
+        store = self._store(max_age=3600)
+        store.register('limits', dump=lambda: limits, restore=lambda entries: None)
+        self.assertEqual(store.checkpoint(), 1)
+        self.assertEqual(store.load(), {'limits': {'new': 2}})
+
+    def test_unusable_file_starts_fresh(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'not gzip')
+        store = self._store()
+        store.register('emojis', dump=lambda: {}, restore=lambda entries: self.fail('nothing to restore'))
+        self.assertEqual(store.restore(), 0)
+        self.assertEqual(self.metrics.get('state.load_errors'), 1)
+
+    def test_pending_profile_changes_survive(self):
+        old = {'id': 'U1', 'display_name': 'b', 'status_emoji': ''}
+        new = {'id': 'U1', 'display_name': 'b', 'status_emoji': ':coffee:'}
+        differ = ProfileDiffer(registry=self.metrics)
+        differ.observe('U1', old, new)
+        store = self._store()
+        store.register('profile_updates', dump=differ.dump_state, restore=differ.restore_state)
+        store.checkpoint()
+
+        differ = ProfileDiffer(registry=self.metrics)
+        store = self._store()
+        store.register('profile_updates', dump=differ.dump_state, restore=differ.restore_state)
+        store.restore()
+        changes = differ.take()
+        self.assertEqual(changes['U1']['old']['status_emoji'], '')
+        self.assertEqual(changes['U1']['new']['status_emoji'], ':coffee:')
+        # The restored change is the baseline for later events
+        self.assertFalse(differ.observe('U1', old, new))
+
+
+if __name__ == '__main__':
+    unittest.main()
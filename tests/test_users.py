@@ -0,0 +1,75 @@
+"""User directory tests"""
+import gc
+import os
+import tracemalloc
+import unittest
+from sasha.users import UserDirectory, UserRecord
+
+
+def synthetic_users(n: int):
+    """Cleaned user info dicts, shaped roughly like what get_channel_members returns.
+    Every string is built fresh, like it would be when decoding an API response."""
+    statuses = [(':coffee:', 'brb'), (':palm_tree:', 'on vacation'), ('', ''), (':house:', 'wfh')]
+    for i in range(n):
+        emoji, text = statuses[i % len(statuses)]
+        yield {
+            'id': f'U{i:08d}', 'name': f'user{i}', 'real_name': f'User Number {i}', 'display_name': f'user{i}',
+            'avi': f'https://avatars.slack-edge.com/2020-01-01/{i}_512.png',
+            'title': ''.join(['Engineer', 'Designer'][i % 2]), 'status_emoji': ''.join(emoji),
+            'status_text': ''.join(text), 'tz': ''.join('Europe/Tallinn'), 'tz_label': ''.join('EET'),
+            'is_admin': False, 'is_bot': False, 'phone': '', 'email': f'user{i}@example.com',
+        }
+
+
+def measure(func) -> int:
+    """Bytes still allocated by what func builds"""
+    gc.collect()
+    tracemalloc.start()
+    obj = func()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del obj
+    return size
+
+
+class TestUserRecord(unittest.TestCase):
+
+    def test_keeps_only_reported_fields(self):
+        rec = UserRecord.from_dict(next(synthetic_users(1)))
+        self.assertEqual(rec['id'], 'U00000000')
+        self.assertEqual(rec['title'], 'Engineer')
+        self.assertIsNone(rec.get('email'))
+        with self.assertRaises(KeyError):
+            _ = rec['tz']
+
+    def test_replace_and_equality(self):
+        rec = UserRecord.from_dict(next(synthetic_users(1)))
+        self.assertEqual(rec, rec.replace())
+        self.assertNotEqual(rec, rec.replace(status_text='lunch'))
+        self.assertEqual(rec.replace(status_text='lunch').to_dict()['status_text'], 'lunch')
+
+    def test_strings_are_interned(self):
+        a = UserRecord.from_dict(next(synthetic_users(1)))
+        b = UserRecord.from_dict(list(synthetic_users(5))[4])
+        self.assertIs(a.status_emoji, b.status_emoji)
+        self.assertIs(a.title, b.title)
+
+
+class TestUserDirectoryMemory(unittest.TestCase):
+
+    def _compare(self, n: int):
+        as_dicts = measure(lambda: {x['id']: x for x in synthetic_users(n)})
+        as_records = measure(lambda: UserDirectory(synthetic_users(n)))
+        self.assertLess(as_records, as_dicts / 2, f'{n} users: dicts {as_dicts / 1024 / 1024:.1f} MiB, '
+                                                  f'records {as_records / 1024 / 1024:.1f} MiB')
+
+    def test_10k_users(self):
+        self._compare(10000)
+
+    @unittest.skipUnless(os.environ.get('SASHA_BENCHMARKS') == '1', 'slow - set SASHA_BENCHMARKS=1 to run')
+    def test_100k_users(self):
+        self._compare(100000)
+
+
+if __name__ == '__main__':
+    unittest.main()
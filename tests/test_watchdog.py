@@ -0,0 +1,86 @@
+"""Latency watchdog tests"""
+import time
+import threading
+import unittest
+from concurrent.futures import Future
+from sasha.metrics import Metrics
+from sasha.watchdog import LatencyWatchdog
+from sasha.work import INTERACTIVE, WorkShed
+
+
+class TestLatencyWatchdog(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+        self.watchdog = LatencyWatchdog(threshold=0.05, registry=self.metrics)
+        self.posted = []
+
+    def _post(self):
+        self.posted.append(time.monotonic())
+        return 'placeholder-ts'
+
+    def test_quick_work_posts_nothing(self):
+        watch = self.watchdog.watch(self._post)
+        self.assertIsNone(watch.finish())
+        time.sleep(0.1)
+        self.assertEqual(self.posted, [])
+        self.assertEqual(self.metrics.get('watchdog.slow'), 0)
+
+    def test_slow_work_gets_placeholder(self):
+        watch = self.watchdog.watch(self._post)
+        time.sleep(0.15)
+        self.assertEqual(watch.finish(), 'placeholder-ts')
+        self.assertEqual(len(self.posted), 1)
+        self.assertEqual(self.metrics.get('watchdog.slow'), 1)
+
+    def test_finish_waits_for_placeholder_in_flight(self):
+        def slow_post():
+            time.sleep(0.1)
+            return 'ts'
+
+        watch = self.watchdog.watch(slow_post, threshold=0.01)
+        time.sleep(0.05)
+        self.assertEqual(watch.finish(), 'ts')
+
+    def test_late_placeholder_gets_cleaned_up(self):
+        posted = threading.Event()
+        late = []
+
+        def slow_post():
+            posted.wait(1)
+            return 'ts'
+
+        watch = self.watchdog.watch(slow_post, threshold=0.01, on_late=late.append)
+        time.sleep(0.05)
+        self.assertIsNone(watch.finish(timeout=0.01))
+        posted.set()
+        time.sleep(0.05)
+        self.assertEqual(late, ['ts'])
+        self.assertEqual(watch.state, 'abandoned')
+
+    def test_dropped_placeholder_is_not_waited_on(self):
+        def shed(func):
+            future = Future()
+            future.set_exception(WorkShed(INTERACTIVE))
+            return future
+
+        watchdog = LatencyWatchdog(threshold=0.01, run_func=shed, registry=self.metrics)
+        watch = watchdog.watch(self._post)
+        time.sleep(0.05)
+        start = time.monotonic()
+        self.assertIsNone(watch.finish())
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(self.metrics.get('watchdog.dropped'), 1)
+
+    def test_failed_placeholder_falls_back(self):
+        def broken():
+            raise ConnectionError()
+
+        watch = self.watchdog.watch(broken, threshold=0.01)
+        time.sleep(0.05)
+        self.assertIsNone(watch.finish())
+        self.assertEqual(self.metrics.get('watchdog.errors'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
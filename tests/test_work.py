@@ -0,0 +1,55 @@
+"""Priority work scheduler tests"""
+import threading
+import unittest
+from sasha.executor import KeyedExecutor
+from sasha.metrics import Metrics
+from sasha.work import COSMETIC, DIGEST, INTERACTIVE, MODERATION, WorkScheduler, WorkShed
+
+
+class TestWorkScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+        self.work = WorkScheduler('test', max_workers=1, max_pending=10, registry=self.metrics)
+        # Keep the only worker busy so work piles up
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.work.submit(lambda: (self.started.set(), self.release.wait(5)))
+        self.started.wait(1)
+
+    def tearDown(self):
+        self.release.set()
+        self.work.shutdown()
+
+    def test_most_important_runs_first(self):
+        order = []
+        futures = [self.work.submit(order.append, p, priority=p) for p in [COSMETIC, DIGEST, INTERACTIVE, MODERATION]]
+        self.release.set()
+        for f in futures:
+            f.result(1)
+        self.assertEqual(order, [INTERACTIVE, MODERATION, DIGEST, COSMETIC])
+
+    def test_cosmetic_work_is_shed_first(self):
+        cosmetic = [self.work.submit(lambda: None, priority=COSMETIC) for _ in range(4)]
+        # Only 30% of the queue is open to cosmetic work
+        self.assertIsInstance(cosmetic[-1].exception(0), WorkShed)
+        self.assertEqual(self.metrics.get('work.test.shed.cosmetic'), 1)
+        interactive = [self.work.submit(lambda: None) for _ in range(10)]
+        # Interactive work pushed the remaining cosmetic work out
+        self.assertTrue(all(isinstance(f.exception(0), WorkShed) for f in cosmetic))
+        self.release.set()
+        for f in interactive:
+            f.result(1)
+
+    def test_shed_work_doesnt_stall_keyed_executor(self):
+        executor = KeyedExecutor('keyed', pool=self.work, max_queue=50, registry=self.metrics)
+        for _ in range(3):
+            self.work.submit(lambda: None, priority=COSMETIC)
+        shed = [executor.submit('C1', lambda: None, priority=COSMETIC) for _ in range(5)]
+        self.assertTrue(all(isinstance(f.exception(0), WorkShed) for f in shed))
+        self.release.set()
+        self.assertEqual(executor.submit('C1', lambda: 'ok').result(1), 'ok')
+
+
+if __name__ == '__main__':
+    unittest.main()